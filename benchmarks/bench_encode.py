@@ -0,0 +1,81 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+# compares encoding throughput of a single encoder pipe against segmented
+# encoding with several encoder processes
+#
+# frames are synthetic, a moving gradient with noise so that the encoder has
+# some motion and detail to work on. the frame count of every output is
+# checked against what was written
+#
+# usage: python2 benchmarks/bench_encode.py [-n FRAMES] [-vs WxH]
+#                                           [-p PRESET] [-e 1,2,4]
+
+import argparse
+import os
+import time
+import numpy as np
+from butterflow.settings import default as settings
+from butterflow import avinfo
+from butterflow.encoders import encoder_call, PipeEncoder, SegmentedEncoder
+
+
+def mk_frames(n, w, h):
+    np.random.seed(0)
+    x = np.linspace(0, 255, w).astype(np.float32)
+    frs = []
+    for i in range(n):
+        ramp = np.roll(x, i * 4)[np.newaxis,:,np.newaxis]
+        noise = np.random.rand(h, w, 3) * 32
+        frs.append(np.uint8(np.clip(ramp + noise, 0, 255)))
+    return frs
+
+
+def encode(encoder, frs, n):
+    t = time.time()
+    for i in range(n):
+        encoder.write(frs[i % len(frs)])
+    encoder.close()
+    return time.time() - t
+
+
+def main():
+    par = argparse.ArgumentParser()
+    par.add_argument('-n', '--frames', type=int, default=600)
+    par.add_argument('-vs', '--video-size', default='1280x720')
+    par.add_argument('-p', '--preset', default=settings['preset'])
+    par.add_argument('-e', '--encoders', default='1,2,4')
+    args = par.parse_args()
+    w, h = [int(x) for x in args.video_size.split('x')]
+    settings['preset'] = args.preset
+
+    frs = mk_frames(min(args.frames, 120), w, h)
+    dest = os.path.join(settings['tempdir'], 'bench_encode.{}.{}'.format(
+        os.getpid(), settings['v_container']))
+    mk_call = lambda dest, gop=None: encoder_call(dest, w, h, 30, False,
+                                                  gop=gop)
+
+    print('{}x{}, {} frames, preset={}'.format(w, h, args.frames,
+                                                args.preset))
+    print('{:<16}{:>10}{:>10}{:>10}'.format('mode', 'secs', 'fps', 'frames'))
+    base = None
+    for n in [int(x) for x in args.encoders.split(',')]:
+        if n == 1:
+            name = 'pipe'
+            encoder = PipeEncoder(mk_call(dest))
+        else:
+            name = 'segmented x{}'.format(n)
+            encoder = SegmentedEncoder(dest, mk_call, n, 'bench')
+        secs = encode(encoder, frs, args.frames)
+        frames = avinfo.get_av_info(dest)['frames']
+        os.remove(dest)
+        line = '{:<16}{:>10.2f}{:>10.1f}{:>10}'.format(
+            name, secs, args.frames / secs, frames)
+        if base is None:
+            base = secs
+        else:
+            line += '{:>10.2f}x'.format(base / secs)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
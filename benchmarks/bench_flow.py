@@ -0,0 +1,104 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+# compares the speed and quality of the optical flow backends
+#
+# quality is measured two ways: the average endpoint error against a known
+# global shift of a synthetic texture, and the photometric error left after
+# warping the second frame back onto the first with the estimated flow. pass
+# a video to also measure the photometric error on its first frame pair
+#
+# usage: python2 benchmarks/bench_flow.py [-n RUNS] [-vs WxH] [video]
+
+import argparse
+import os
+import timeit
+import cv2
+import numpy as np
+from butterflow.settings import default as settings
+from butterflow import ocl, flow
+
+
+def mk_shifted_pair(w, h, dx, dy):
+    np.random.seed(0)
+    noise = np.float32(np.random.rand(h, w) * 255)
+    noise = cv2.GaussianBlur(noise, (0, 0), 2)
+    fr_1 = np.uint8(cv2.normalize(noise, None, 0, 255, cv2.NORM_MINMAX))
+    m = np.float32([[1, 0, dx], [0, 1, dy]])
+    fr_2 = cv2.warpAffine(fr_1, m, (w, h), borderMode=cv2.BORDER_REFLECT)
+    return fr_1, fr_2
+
+
+def video_pair(path, w, h):
+    capture = cv2.VideoCapture(path)
+    frs = []
+    for i in range(2):
+        success, fr = capture.read()
+        if not success:
+            raise RuntimeError('Could not read 2 frames from {}'.format(path))
+        fr = cv2.resize(fr, (w, h))
+        frs.append(cv2.cvtColor(fr, cv2.COLOR_BGR2GRAY))
+    capture.release()
+    return frs
+
+
+def endpoint_error(u, v, dx, dy, border=20):
+    u = u[border:-border,border:-border]
+    v = v[border:-border,border:-border]
+    return np.mean(np.sqrt((u-dx)**2 + (v-dy)**2))
+
+
+def main():
+    par = argparse.ArgumentParser()
+    par.add_argument('video', nargs='?', default=None)
+    par.add_argument('-n', '--runs', type=int, default=5)
+    par.add_argument('-vs', '--video-size', default='1280x720')
+    args = par.parse_args()
+    w, h = [int(x) for x in args.video_size.split('x')]
+    ocl.set_cache_path(settings['clbdir'] + os.sep)
+
+    backends = []
+    for name in flow.available_backends():
+        if name == 'farneback':
+            backends.append(('farneback (sw)',
+                             flow.get_backend(name, use_ocl=False)))
+            backends.append(('farneback (ocl)',
+                             flow.get_backend(name, use_ocl=True)))
+        else:
+            backends.append((name, flow.get_backend(name)))
+
+    shifts = [(2.5, -1.5), (12, 7)]
+    pairs = [mk_shifted_pair(w, h, dx, dy) for dx, dy in shifts]
+    if args.video:
+        pairs.append(video_pair(args.video, w, h))
+
+    print('{}x{}, best of {} runs'.format(w, h, args.runs))
+    header = '{:<18}{:>10}'.format('method', 'ms/flow')
+    for dx, dy in shifts:
+        header += '{:>14}'.format('epe({},{})'.format(dx, dy))
+    header += '{:>12}'.format('photo err')
+    if args.video:
+        header += '{:>12}'.format('video err')
+    print(header)
+
+    for name, backend in backends:
+        fr_1, fr_2 = pairs[0]
+        backend.compute(fr_1, fr_2)  # warm up, builds ocl kernels
+        secs = min(timeit.repeat(lambda: backend.compute(fr_1, fr_2),
+                                 repeat=args.runs, number=1))
+        line = '{:<18}{:>10.1f}'.format(name, secs * 1000)
+        photo_errs = []
+        for (dx, dy), (fr_1, fr_2) in zip(shifts, pairs):
+            u, v = backend.compute(fr_1, fr_2)
+            line += '{:>14.3f}'.format(endpoint_error(u, v, dx, dy))
+            photo_errs.append(flow.photometric_error(fr_1, fr_2, u, v))
+        line += '{:>12.3f}'.format(np.mean(photo_errs))
+        if args.video:
+            fr_1, fr_2 = pairs[-1]
+            u, v = backend.compute(fr_1, fr_2)
+            line += '{:>12.3f}'.format(
+                flow.photometric_error(fr_1, fr_2, u, v))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+# compares the memory used to interpolate frame pairs when frames are handed
+# to the interpolator as uint8, and normalized on the device, against
+# converting them to float32 on the host first
+#
+# every mode runs in its own process so that its peak resident set size can
+# be measured. host temporaries are the float32 frames made for each pair
+#
+# usage: python2 benchmarks/bench_memory.py [-n PAIRS] [-vs WxH] [-sw]
+
+import argparse
+import os
+import sys
+import time
+import resource
+import multiprocessing
+import numpy as np
+from butterflow.settings import default as settings
+from butterflow import ocl, motion
+from butterflow.interpolate import vec_interpolate_flow
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss / 1024.0**2  # bytes
+    return rss / 1024.0  # kilobytes
+
+
+def run(mode, n, w, h, sw, queue):
+    if not sw:
+        ocl.set_cache_path(settings['clbdir'] + os.sep)
+    interpolate_fn = vec_interpolate_flow if sw else \
+        motion.ocl_interpolate_flow
+    np.random.seed(0)
+    frs = [np.array(np.random.rand(h, w, 3) * 255, dtype=np.uint8)
+           for x in range(2)]
+    flows = [np.float32(np.random.rand(h, w) * 4 - 2) for x in range(4)]
+    base = peak_rss_mb()
+    temp_bytes = 0
+    t = time.time()
+    for i in range(n):
+        fr_1, fr_2 = frs[i % 2], frs[(i+1) % 2]
+        if mode == 'float32':
+            fr_1 = np.float32(fr_1) * 1/255.0
+            fr_2 = np.float32(fr_2) * 1/255.0
+            temp_bytes += fr_1.nbytes + fr_2.nbytes
+        interpolate_fn(fr_1, fr_2, flows[0], flows[1], flows[2], flows[3], 1)
+    secs = time.time() - t
+    queue.put((peak_rss_mb() - base, temp_bytes / n / 1024.0**2, secs / n))
+
+
+def main():
+    par = argparse.ArgumentParser()
+    par.add_argument('-n', '--pairs', type=int, default=20)
+    par.add_argument('-vs', '--video-size', default='3840x2160')
+    par.add_argument('-sw', action='store_true',
+                     help='measure the cpu interpolator instead of OpenCL')
+    args = par.parse_args()
+    w, h = [int(x) for x in args.video_size.split('x')]
+
+    print('{}x{}, {} pairs, {}'.format(w, h, args.pairs,
+                                        'cpu' if args.sw else 'opencl'))
+    print('{:<10}{:>18}{:>22}{:>12}'.format(
+          'frames', 'peak rss +MB', 'host temps MB/pair', 'ms/pair'))
+    for mode in ['float32', 'uint8']:
+        queue = multiprocessing.Queue()
+        p = multiprocessing.Process(target=run, args=(mode, args.pairs, w, h,
+                                                      args.sw, queue))
+        p.start()
+        rss, temps, secs = queue.get()
+        p.join()
+        print('{:<10}{:>18.1f}{:>22.1f}{:>12.1f}'.format(mode, rss, temps,
+                                                        secs * 1000))
+
+
+if __name__ == '__main__':
+    main()
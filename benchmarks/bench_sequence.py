@@ -0,0 +1,70 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+# measures how building a VideoSequence scales with the number of subregions,
+# adding them one at a time in a random order and all at once, and checking
+# the result for overlapping subregions
+#
+# subregions are evenly spaced over a 10 minute, 60 fps video with a gap
+# after each one, so every one of them splits a skip subregion. with more
+# subregions than frames some share frames and are reported as overlapping,
+# and the check stops at the first of them
+#
+# usage: python2 benchmarks/bench_sequence.py [-n 100,1000,10000]
+
+import argparse
+import random
+import time
+from butterflow.sequence import VideoSequence, Subregion
+
+duration = 10 * 60 * 1000.0
+frames = 10 * 60 * 60
+
+
+def mk_subs(n):
+    step = duration / n
+    subs = []
+    for i in range(n):
+        sub = Subregion(i * step, i * step + step / 2)
+        sub.target_spd = 0.5
+        subs.append(sub)
+    random.seed(0)
+    random.shuffle(subs)
+    return subs
+
+
+def one_at_a_time(subs):
+    seq = VideoSequence(duration, frames)
+    for sub in subs:
+        seq.add_subregion(sub)
+    return seq
+
+
+def all_at_once(subs):
+    return VideoSequence.from_subregions(duration, frames, subs)
+
+
+def timed(fn, *args):
+    t = time.time()
+    x = fn(*args)
+    return x, time.time() - t
+
+
+def main():
+    par = argparse.ArgumentParser()
+    par.add_argument('-n', '--subregions', default='100,1000,10000')
+    args = par.parse_args()
+
+    print('{:>10}{:>14}{:>14}{:>14}{:>12}'.format(
+          'subs', 'add ms', 'bulk ms', 'overlap ms', 'us/sub'))
+    for n in [int(x) for x in args.subregions.split(',')]:
+        seq, add_secs = timed(one_at_a_time, mk_subs(n))
+        bulk, bulk_secs = timed(all_at_once, mk_subs(n))
+        assert len(seq.subregions) == len(bulk.subregions) == n * 2
+        overlap, overlap_secs = timed(seq.first_overlap)
+        print('{:>10}{:>14.1f}{:>14.1f}{:>14.1f}{:>12.1f}'.format(
+              n, add_secs * 1000, bulk_secs * 1000, overlap_secs * 1000,
+              add_secs * 1e6 / n))
+
+
+if __name__ == '__main__':
+    main()
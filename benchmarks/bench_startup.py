@@ -0,0 +1,78 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+# measures how long butterflow takes to start for commands that don't render,
+# and which heavy modules each of them imports
+#
+# every command runs in a fresh interpreter, as it would from a shell, and
+# the median of the runs is reported. pass a video to also time `--probe`
+#
+# usage: python2 benchmarks/bench_startup.py [-n RUNS] [video]
+
+import argparse
+import subprocess
+import sys
+import time
+
+heavy = ['cv2', 'numpy', 'butterflow.ocl', 'butterflow.motion',
+         'butterflow.avinfo']
+
+script = '''
+import sys
+sys.argv = ['butterflow'] + {argv!r}
+if {argv!r}:
+    from butterflow.cli import main
+    try:
+        main()
+    except SystemExit:  # -h
+        pass
+else:
+    import butterflow.settings
+if {report!r}:
+    sys.stderr.write(','.join(x for x in {heavy!r} if x in sys.modules))
+'''
+
+
+def run(argv, report=False):
+    # returns the seconds it took and, when reporting, the heavy modules
+    # that were imported
+    code = script.format(argv=argv, report=report, heavy=heavy)
+    t = time.time()
+    p = subprocess.Popen([sys.executable, '-c', code],
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    secs = time.time() - t
+    if p.returncode != 0:
+        raise RuntimeError('Failed: {}\n{}'.format(' '.join(argv),
+                                                   err.strip()))
+    imported = err.strip().split('\n')[-1] if report else None
+    return secs, imported
+
+
+def main():
+    par = argparse.ArgumentParser()
+    par.add_argument('-n', '--runs', type=int, default=10)
+    par.add_argument('video', nargs='?')
+    args = par.parse_args()
+
+    cmds = [('import settings', []),
+            ('--version', ['--version']),
+            ('-h', ['-h']),
+            ('-d', ['-d'])]
+    if args.video:
+        cmds.append(('--probe', ['--probe', args.video]))
+
+    print('{:<18}{:>10}  {}'.format('command', 'ms', 'heavy imports'))
+    for name, argv in cmds:
+        try:
+            secs, imported = run(argv, report=True)
+        except RuntimeError as error:
+            print('{:<18}{:>10}  {}'.format(name, 'failed',
+                                            str(error).split('\n')[-1]))
+            continue
+        times = sorted([secs] + [run(argv)[0] for x in range(args.runs - 1)])
+        print('{:<18}{:>10.1f}  {}'.format(name, times[len(times) // 2] * 1000,
+                                           imported or '-'))
+
+
+if __name__ == '__main__':
+    main()
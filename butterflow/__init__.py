@@ -3,9 +3,12 @@
 
 import os
 import sys
-import _winreg as winreg
 import itertools
 
+# the registry only exists on windows, see the bottom of this file
+if sys.platform.startswith("win"):
+    import _winreg as winreg
+
 
 ADDED_KEYS=False
 
@@ -24,13 +27,15 @@ class RegistryKey(object):
         return False
 
 
-REG_HIVE=winreg.HKEY_CURRENT_USER
 KHRONOS_REG_PATH=r"Software\Khronos\OpenCL\Vendors"
 
-KEYS_NEEDED=[RegistryKey("amdocl64.dll", winreg.REG_DWORD, 0),
-    RegistryKey("AMD_OpenCL64.dll", winreg.REG_DWORD, 0),
-    RegistryKey("nvopencl64.dll", winreg.REG_DWORD, 0),
-    RegistryKey("IntelOpenCL64.dll", winreg.REG_DWORD, 0)]
+if sys.platform.startswith("win"):
+    REG_HIVE=winreg.HKEY_CURRENT_USER
+
+    KEYS_NEEDED=[RegistryKey("amdocl64.dll", winreg.REG_DWORD, 0),
+        RegistryKey("AMD_OpenCL64.dll", winreg.REG_DWORD, 0),
+        RegistryKey("nvopencl64.dll", winreg.REG_DWORD, 0),
+        RegistryKey("IntelOpenCL64.dll", winreg.REG_DWORD, 0)]
 
 def get_local_machine_registry_subkeys(name):
     # print("Keys at %s:" % name)
@@ -1,11 +1,13 @@
 #include <Python.h>
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
 #include <math.h>
 #include <libavcodec/avcodec.h>
 #include <libavformat/avformat.h>
 #include <libavutil/avutil.h>
 #include <libavutil/mathematics.h>
+#include <libavutil/pixdesc.h>
 
 #define MIN(A,B) (((A)<(B))?(A):(B))
 #define MAX(A,B) (((A)>(B))?(A):(B))
@@ -82,6 +84,12 @@ get_av_info(PyObject *self, PyObject *arg) {
     AVRational dar  = {0, 0};  /* display aspect ratio */
     float rate = 0.0;          /* average fps */
     AVRational rational_rate = {0, 0};
+    const char *v_codec = "";  /* short name of the video codec */
+    const char *pix_fmt = "";
+    const char *profile = "";
+    int level = 0;             /* e.g. 42 for h264 level 4.2 */
+    AVRational tb = {0, 0};    /* time base of the video stream */
+    char *extradata = NULL;    /* codec parameter sets, in hex */
 
     if (v_stream_exists) {
         AVStream *v_stream = format_ctx->streams[v_stream_idx];
@@ -105,6 +113,33 @@ get_av_info(PyObject *self, PyObject *arg) {
         w = v_codec_ctx->width;
         h = v_codec_ctx->height;
 
+        v_codec = avcodec_get_name(v_codec_ctx->codec_id);
+        if (av_get_pix_fmt_name(v_codec_ctx->pix_fmt) != NULL) {
+            pix_fmt = av_get_pix_fmt_name(v_codec_ctx->pix_fmt);
+        }
+
+        AVCodec *v_codec_dec = avcodec_find_decoder(v_codec_ctx->codec_id);
+        if (v_codec_dec != NULL &&
+            av_get_profile_name(v_codec_dec, v_codec_ctx->profile) != NULL) {
+            profile = av_get_profile_name(v_codec_dec, v_codec_ctx->profile);
+        }
+        level = v_codec_ctx->level;
+        tb = v_stream->time_base;
+
+        /* copied because the codec context is freed with the input */
+        int n = v_codec_ctx->extradata_size;
+        extradata = malloc(2 * n + 1);
+        if (extradata == NULL) {
+            avformat_close_input(&format_ctx);
+            PyErr_NoMemory();
+            return (PyObject*)NULL;
+        }
+        int i;
+        for (i = 0; i < n; i++) {
+            sprintf(extradata + 2 * i, "%02x", v_codec_ctx->extradata[i]);
+        }
+        extradata[2 * n] = '\0';
+
         rational_rate = format_ctx->streams[v_stream_idx]->avg_frame_rate;
         rate = rational_rate.num * 1.0 / rational_rate.den;
 
@@ -143,6 +178,15 @@ get_av_info(PyObject *self, PyObject *arg) {
     py_safe_set(py_info, "v_stream_exists", PyBool_FromLong(v_stream_exists));
     py_safe_set(py_info, "a_stream_exists", PyBool_FromLong(a_stream_exists));
     py_safe_set(py_info, "s_stream_exists", PyBool_FromLong(s_stream_exists));
+    py_safe_set(py_info, "v_codec", PyString_FromString(v_codec));
+    py_safe_set(py_info, "pix_fmt", PyString_FromString(pix_fmt));
+    py_safe_set(py_info, "profile", PyString_FromString(profile));
+    py_safe_set(py_info, "level", PyInt_FromLong(level));
+    py_safe_set(py_info, "tb_n", PyInt_FromLong(tb.num));
+    py_safe_set(py_info, "tb_d", PyInt_FromLong(tb.den));
+    py_safe_set(py_info, "extradata",
+                PyString_FromString(extradata != NULL ? extradata : ""));
+    free(extradata);
     py_safe_set(py_info, "w", PyInt_FromLong(w));
     py_safe_set(py_info, "h", PyInt_FromLong(h));
     py_safe_set(py_info, "sar_n", PyInt_FromLong(sar.num));
@@ -158,6 +202,139 @@ get_av_info(PyObject *self, PyObject *arg) {
     return py_info;
 }
 
+typedef struct {
+    int64_t pts;
+    int64_t duration;
+    int key;
+} fr_entry;
+
+static int
+compare_fr_entries(const void *a, const void *b) {
+    int64_t x = ((const fr_entry*)a)->pts;
+    int64_t y = ((const fr_entry*)b)->pts;
+    return (x > y) - (x < y);
+}
+
+static PyObject*
+get_fr_table(PyObject *self, PyObject *arg) {
+    /* scans the packets of the video stream without decoding them. packets
+     * are in decoding order, sorting them by pts gives the frames in the
+     * order they're shown */
+    char *path = PyString_AsString(arg);
+
+    av_register_all();
+
+    AVFormatContext *format_ctx = avformat_alloc_context();
+
+    int initial_level = av_log_get_level();
+    av_log_set_level(AV_LOG_ERROR);
+
+    int rc = avformat_open_input(&format_ctx, path, NULL, NULL);
+    if (rc != 0) {
+        av_log_set_level(initial_level);
+        PyErr_SetString(PyExc_RuntimeError, "open input failed");
+        return (PyObject*)NULL;
+    }
+
+    rc = avformat_find_stream_info(format_ctx, NULL);
+    if (rc < 0) {
+        avformat_close_input(&format_ctx);
+        av_log_set_level(initial_level);
+        PyErr_SetString(PyExc_RuntimeError, "no stream info found");
+        return (PyObject*)NULL;
+    }
+
+    int v_stream_idx = av_find_best_stream(format_ctx, AVMEDIA_TYPE_VIDEO,
+                                           -1, -1, NULL, 0);
+    if (v_stream_idx < 0) {
+        avformat_close_input(&format_ctx);
+        av_log_set_level(initial_level);
+        PyErr_SetString(PyExc_RuntimeError, "no video stream found");
+        return (PyObject*)NULL;
+    }
+    AVRational tb = format_ctx->streams[v_stream_idx]->time_base;
+
+    size_t n = 0;
+    size_t cap = 1024;
+    fr_entry *entries = malloc(cap * sizeof(fr_entry));
+    if (entries == NULL) {
+        avformat_close_input(&format_ctx);
+        av_log_set_level(initial_level);
+        return PyErr_NoMemory();
+    }
+
+    AVPacket pkt;
+    av_init_packet(&pkt);
+    int64_t last_pts = 0;
+
+    while (av_read_frame(format_ctx, &pkt) >= 0) {
+        if (pkt.stream_index == v_stream_idx) {
+            if (n == cap) {
+                cap *= 2;
+                fr_entry *grown = realloc(entries, cap * sizeof(fr_entry));
+                if (grown == NULL) {
+                    av_free_packet(&pkt);
+                    free(entries);
+                    avformat_close_input(&format_ctx);
+                    av_log_set_level(initial_level);
+                    return PyErr_NoMemory();
+                }
+                entries = grown;
+            }
+            int64_t pts = pkt.pts;
+            if (pts == AV_NOPTS_VALUE) {
+                pts = pkt.dts;
+            }
+            if (pts == AV_NOPTS_VALUE) {
+                /* keep the frame, shown right after the last one */
+                pts = last_pts + 1;
+            }
+            last_pts = pts;
+            entries[n].pts = pts;
+            entries[n].duration = pkt.duration;
+            entries[n].key = (pkt.flags & AV_PKT_FLAG_KEY) != 0;
+            n++;
+        }
+        av_free_packet(&pkt);
+    }
+
+    av_log_set_level(initial_level);
+    avformat_close_input(&format_ctx);
+
+    qsort(entries, n, sizeof(fr_entry), compare_fr_entries);
+
+    /* times are in milliseconds from the first frame */
+    double ms_per_tick = tb.num * 1000.0 / tb.den;
+    double duration = 0.0;
+    int64_t start = n > 0 ? entries[0].pts : 0;
+
+    PyObject *py_pts = PyList_New(n);
+    PyObject *py_keyframes = PyList_New(0);
+    size_t i;
+    for (i = 0; i < n; i++) {
+        double t = (entries[i].pts - start) * ms_per_tick;
+        /* PyList_SetItem steals the reference */
+        PyList_SetItem(py_pts, i, PyFloat_FromDouble(t));
+        if (entries[i].key) {
+            PyObject *py_idx = PyInt_FromLong(i);
+            PyList_Append(py_keyframes, py_idx);
+            Py_DECREF(py_idx);
+        }
+        duration = MAX(duration,
+                       t + MAX(entries[i].duration, 0) * ms_per_tick);
+    }
+    free(entries);
+
+    PyObject *py_table = PyDict_New();
+    py_safe_set(py_table, "pts", py_pts);
+    py_safe_set(py_table, "keyframes", py_keyframes);
+    py_safe_set(py_table, "duration", PyFloat_FromDouble(duration));
+    Py_DECREF(py_pts);
+    Py_DECREF(py_keyframes);
+
+    return py_table;
+}
+
 static PyObject*
 print_av_info(PyObject *self, PyObject *arg) {
     PyObject *py_info = get_av_info(self, arg);
@@ -229,6 +406,8 @@ static PyMethodDef ModuleMethods[] = {
         "Return information on a multimedia file as a dictionary"},
     {"print_av_info", print_av_info, METH_O,
         "Prints a multimedia file's information"},
+    {"get_fr_table", get_fr_table, METH_O,
+        "Return the time of every frame and the keyframes as a dictionary"},
     {NULL, NULL, 0, NULL}
 };
 
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# renders many videos in one process. jobs share the selected OpenCL device,
+# and with it the context and the kernels already built on it, and the worker
+# processes made for `-devices` and `-hybrid`. a manifest has a job per line,
+# each written like the options and video of a butterflow command, or is a
+# json list of those as strings or lists of arguments
+
+import os
+import sys
+import json
+import shlex
+import threading
+from butterflow.settings import default as settings
+from butterflow.workers import DeviceWorkers
+
+import logging
+log = logging.getLogger('butterflow')
+
+
+class ManifestError(Exception):
+    pass
+
+
+def argv_from_json(x):
+    # a job in json is a command string or a list of arguments
+    if isinstance(x, basestring):
+        try:
+            return shlex.split(x.encode('utf-8'))
+        except ValueError as error:
+            raise ManifestError(str(error))
+    elif isinstance(x, list) and all(isinstance(y, basestring) for y in x):
+        return [y.encode('utf-8') for y in x]
+    raise ManifestError('expected a string or a list of strings')
+
+
+def read_manifest(path):
+    # returns (line number, argv) for every job, `-` reads from stdin
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path) as f:
+            text = f.read()
+    jobs = []
+    if os.path.splitext(path)[1].lower() == '.json':
+        try:
+            entries = json.loads(text)
+        except ValueError as error:
+            raise ManifestError('Bad manifest: {}'.format(error))
+        if not isinstance(entries, list):
+            raise ManifestError('Bad manifest: expected a list of jobs')
+        for i, x in enumerate(entries):
+            try:
+                jobs.append((i+1, argv_from_json(x)))
+            except ManifestError as error:
+                raise ManifestError('Bad job {}: {}'.format(i+1, error))
+        return jobs
+    for i, line in enumerate(text.splitlines()):
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as error:
+            raise ManifestError('Bad job on line {}: {}'.format(i+1, error))
+        if len(argv) > 0:
+            jobs.append((i+1, argv))
+    return jobs
+
+
+class Session(object):
+    # state shared by the jobs of a batch
+    def __init__(self):
+        self.device = None  # selected by a job, kept for the next ones
+        self.pools = {}
+        # jobs set up one at a time because options are applied to settings,
+        # and render one at a time when they use OpenCL in this process
+        self.setup_lock = threading.Lock()
+        self.ocl_lock = threading.Lock()
+
+    def workers(self, devices, optflow_fn):
+        # worker processes for the devices and flow method, made by the first
+        # job that needs them
+        key = (tuple(devices), optflow_fn.__class__.__name__,
+               tuple(optflow_fn.params().items()), optflow_fn.uses_ocl,
+               settings['flow_storage'])
+        if key not in self.pools:
+            self.pools[key] = DeviceWorkers(devices, optflow_fn,
+                                            settings['clbdir'])
+        else:
+            log.info('Reusing %d worker processes',
+                     len(self.pools[key].workers))
+        return self.pools[key]
+
+    def close(self):
+        for workers in self.pools.values():
+            workers.close()
+            if hasattr(workers.optflow_fn, 'estimated'):
+                log.info('Backward flows: {} estimated, {} computed'.format(
+                         workers.optflow_fn.estimated,
+                         workers.optflow_fn.fallbacks))
+        self.pools = {}
+
+    def terminate(self):
+        for workers in self.pools.values():
+            workers.terminate()
+        self.pools = {}
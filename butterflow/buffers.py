@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# a pool of frame buffers that are reused instead of allocating a new array
+# for every frame that's decoded, scaled or interpolated. buffers are handed
+# out with get() and given back with put() once nothing refers to them anymore,
+# usually after they've been written to the encoder
+
+import numpy as np
+
+
+class FramePool(object):
+    def __init__(self, capacity=0):
+        self.capacity = capacity  # free buffers kept per shape
+        self.free = {}
+        self.allocated = 0
+        self.reused = 0
+
+    def get(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype))
+        free = self.free.get(key)
+        if free:
+            self.reused += 1
+            return free.pop()
+        self.allocated += 1
+        return np.empty(shape, dtype=dtype)
+
+    def put(self, buf):
+        # the pool keeps up to capacity buffers, the rest are left to the gc
+        if buf is None:
+            return
+        key = (buf.shape, buf.dtype)
+        free = self.free.setdefault(key, [])
+        if len(free) < self.capacity:
+            free.append(buf)
+
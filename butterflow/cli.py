@@ -3,17 +3,24 @@
 import os
 import sys
 import re
+import csv
+import json
 import argparse
 import datetime
 import logging
-import numpy.core.multiarray  # Bug: https://github.com/opencv/opencv/issues/8139
-import cv2
+import socket
+import tempfile
+import threading
+import collections
 from butterflow.settings import default as settings
-from butterflow import ocl, avinfo, motion
-from butterflow.render import Renderer
-from butterflow.sequence import VideoSequence, Subregion
+from butterflow.sequence import VideoSequence, Subregion, OverlapError
 from butterflow.version import __version__
 
+# opencv, the OpenCL extension and the modules that use them are imported
+# where they're needed so that options like `--version`, `--probe` and `-d`
+# start quickly
+
+log = logging.getLogger('butterflow')
 
 flt_pattern = r"(?P<flt>\d*\.\d+|\d+)"
 wh_pattern = re.compile(r"""
@@ -41,11 +48,10 @@ tm_pattern = r"""^
 (\.\d{1,3}|[0-5]?\d(?:\.\d{1,3})?)$
 """
 sr_tm_pattern = tm_pattern[1:-2]  # remove ^$
+tm_re = re.compile(tm_pattern, re.X)
 sr_end_pattern = r"end"
 sr_ful_pattern = r"full"
-sr_pattern = re.compile(r"""^
-a=(?P<tm_a>{tm}),
-b=(?P<tm_b>{tm}),
+sr_target_pattern = r"""
 (?P<target>fps|dur|spd)=
 {}
 (?P<val>
@@ -54,10 +60,19 @@ b=(?P<tm_b>{tm}),
     {}
   )
 )$
-""".format(sl_pattern, nd_pattern, flt_pattern, tm=sr_tm_pattern), re.X)
+""".format(sl_pattern, nd_pattern, flt_pattern)
+sr_pattern = re.compile(r"""^
+a=(?P<tm_a>{tm}),
+b=(?P<tm_b>{tm}),
+""".format(tm=sr_tm_pattern) + sr_target_pattern, re.X)
+sr_fr_pattern = re.compile(r"""^
+fa=(?P<fr_a>\d+),
+fb=(?P<fr_b>\d+|end),
+""" + sr_target_pattern, re.X)
+sr_sep_pattern = r":(?=f?a=)"  # times have colons too
 
 
-def main():
+def mk_parser():
     par = argparse.ArgumentParser(usage='butterflow [options] [video]',
                                   add_help=False)
     req = par.add_argument_group('Required arguments')
@@ -81,6 +96,27 @@ def main():
                      help='Show cache information and exit')
     gen.add_argument('--rm-cache', action='store_true',
                      help='Set to clear the cache and exit')
+    gen.add_argument('-es', '--encode-spool', type=str, default=None,
+                     metavar='SPOOL',
+                     help='Encode a spool made with `-spool` to the output '
+                     'path and exit. Video and audio options like `-crf`, '
+                     '`-l`, `-enc`, and `-audio` apply.')
+    gen.add_argument('-b', '--batch', type=str, default=None,
+                     metavar='MANIFEST',
+                     help='Render every job in a manifest, one per line, '
+                     'written like the options and video of a butterflow '
+                     'command, or `-` to read it from stdin. Options given '
+                     'here apply to every job. Jobs share the OpenCL device '
+                     'and worker processes.')
+    gen.add_argument('-bj', '--batch-jobs', type=int, default=1,
+                     help='Specify how many batch or server jobs to render '
+                     'at once, jobs that interpolate with OpenCL in this '
+                     'process still take turns, (default: %(default)s)')
+    gen.add_argument('--serve', type=str, default=None, metavar='ADDRESS',
+                     help='Keep running and render jobs sent over HTTP, on '
+                     'a localhost port if ADDRESS is a number and on a unix '
+                     'socket at that path otherwise. Jobs share the OpenCL '
+                     'device and worker processes, See: docs/Example-Usage.md')
     gen.add_argument('-prb', '--probe', action='store_true',
                      help='Show media file information and exit')
     gen.add_argument('-v', '--verbosity', action='count',
@@ -96,6 +132,16 @@ def main():
                      'integer. Device numbers can be listed with the `-d` '
                      'option. The device will be chosen automatically if '
                      'nothing is specified.')
+    dev.add_argument('-devices', type=str, default=None,
+                     help='Spread rendering across several OpenCL devices, '
+                     'one worker process per device, as a comma separated '
+                     'list of device numbers or `all`. A device can be '
+                     'listed more than once to run more than one worker on '
+                     'it.')
+    dev.add_argument('-hybrid', action='store_true',
+                     help='Set to also interpolate on the CPU while OpenCL '
+                     'devices are rendering. Pairs are split between them '
+                     'by how fast each has been.')
     dev.add_argument('-sw', action='store_true',
                      help='Set to force software rendering')
 
@@ -126,13 +172,29 @@ def main():
                      '"a=TIME,b=TIME,TARGET=VALUE" where TARGET is either '
                      '`spd`, `dur`, `fps`. Valid TIME syntaxes are [hr:m:s], '
                      '[m:s], [s], [s.xxx], or `end`, which signifies to the '
-                     'end the video. You can specify multiple subregions by '
+                     'end the video. Subregions can also be given as exact '
+                     'frame numbers, counted from 0, in the form: '
+                     '"fa=FRAME,fb=FRAME,TARGET=VALUE", where fb can be `end`. '
+                     'You can specify multiple subregions by '
                      'separating them with a colon `:`. A special subregion '
                      'format that conveniently describes the entire clip is '
                      'available in the form: "full,TARGET=VALUE".')
+    vid.add_argument('-sf', '--subregions-file', type=str, default=None,
+                     metavar='PATH',
+                     help='Read subregions from a JSON list of objects or a '
+                     'CSV file with a header, or `-` for stdin. Each has the '
+                     'times `a` and `b`, or the frames `fa` and `fb`, and '
+                     'one of `spd`, `dur`, or `fps`. Times are in seconds or '
+                     'the TIME syntax of `-s`, `b` and `fb` can be `end`.')
     vid.add_argument('-k', '--keep-subregions', action='store_true',
                      help='Set to render subregions that are not explicitly '
                           'specified')
+    vid.add_argument('-cs', '--copy-subregions', action='store_true',
+                     help='Set to keep subregions that are not explicitly '
+                          'specified, like `-k`, but copy their whole '
+                          'keyframe intervals from the source instead of '
+                          'rendering them. The output has to have the same '
+                          'codec, size, and rate as the source')
     vid.add_argument('-vs', '--video-scale', type=str,
                      default=str(settings['video_scale']),
                      help='Specify output video size in the form: '
@@ -140,6 +202,21 @@ def main():
                      'aspect ratio only specify one component, either width '
                      'or height, and set the other component to -1, '
                      '(default: %(default)s)')
+    vid.add_argument('-dw', '--direct-write', action='store_true',
+                     help='Set to encode the video and audio straight into '
+                     'the output\'s directory instead of the cache and '
+                     'skip the copies made when muxing and moving it')
+    vid.add_argument('-enc', '--encoders', type=int, default=1,
+                     help='Specify how many encoder processes to split the '
+                     'video into segments across, helps slow presets use more '
+                     'cores, (default: %(default)s)')
+    vid.add_argument('-crf', type=int, default=settings['crf'],
+                     help='Specify the constant rate factor, lower is better '
+                     'quality, (default: %(default)s)')
+    vid.add_argument('-spool', action='store_true',
+                     help='Set to write rendered frames to a spool directory '
+                     'at the output path instead of encoding them. Encode it '
+                     'later with `-es`.')
     vid.add_argument('-l', '--lossless', action='store_true',
                      help='Set to use lossless encoding settings')
     vid.add_argument('-sm', '--smooth-motion', action='store_true',
@@ -150,6 +227,26 @@ def main():
     aud.add_argument('-audio', action='store_true',
                      help='Set to add the source audio to the output video')
 
+    fgr.add_argument('-fm', '--flow-method', default=settings['flow_method'],
+                     help='Specify which algorithm to use for optical flow '
+                     'estimation, one of `farneback`, `dis`, or `bm`. `dis` '
+                     'and `bm` always run on the CPU and are faster than '
+                     '`farneback` in software mode, `dis` requires OpenCV >= '
+                     '3.3, (default: %(default)s)')
+    fgr.add_argument('-eb', '--estimate-backward', action='store_true',
+                     help='Set to derive the backward flow from the forward '
+                     'flow instead of computing it, nearly halving the cost '
+                     'of optical flow. Best for mostly rigid, slow motion. '
+                     'The backward flow will still be computed for pairs '
+                     'where the estimate is unreliable.')
+    fgr.add_argument('-fs', '--flow-storage',
+                     choices=['float32', 'float16', 'int16'],
+                     default=settings['flow_storage'],
+                     help='Specify how flows are kept until they are '
+                     'interpolated with. `float16` and `int16` take half the '
+                     'memory, `int16` also halves uploads to the device and '
+                     'is exact to 1/{} px, (default: %(default)s)'.format(
+                     settings['flow_fixed_steps']))
     fgr.add_argument('--fast-pyr', action='store_true',
                      help='Set to use fast pyramids')
     fgr.add_argument('--pyr-scale', type=float,
@@ -182,15 +279,25 @@ def main():
                      help='Specify which filter to use for optical flow '
                      'estimation, (default: %(default)s)')
 
-    for i, arg in enumerate(sys.argv):
-        if arg[0] == '-' and arg[1].isdigit():
-            sys.argv[i] = ' '+arg
-    args = par.parse_args()
+    return par
+
+
+def fix_negative_args(argv):
+    # argparse mistakes values like `-1:-1` for options
+    argv = list(argv)
+    for i, arg in enumerate(argv):
+        if arg[:1] == '-' and arg[1:2].isdigit():
+            argv[i] = ' '+arg
+    return argv
+
+
+def main():
+    par = mk_parser()
+    args = par.parse_args(fix_negative_args(sys.argv[1:]))
 
     format = '[butterflow:%(levelname)s]: %(message)s'
 
     logging.basicConfig(level=settings['loglevel_0'], format=format)
-    log = logging.getLogger('butterflow')
 
     if args.verbosity == 1:
         log.setLevel(settings['loglevel_1'])
@@ -215,21 +322,13 @@ def main():
             os.makedirs(cachedir)
         settings['tempdir'] = cachedir
         settings['clbdir'] = os.path.join(cachedir, 'clb')
-        if not os.path.exists(settings['clbdir']):
-            os.makedirs(settings['clbdir'])
-        ocl.set_cache_path(settings['clbdir'] + os.sep)
+        settings['idxdir'] = os.path.join(cachedir, 'idx')
+        for x in [settings['clbdir'], settings['idxdir']]:
+            if not os.path.exists(x):
+                os.makedirs(x)
 
     cachedir = settings['tempdir']
 
-    cachedirs = []
-    tempfolder = os.path.dirname(cachedir)
-    for dirpath, dirnames, filenames in os.walk(tempfolder):
-        for d in dirnames:
-            if 'butterflow' in d:
-                if 'butterflow-'+__version__ not in d:
-                    cachedirs.append(os.path.join(dirpath, d))
-        break
-
     if args.cache:
         nfiles = 0
         sz = 0
@@ -245,6 +344,7 @@ def main():
         print('Cache: '+cachedir)
         return 0
     if args.rm_cache:
+        cachedirs = stale_cache_dirs()
         cachedirs.append(cachedir)
         for i, x in enumerate(cachedirs):
             print('[{}] {}'.format(i, x))
@@ -260,58 +360,369 @@ def main():
         return 0
 
     if args.show_devices:
+        from butterflow import ocl
         ocl.print_ocl_devices()
         return 0
 
+    if not args.probe:
+        log.info('Version '+__version__)
+        log.info('Cache directory:\t%s' % cachedir)
+
+    if args.serve is not None:
+        return run_server(par, args)
+    if args.batch is not None:
+        return run_batch(par, args)
+    return run(args)
+
+
+def stale_cache_dirs():
+    # caches of other versions of butterflow next to this one. only names are
+    # compared, temp folders can have a lot of entries
+    tempfolder = os.path.dirname(settings['tempdir'])
+    cachedirs = []
+    for d in os.listdir(tempfolder):
+        if 'butterflow' in d and 'butterflow-'+__version__ not in d:
+            x = os.path.join(tempfolder, d)
+            if os.path.isdir(x):
+                cachedirs.append(x)
+    return cachedirs
+
+
+def run_batch(par, args):
+    # options on the command line apply to every job, options in the
+    # manifest override them
+    from butterflow import batch
+    try:
+        jobs = batch.read_manifest(args.batch)
+    except (IOError, batch.ManifestError) as error:
+        print('Error: '+str(error))
+        return 1
+    base_argv = []
+    skip = False
+    for x in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif x in ['-b', '--batch', '-bj', '--batch-jobs']:
+            skip = True
+        elif not x.startswith('--batch=') and not \
+                x.startswith('--batch-jobs='):
+            base_argv.append(x)
+    if args.video is not None:
+        base_argv.remove(args.video)
+
+    session = batch.Session()
+    results = {}
+    pending = collections.deque(jobs)
+    lock = threading.Lock()
+
+    def run_jobs():
+        while True:
+            with lock:
+                if len(pending) == 0:
+                    return
+                line, argv = pending.popleft()
+            log.info('Job on line %d: %s', line, ' '.join(argv))
+            try:
+                job_args = par.parse_args(fix_negative_args(base_argv + argv))
+            except SystemExit:  # argparse has printed the error
+                results[line] = 1
+                continue
+            if job_args.video is None:
+                print('Error: No video for the job on line {}'.format(line))
+                results[line] = 1
+                continue
+            try:
+                results[line] = run(job_args, session)
+            except Exception:
+                log.exception('Job on line %d failed', line)
+                results[line] = 1
+
+    threads = []
+    for i in range(max(1, min(args.batch_jobs, len(jobs)))):
+        t = threading.Thread(target=run_jobs)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.1)  # so that ctrl+c reaches this thread
+    except (KeyboardInterrupt, SystemExit):
+        session.terminate()
+        log.warn('Quit unexpectedly')
+        return 1
+    session.close()
+
+    failed = sorted(x for x, rc in results.items() if rc != 0)
+    log.info('Batch: %d of %d jobs done', len(jobs) - len(failed), len(jobs))
+    if len(failed) > 0:
+        log.warn('Failed jobs on lines: %s', ', '.join(str(x) for x in failed))
+        return 1
+    return 0
+
+
+def run_server(par, args):
+    # jobs are parsed like the command line, without the options that
+    # started the server
+    from butterflow import batch, server
+    def parse(argv):
+        try:
+            job_args = par.parse_args(fix_negative_args(argv))
+        except SystemExit:  # -h
+            raise ValueError('jobs can\'t show help')
+        if job_args.video is None:
+            raise ValueError('no video')
+        if job_args.batch is not None or job_args.serve is not None:
+            raise ValueError('jobs can\'t start batches or servers')
+        return job_args
+
+    def parse_error(message):
+        raise ValueError(message)
+    par.error = parse_error
+
+    session = batch.Session()
+    queue = server.JobQueue(parse, lambda job: run(job.args, session, job),
+                            args.batch_jobs)
+    # any local user can connect to a port, unlike to a unix socket
+    token = None
+    token_file = None
+    if args.serve.isdigit():
+        token_file = os.path.join(settings['tempdir'],
+                                  'server-{}.token'.format(args.serve))
+        token = server.mk_token_file(token_file)
+    try:
+        httpd = server.mk_server(args.serve, queue, token)
+    except (ValueError, socket.error) as error:
+        print('Error: Can\'t listen on {}: {}'.format(args.serve, error))
+        queue.close()
+        if token_file is not None:
+            os.remove(token_file)
+        return 1
+    log.warn('Serving on %s, running %d jobs at once, Ctrl+c to quit',
+             args.serve, max(1, args.batch_jobs))
+    if token_file is not None:
+        log.warn('Requests need the header `Authorization: Bearer <token>` '
+                 'with the token in %s', token_file)
+    try:
+        httpd.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    log.warn('Stopping the server, cancelling running jobs')
+    httpd.server_close()
+    if token_file is not None:
+        os.remove(token_file)
+    queue.close()
+    session.close()
+    return 0
+
+
+def run(args, session=None, job=None):
+    # renders a video, or encodes a spool. with a session from batch or server
+    # mode, the device and worker processes are shared with other jobs. a job
+    # from the server can cancel the render
+    if args.encode_spool is not None:
+        return encode_spool(args)
+
+    if session is None:
+        rc, rnd, optflow_fn, workers = prepare(args)
+    else:
+        with session.setup_lock:
+            rc, rnd, optflow_fn, workers = prepare(args, session)
+    if rc is not None:
+        return rc  # nothing to render, e.g. `--probe`
+
+    from butterflow import spool
+    from butterflow.render import RenderCancelled
+    if job is not None:
+        job.renderer = rnd
+        if job.cancelled:
+            return 1
+
+    # renders that use OpenCL in this process take turns in a batch
+    ocl_lock = None
+    if session is not None and workers is None and not args.sw:
+        ocl_lock = session.ocl_lock
+
+    log.info('Rendering:')
+    added_rate = False
+    for x in str(rnd.sequence).split('\n'):
+        x = x.strip()
+        if not added_rate:
+            x += ', Rate={}'.format(rnd.av_info['rate'])
+            log.info(x)
+            added_rate = True
+            continue
+        if not rnd.keep_subregions and 'autogenerated' in x:
+            log.info(x[:-1]+ ', will skip when rendering)')
+            continue
+        log.info(x)
+
+
+    if rnd.sequence.first_overlap() is not None:
+        log.warn('At least 1 subregion overlaps with another')
+
+    success = True
+    cancelled = False
+    total_time = 0
+    if ocl_lock is not None:
+        ocl_lock.acquire()
+    try:
+        import timeit
+        total_time = timeit.timeit(rnd.render,
+                                   setup='import gc;gc.enable()',
+                                   number=1)
+    except (KeyboardInterrupt, SystemExit):
+        success = False
+    except RenderCancelled:
+        success = False
+        cancelled = True
+    finally:
+        if ocl_lock is not None:
+            ocl_lock.release()
+    # a session closes the workers it shares when the batch is done
+    if workers is not None and session is None:
+        if success:
+            workers.close()
+        else:
+            workers.terminate()
+    if cancelled:
+        return 1
+    if success:
+        log_function = log.info
+        if rnd.frs_written > rnd.frs_to_render:
+            log_function = log.warn
+            log.warn('Unexpected write ratio')
+        log_function('Write ratio: {}/{}, ({:.2f}%)'.format(
+                 rnd.frs_written,
+                 rnd.frs_to_render,
+                 rnd.frs_written*100.0/rnd.frs_to_render))
+        txt = 'Final output frames: {} source, +{} interpolated, +{} duped, -{} dropped'
+        if not settings['quiet']:
+            log.info(txt.format(rnd.source_frs,
+                                rnd.frs_interpolated,
+                                rnd.frs_duped,
+                                rnd.frs_dropped))
+            log.info('Source seeks: {}, {} subregions started on the frame '
+                     'the last one ended on'.format(rnd.seeks,
+                                                    rnd.frs_carried))
+            if rnd.stream_copy:
+                log.info('Copied {:.3g} secs of video from the source'.format(
+                         rnd.secs_copied))
+        if args.estimate_backward and (workers is None or session is None):
+            log.info('Backward flows: {} estimated, {} computed'.format(
+                     optflow_fn.estimated, optflow_fn.fallbacks))
+        if rnd.audio_thread is not None:
+            log.info('Audio was prepared while rendering, saved {:.3g} '
+                     'secs'.format(rnd.audio_secs_saved))
+        old_sz = os.path.getsize(args.video) / 1024.0
+        if args.spool:
+            new_sz = spool.spool_size(args.output_path) / 1024.0
+        else:
+            new_sz = os.path.getsize(args.output_path) / 1024.0
+        log.info('Output file size:\t{:.2f} kB ({:.2f} kB)'.format(new_sz,
+                 new_sz - old_sz))
+        log.info('Rendering took {:.3g} mins, done.'.format(total_time / 60))
+        return 0
+    else:
+        log.warn('Quit unexpectedly')
+        log.warn('Files were left in the cache @ '+settings['tempdir']+'.')
+        return 1
+
+
+def encode_spool(args):
+    from butterflow import spool
+    extension = os.path.splitext(
+        os.path.basename(args.output_path))[1].lower()
+    if extension[1:] != settings['v_container']:
+        print('Bad output file extension. Must be {}.'.format(
+              settings['v_container'].upper()))
+        return 0
+    try:
+        frs = spool.encode_spool(args.encode_spool, args.output_path,
+                                 args.lossless, args.audio, args.encoders,
+                                 args.crf)
+    except RuntimeError as error:
+        print('Error: '+str(error))
+        return 1
+    log.info('Encoded {} frames to {}, done.'.format(frs,
+             args.output_path))
+    return 0
+
+
+def prepare(args, session=None):
+    # checks the options and makes the renderer. returns a return code if
+    # there's nothing to render
+    settings['crf'] = args.crf
+    settings['flow_storage'] = args.flow_storage
+
     if not args.video:
         print('No file specified')
-        return 1
+        return 1, None, None, None
     elif not os.path.exists(args.video):
         print('File doesn\'t exist')
-        return 1
+        return 1, None, None, None
 
     if args.probe:
+        from butterflow import avinfo
         avinfo.print_av_info(args.video)
-        return 0
+        return 0, None, None, None
+
+    import numpy.core.multiarray  # Bug: https://github.com/opencv/opencv/issues/8139
+    import cv2
+    from butterflow import ocl, motion, flow, frametable, probe
+    from butterflow.render import Renderer
+    from butterflow.workers import DeviceWorkers
+    ocl.set_cache_path(settings['clbdir'] + os.sep)
 
-    av_info = avinfo.get_av_info(args.video)
+    av_info = probe.probe(args.video)
+    try:
+        fr_table = frametable.get_fr_table(args.video)
+    except RuntimeError as error:
+        log.warn('Couldn\'t index frames, estimating them from the rate '
+                 '(%s)', error)
+        fr_table = None
+    if fr_table is not None and fr_table.frames != av_info['frames']:
+        log.info('Frames: %d (%d estimated from the rate)', fr_table.frames,
+                 av_info['frames'])
+        av_info['frames'] = fr_table.frames
     if av_info['frames'] == 0:
         print('Bad file with 0 frames')
-        return 1
+        return 1, None, None, None
 
     extension = os.path.splitext(os.path.basename(args.output_path))[1].lower()
-    if extension[1:] != settings['v_container']:
+    if not args.spool and extension[1:] != settings['v_container']:
         print('Bad output file extension. Must be {}.'.format(
               settings['v_container'].upper()))
-        return 0
+        return 0, None, None, None
 
     if not args.sw and not ocl.compat_ocl_device_available():
         print('No compatible OpenCL devices were detected. Must force software '
               'rendering with the `-sw` flag to continue.')
-        return 1
-
-    log.info('Version '+__version__)
-    log.info('Cache directory:\t%s' % cachedir)
-
-    for x in cachedirs:
-        log.warn('Stale cache directory (delete with `--rm-cache`): %s' % x)
+        return 1, None, None, None
 
     if not args.sw and ocl.compat_ocl_device_available():
         log.info('At least one compatible OpenCL device was detected')
     else:
         log.warning('No compatible OpenCL devices were detected.')
 
-    if args.device != -1:
+    if args.device != -1 and (session is None or
+                              session.device != args.device):
         try:
-            ocl.select_ocl_device(args.device)
+            if session is None:
+                ocl.select_ocl_device(args.device)
+            else:
+                # a new context, wait for renders using the current one
+                with session.ocl_lock:
+                    ocl.select_ocl_device(args.device)
+                session.device = args.device
         except IndexError as error:
             print('Error: '+str(error))
-            return 1
+            return 1, None, None, None
         except ValueError:
             if not args.sw:
                 print('An incompatible device was selected.\n'
                       'Must force software rendering with the `-sw` flag to continue.')
-                return 1
+                return 1, None, None, None
 
     s = "Using device: %s"
     if args.device == -1:
@@ -327,22 +738,29 @@ def main():
     if args.smooth_motion:
         args.poly_s = 0.01
 
-    def optflow_fn(x, y,
-                   pyr=args.pyr_scale, levels=args.levels,
-                   winsize=args.winsize, iters=args.iters, polyn=args.poly_n,
-                   polys=args.poly_s, fast=args.fast_pyr,
-                   filt=args.flow_filter):
-        if use_sw_interpolate:
-            return cv2.calcOpticalFlowFarneback(
-                x, y, pyr, levels, winsize, iters, polyn, polys, filt)
+    try:
+        if args.flow_method == 'farneback':
+            optflow_fn = flow.get_backend(
+                'farneback', pyr=args.pyr_scale, levels=args.levels,
+                winsize=args.winsize, iters=args.iters, polyn=args.poly_n,
+                polys=args.poly_s, fast=args.fast_pyr, filt=args.flow_filter,
+                use_ocl=not use_sw_interpolate)
         else:
-            return motion.ocl_farneback_optical_flow(
-                x, y, pyr, levels, winsize, iters, polyn, polys, fast, filt)
+            optflow_fn = flow.get_backend(args.flow_method)
+    except ValueError as error:
+        print('Error: '+str(error))
+        return 1, None, None, None
+    log.info('Flow method: %s', args.flow_method)
+    if args.flow_storage != 'float32':
+        log.info('Storing flows as %s', args.flow_storage)
+    if args.estimate_backward:
+        optflow_fn = flow.EstimatedBackwardFlow(optflow_fn)
+        log.info('Estimating backward flows from forward flows')
 
     interpolate_fn = None
     if use_sw_interpolate:
-        from butterflow.interpolate import sw_interpolate_flow
-        interpolate_fn = sw_interpolate_flow
+        from butterflow.interpolate import vec_interpolate_flow
+        interpolate_fn = vec_interpolate_flow
         log.warn("Hardware acceleration is disabled. Rendering will be slow. "
                  "Do Ctrl+c to quit or suspend the process with Ctrl+z and "
                  "then stop it with `kill %1`, etc. You can list suspended "
@@ -351,15 +769,57 @@ def main():
         interpolate_fn = motion.ocl_interpolate_flow
         log.info("Hardware acceleration is enabled")
 
+    if args.encoders < 1:
+        print('Error: Need at least 1 encoder')
+        return 1, None, None, None
+
+    workers = None
+    if args.devices is not None or args.hybrid:
+        if use_sw_interpolate:
+            print('Error: `-devices` and `-hybrid` can\'t be used with `-sw`')
+            return 1, None, None, None
+        compat_devices = ocl.compat_ocl_devices()
+        try:
+            if args.devices is None:
+                # the preferred device, or the first one as it's the one
+                # that's autoselected
+                devices = [args.device if args.device != -1 else
+                           compat_devices[0]]
+            elif args.devices == 'all':
+                devices = compat_devices
+            else:
+                devices = [int(x) for x in args.devices.split(',')]
+        except ValueError:
+            print('Error: Bad device list: {}'.format(args.devices))
+            return 1, None, None, None
+        for x in devices:
+            if x not in compat_devices:
+                print('Error: {} is not a compatible device. Device numbers '
+                      'can be listed with the `-d` option.'.format(x))
+                return 1, None, None, None
+        if args.hybrid:
+            devices.extend([None] * settings['cpu_workers'])
+        if session is None:
+            workers = DeviceWorkers(devices, optflow_fn, settings['clbdir'])
+        else:
+            workers = session.workers(devices, optflow_fn)
+
     try:
         w, h = w_h_from_input_str(args.video_scale, av_info['w'], av_info['h'])
-        sequence = sequence_from_input_str(args.subregions,
-                                           av_info['duration'],
-                                           av_info['frames'])
+        if args.subregions_file is not None:
+            if args.subregions:
+                raise ValueError('Can\'t use both `-s` and `-sf`')
+            sequence = sequence_from_file(args.subregions_file,
+                                          av_info['duration'],
+                                          av_info['frames'], fr_table)
+        else:
+            sequence = sequence_from_input_str(args.subregions,
+                                               av_info['duration'],
+                                               av_info['frames'], fr_table)
         rate = rate_from_input_str(args.playback_rate, av_info['rate'])
-    except (ValueError, AttributeError) as error:
+    except (ValueError, AttributeError, IOError) as error:
         print('Error: '+str(error))
-        return 1
+        return 1, None, None, None
 
     def nearest_even_int(x, tag=""):
         new_x = x & ~1
@@ -386,6 +846,23 @@ def main():
     else:
         scaling_method = None
 
+    keep_subregions = args.keep_subregions or args.copy_subregions
+    stream_copy = False
+    if args.copy_subregions:
+        problem = stream_copy_problem(args, av_info, fr_table, w2, h2, rate)
+        if problem is None:
+            try:
+                enc_info = sample_encoder_info(
+                    w2, h2, rate, os.path.splitext(args.video)[1])
+                problem = stream_params_problem(av_info, enc_info)
+            except RuntimeError:
+                problem = 'the encoder\'s stream parameters aren\'t known'
+        if problem is None:
+            stream_copy = True
+        else:
+            log.warn('Rendering subregions instead of copying them: %s',
+                     problem)
+
     rnd = Renderer(args.video,
                    args.output_path,
                    sequence,
@@ -396,77 +873,80 @@ def main():
                    h2,
                    scaling_method,
                    args.lossless,
-                   args.keep_subregions,
+                   keep_subregions,
                    args.show_preview,
                    args.embed_info,
                    args.text_type,
                    args.mark_frames,
-                   args.audio)
+                   args.audio,
+                   workers,
+                   args.direct_write,
+                   args.encoders,
+                   args.spool,
+                   stream_copy)
 
     ocl.set_num_threads(settings['ocv_threads'])
+    return None, rnd, optflow_fn, workers
 
-    log.info('Rendering:')
-    added_rate = False
-    for x in str(rnd.sequence).split('\n'):
-        x = x.strip()
-        if not added_rate:
-            x += ', Rate={}'.format(av_info['rate'])
-            log.info(x)
-            added_rate = True
-            continue
-        if not args.keep_subregions and 'autogenerated' in x:
-            log.info(x[:-1]+ ', will skip when rendering)')
-            continue
-        log.info(x)
 
+def stream_copy_problem(args, av_info, fr_table, w, h, rate):
+    # why subregions can't be copied from the source, or None. copied and
+    # rendered parts are joined without re-encoding them, so they have to be
+    # in the same format
+    codecs = {'libx264': 'h264', 'libx265': 'hevc'}
+    if fr_table is None:
+        return 'the keyframes aren\'t known'
+    if av_info.get('v_codec') != codecs.get(settings['cv']):
+        return 'the video codec is {}, not {}'.format(
+               av_info.get('v_codec'), codecs.get(settings['cv']))
+    if av_info.get('pix_fmt') != 'yuv420p':
+        return 'the pixel format is {}, not yuv420p'.format(
+               av_info.get('pix_fmt'))
+    if w != av_info['w'] or h != av_info['h']:
+        return 'the video is scaled'
+    if rate != av_info['rate']:
+        return 'the playback rate is changed'
+    if args.lossless:
+        return 'the output is lossless'
+    if args.spool:
+        return 'the frames are spooled'
+    if args.embed_info or args.mark_frames:
+        return 'the frames are drawn on'
+    return None
 
-    temp_subs = rnd.sequence.subregions
-    for x in rnd.sequence.subregions:
-        overlaps = False
-        for y in temp_subs:
-            if x is y:
-                continue
-            elif x.intersects(y):
-                overlaps = True
-                break
-        if overlaps:
-            log.warn('At least 1 subregion overlaps with another')
-            break
 
-    success = True
-    total_time = 0
+def stream_params_problem(av_info, enc_info):
+    # why the encoder's stream can't be joined to the source's, or None. the
+    # joined video has one set of codec parameters, from its first part, so
+    # every part has to have been encoded with the same ones
+    if av_info['profile'] != enc_info['profile']:
+        return 'the profile is {}, the encoder\'s is {}'.format(
+               av_info['profile'], enc_info['profile'])
+    if av_info['level'] != enc_info['level']:
+        return 'the level is {}, the encoder\'s is {}'.format(
+               av_info['level'], enc_info['level'])
+    for k, name in [('tb', 'time base'), ('sar', 'sample aspect ratio')]:
+        a = (av_info[k+'_n'], av_info[k+'_d'])
+        b = (enc_info[k+'_n'], enc_info[k+'_d'])
+        if a != b:
+            return 'the {} is {}/{}, the encoder\'s is {}/{}'.format(
+                   name, a[0], a[1], b[0], b[1])
+    if av_info['extradata'] != enc_info['extradata']:
+        return 'the codec parameters (extradata) differ from the encoder\'s'
+    return None
+
+
+def sample_encoder_info(w, h, rate, ext):
+    # avinfo of a frame encoded like the rendered parts, in the source's
+    # container so that their extradata can be compared
+    from butterflow import avinfo, encoders
+    fd, path = tempfile.mkstemp(suffix=ext, dir=settings['tempdir'])
+    os.close(fd)
     try:
-        import timeit
-        total_time = timeit.timeit(rnd.render,
-                                   setup='import gc;gc.enable()',
-                                   number=1)
-    except (KeyboardInterrupt, SystemExit):
-        success = False
-    if success:
-        log_function = log.info
-        if rnd.frs_written > rnd.frs_to_render:
-            log_function = log.warn
-            log.warn('Unexpected write ratio')
-        log_function('Write ratio: {}/{}, ({:.2f}%)'.format(
-                 rnd.frs_written,
-                 rnd.frs_to_render,
-                 rnd.frs_written*100.0/rnd.frs_to_render))
-        txt = 'Final output frames: {} source, +{} interpolated, +{} duped, -{} dropped'
-        if not settings['quiet']:
-            log.info(txt.format(rnd.source_frs,
-                                rnd.frs_interpolated,
-                                rnd.frs_duped,
-                                rnd.frs_dropped))
-        old_sz = os.path.getsize(args.video) / 1024.0
-        new_sz = os.path.getsize(args.output_path) / 1024.0
-        log.info('Output file size:\t{:.2f} kB ({:.2f} kB)'.format(new_sz,
-                 new_sz - old_sz))
-        log.info('Rendering took {:.3g} mins, done.'.format(total_time / 60))
-        return 0
-    else:
-        log.warn('Quit unexpectedly')
-        log.warn('Files were left in the cache @ '+settings['tempdir']+'.')
-        return 1
+        encoders.encode_sample(path, w, h, rate)
+        return avinfo.get_av_info(path)
+    finally:
+        os.remove(path)
 
 
 def time_str_to_milliseconds(s):
@@ -525,8 +1005,8 @@ def w_h_from_input_str(s, src_w, src_h):
         raise ValueError('Unknown W:H syntax: {}'.format(s))
 
 
-def sequence_from_input_str(s, src_duration, src_frs):
-    seq = VideoSequence(src_duration, src_frs)
+def sequence_from_input_str(s, src_duration, src_frs, fr_table=None):
+    seq = VideoSequence(src_duration, src_frs, fr_table)
     if not s:
         seq.subregions[0].skip = False
         return seq
@@ -534,41 +1014,160 @@ def sequence_from_input_str(s, src_duration, src_frs):
     partition = list(src_duration.partition('.'))
     partition[-1] = partition[-1][:3]  # keep secs.xxx...
     src_duration = ''.join(partition)
-    s = re.sub(sr_ful_pattern,
-               'a=0,b={}'.format(src_duration), re.sub(sr_end_pattern,
-                                                       src_duration, s))
-    subs = re.split(':a', s)
-    new_subs = []
-    if len(subs) > 1:
-        for sub in subs:
-            if not sub.startswith('a'):
-                new_subs.append('a'+sub)
+    s = re.sub(sr_ful_pattern, 'a=0,b={}'.format(sr_end_pattern), s)
+    added = []
+    for substr in re.split(sr_sep_pattern, s):
+        fr_match = re.match(sr_fr_pattern, substr)
+        match = fr_match or re.match(sr_pattern, re.sub(sr_end_pattern,
+                                                        src_duration, substr))
+        if not match:
+            raise ValueError('Unknown subregion syntax: {}'.format(substr))
+        try:
+            if fr_match:
+                sub = seq.subregion_at_frs(
+                    fr_from_value(match.groupdict()['fr_a'], src_frs),
+                    fr_from_value(match.groupdict()['fr_b'], src_frs))
             else:
-                new_subs.append(sub)
-        subs = new_subs
-    for sub in subs:
-        match = re.match(sr_pattern, sub)
-        if match:
-            substr = str(sub)
-            try:
                 sub = Subregion(
-                           time_str_to_milliseconds(match.groupdict()['tm_a']),
-                           time_str_to_milliseconds(match.groupdict()['tm_b']))
-            except AttributeError as e:
-                raise AttributeError("Bad subregion: {} ({})".format(substr, e))
-            target = match.groupdict()['target']
-            val = match.groupdict()['val']
-            if target == 'fps':
-                val = rate_from_input_str(val, -1)
-            elif target == 'dur':
-                val = float(val)*1000.0
-            elif target == 'spd':
-                val = float(val)
-            setattr(sub, 'target_'+target, val)
-            try:
-                seq.add_subregion(sub)
-            except ValueError as e:
-                raise ValueError("Bad subregion: {} ({})".format(substr, e))
+                    time_str_to_milliseconds(match.groupdict()['tm_a']),
+                    time_str_to_milliseconds(match.groupdict()['tm_b']))
+        except AttributeError as e:
+            raise AttributeError("Bad subregion: {} ({})".format(substr, e))
+        except ValueError as e:
+            raise ValueError("Bad subregion: {} ({})".format(substr, e))
+        target = match.groupdict()['target']
+        val = match.groupdict()['val']
+        if target == 'fps':
+            val = rate_from_input_str(val, -1)
+        elif target == 'dur':
+            val = float(val)*1000.0
+        elif target == 'spd':
+            val = float(val)
+        setattr(sub, 'target_'+target, val)
+        try:
+            seq.check_in_range(sub)
+        except ValueError as e:
+            raise ValueError("Bad subregion: {} ({})".format(substr, e))
+        added.append(sub)
+    seq.add_subregions(added)
+    return seq
+
+
+def subregion_rows(path):
+    # returns (row, fields) for every subregion in a json or csv file, `-`
+    # reads from stdin. csv rows are numbered by line, including the header
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path) as f:
+            text = f.read()
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json' or \
+            extension != '.csv' and text.lstrip()[:1] == '[':
+        try:
+            rows = json.loads(text)
+        except ValueError as error:
+            raise ValueError('Bad subregions file: {}'.format(error))
+        if not isinstance(rows, list):
+            raise ValueError('Bad subregions file: expected a list')
+        for i, row in enumerate(rows):
+            yield i+1, row
+        return
+    reader = csv.DictReader(text.splitlines())
+    for row in reader:
+        if None in row:
+            raise ValueError('Bad subregion in row {}: more values than '
+                             'columns'.format(reader.line_num))
+        yield reader.line_num, dict((k.strip(), v.strip()) for k, v in
+                                    row.items() if v is not None)
+
+
+def ms_from_value(x, src_duration):
+    # a number of seconds or a TIME as in `-s`
+    if isinstance(x, (int, float)) and not isinstance(x, bool):
+        if x < 0:
+            raise ValueError('time < 0: {}'.format(x))
+        return x * 1000.0
+    if not isinstance(x, basestring):
+        raise ValueError('bad time: {}'.format(x))
+    if x == sr_end_pattern:
+        return src_duration
+    if not tm_re.match(x):
+        raise ValueError('bad time: {}'.format(x))
+    return time_str_to_milliseconds(x)
+
+
+def fr_from_value(x, src_frs):
+    if isinstance(x, basestring):
+        if x == sr_end_pattern:
+            return src_frs-1
+        if not x.isdigit():
+            raise ValueError('bad frame: {}'.format(x))
+        x = int(x)
+    if not isinstance(x, int) or isinstance(x, bool) or x < 0:
+        raise ValueError('bad frame: {}'.format(x))
+    if x >= src_frs:
+        raise ValueError('frame {} >= frames={}'.format(x, src_frs))
+    return x
+
+
+def subregion_from_row(row, seq):
+    if not isinstance(row, dict):
+        raise ValueError('expected an object')
+    row = dict((k, v) for k, v in row.items() if v is not None and v != '')
+    unknown = sorted(set(row) - set(['a', 'b', 'fa', 'fb', 'spd', 'dur',
+                                     'fps']))
+    if len(unknown) > 0:
+        raise ValueError('unknown fields: {}'.format(', '.join(unknown)))
+    if 'fa' in row or 'fb' in row:
+        if 'a' in row or 'b' in row:
+            raise ValueError('has both times and frames')
+        if 'fa' not in row or 'fb' not in row:
+            raise ValueError('needs both `fa` and `fb`')
+        sub = seq.subregion_at_frs(fr_from_value(row['fa'], seq.frames),
+                                   fr_from_value(row['fb'], seq.frames))
+    else:
+        if 'a' not in row or 'b' not in row:
+            raise ValueError('needs both `a` and `b`, or `fa` and `fb`')
+        sub = Subregion(ms_from_value(row['a'], seq.duration),
+                        ms_from_value(row['b'], seq.duration))
+    targets = [x for x in ['fps', 'dur', 'spd'] if x in row]
+    if len(targets) != 1:
+        raise ValueError('needs one of `spd`, `dur`, or `fps`')
+    target = targets[0]
+    try:
+        if target == 'fps':
+            val = rate_from_input_str(str(row[target]), -1)
         else:
-            raise ValueError('Unknown subregion syntax: {}'.format(sub))
+            val = float(row[target])
+    except (ValueError, TypeError):
+        raise ValueError('bad {}: {}'.format(target, row[target]))
+    if val <= 0:
+        raise ValueError('{} <= 0'.format(target))
+    if target == 'dur':
+        val *= 1000.0
+    setattr(sub, 'target_'+target, val)
+    return sub
+
+
+def sequence_from_file(path, src_duration, src_frs, fr_table=None):
+    # every row is checked before they're all added at once
+    seq = VideoSequence(src_duration, src_frs, fr_table)
+    subs = []
+    rows = {}
+    for n, row in subregion_rows(path):
+        try:
+            sub = subregion_from_row(row, seq)
+            seq.check_in_range(sub)
+        except (ValueError, AttributeError) as error:
+            raise ValueError('Bad subregion in row {}: {}'.format(n, error))
+        subs.append(sub)
+        rows[sub] = n
+    if len(subs) == 0:
+        raise ValueError('No subregions in {}'.format(path))
+    try:
+        seq.add_subregions(subs)
+    except OverlapError as error:
+        a, b = sorted(rows[x] for x in error.subregions)
+        raise ValueError('Subregions in rows {} and {} overlap'.format(a, b))
     return seq
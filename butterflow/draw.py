@@ -2,8 +2,7 @@
 
 import cv2
 import sys
-import collections
-import inspect
+import numpy as np
 from butterflow.settings import default as settings
 from butterflow.version import __version__
 
@@ -102,67 +101,14 @@ def draw_progress_bar(fr, progress=0.0):
         draw_rectangle(bar_v1, bar_v2)
 
 
-@draw_if_fr_fits(settings['txt_w_fits'], settings['txt_h_fits'], settings['txt_min_scale'])
-def draw_debug_text(fr, text_type, rate, optflow_fn, tot_frs_written, pair_a,
-                    pair_b, idx_between_pair, fr_type, is_dupe, frs_to_render,
-                    frs_written, sub, sub_idx, subs_to_render, drp_every,
-                    dup_every, src_seen, frs_interpolated, frs_dropped,
-                    frs_duped):
-    w = fr.shape[1]
-    h = fr.shape[0]
-    min_w = min(float(w)/settings['txt_w_fits'], settings['txt_max_scale'])
-    min_h = min(float(h)/settings['txt_h_fits'], settings['txt_max_scale'])
-    scale = min(min_w, min_h)
-
-    def draw_stroke(x, y):
-        cv2.putText(fr,
-                    x,
-                    y,
-                    settings['font_face'],
-                    scale,
-                    settings['dark_color'],
-                    settings['txt_stroke_thick'],
-                    settings['font_type'])
-
-    if text_type == 'dark':
-        color = settings['dark_color']
-    else:
-        color = settings['light_color']
-
-    def draw_text(x, y):
-        cv2.putText(fr,
-                    x,
-                    y,
-                    settings['font_face'],
-                    scale,
-                    color,
-                    settings['txt_thick'],
-                    settings['font_type'])
-
-    txt = "butterflow {} ({})\n"\
-          "Res: {}x{}\n"\
-          "Playback Rate: {:.2f} fps\n"
-    txt = txt.format(__version__, sys.platform, w, h, rate)
-
-    argspec = inspect.getargspec(optflow_fn)
-    defaults = list(argspec.defaults)
-    args = argspec.args[-len(defaults):]
-    flow_kwargs = collections.OrderedDict(zip(args, defaults))
-
-    if flow_kwargs is not None:
-        flow_format = ''
-        i = 0
-        for k, v in flow_kwargs.items():
-            value_format = "{}"
-            if isinstance(v, bool):
-                value_format = "{:1}"
-            flow_format += ("{}: "+value_format).format(k.capitalize()[:1], v)
-            if i == len(flow_kwargs)-1:
-                flow_format += '\n\n'
-            else:
-                flow_format += ', '
-            i += 1
-        txt += flow_format
+def debug_text_lines(header, rate, tot_frs_written, pair_a, pair_b,
+                     idx_between_pair, fr_type, is_dupe, frs_to_render,
+                     frs_written, sub, sub_idx, subs_to_render, drp_every,
+                     dup_every, src_seen, frs_interpolated, frs_dropped,
+                     frs_duped, mem):
+    # the lines of debug info drawn on the left and right of a frame, header
+    # is from header_text
+    txt = header
 
     def yn_str(bool):
         if bool:
@@ -181,19 +127,8 @@ def draw_debug_text(fr, text_type, rate, optflow_fn, tot_frs_written, pair_a,
                      yn_str(fr_type == 'SOURCE'),
                      yn_str(fr_type == 'INTERPOLATED'),
                      yn_str(is_dupe > 0),
-                     hex(id(fr)))
-
-    for i, line in enumerate(txt.split('\n')):
-        line_sz, _ = cv2.getTextSize(line,
-                                     settings['font_face'],
-                                     scale,
-                                     settings['txt_thick'])
-        _, line_h = line_sz
-        origin = (int(settings['txt_l_pad']), int(settings['txt_t_pad'] +
-                  (i * (line_h + settings['txt_ln_b_pad']))))
-        if text_type == 'stroke':
-            draw_stroke(line, origin)
-        draw_text(line, origin)
+                     mem)
+    l_lines = txt.split('\n')
 
     txt = "Region {}/{}, F: [{}, {}], T: [{:.2f}, {:.2f}s]\n"\
           "Len F: {}, T: {:.2f}s\n"
@@ -231,8 +166,95 @@ def draw_debug_text(fr, text_type, rate, optflow_fn, tot_frs_written, pair_a,
                      frs_written,
                      frs_to_render,
                      frs_written * 100.0 / frs_to_render)
+    r_lines = txt.split('\n')
+    return l_lines, r_lines
+
 
-    for i, line in enumerate(txt.split('\n')):
+def header_text(w, h, rate, optflow_fn):
+    txt = "butterflow {} ({})\n"\
+          "Res: {}x{}\n"\
+          "Playback Rate: {:.2f} fps\n"
+    txt = txt.format(__version__, sys.platform, w, h, rate)
+
+    flow_kwargs = optflow_fn.params()
+
+    if len(flow_kwargs) > 0:
+        flow_format = ''
+        i = 0
+        for k, v in flow_kwargs.items():
+            value_format = "{}"
+            if isinstance(v, bool):
+                value_format = "{:1}"
+            flow_format += ("{}: "+value_format).format(k.capitalize()[:1], v)
+            if i == len(flow_kwargs)-1:
+                flow_format += '\n\n'
+            else:
+                flow_format += ', '
+            i += 1
+        txt += flow_format
+    return txt
+
+
+def txt_scale(w, h):
+    min_w = min(float(w)/settings['txt_w_fits'], settings['txt_max_scale'])
+    min_h = min(float(h)/settings['txt_h_fits'], settings['txt_max_scale'])
+    return min(min_w, min_h)
+
+
+@draw_if_fr_fits(settings['txt_w_fits'], settings['txt_h_fits'], settings['txt_min_scale'])
+def draw_debug_text(fr, text_type, rate, optflow_fn, tot_frs_written, pair_a,
+                    pair_b, idx_between_pair, fr_type, is_dupe, frs_to_render,
+                    frs_written, sub, sub_idx, subs_to_render, drp_every,
+                    dup_every, src_seen, frs_interpolated, frs_dropped,
+                    frs_duped):
+    w = fr.shape[1]
+    h = fr.shape[0]
+    scale = txt_scale(w, h)
+
+    def draw_stroke(x, y):
+        cv2.putText(fr,
+                    x,
+                    y,
+                    settings['font_face'],
+                    scale,
+                    settings['dark_color'],
+                    settings['txt_stroke_thick'],
+                    settings['font_type'])
+
+    if text_type == 'dark':
+        color = settings['dark_color']
+    else:
+        color = settings['light_color']
+
+    def draw_text(x, y):
+        cv2.putText(fr,
+                    x,
+                    y,
+                    settings['font_face'],
+                    scale,
+                    color,
+                    settings['txt_thick'],
+                    settings['font_type'])
+
+    l_lines, r_lines = debug_text_lines(
+        header_text(w, h, rate, optflow_fn), rate, tot_frs_written, pair_a,
+        pair_b, idx_between_pair, fr_type, is_dupe, frs_to_render,
+        frs_written, sub, sub_idx, subs_to_render, drp_every, dup_every,
+        src_seen, frs_interpolated, frs_dropped, frs_duped, hex(id(fr)))
+
+    for i, line in enumerate(l_lines):
+        line_sz, _ = cv2.getTextSize(line,
+                                     settings['font_face'],
+                                     scale,
+                                     settings['txt_thick'])
+        _, line_h = line_sz
+        origin = (int(settings['txt_l_pad']), int(settings['txt_t_pad'] +
+                  (i * (line_h + settings['txt_ln_b_pad']))))
+        if text_type == 'stroke':
+            draw_stroke(line, origin)
+        draw_text(line, origin)
+
+    for i, line in enumerate(r_lines):
         line_sz, _ = cv2.getTextSize(line,
                                      settings['font_face'],
                                      scale,
@@ -244,3 +266,203 @@ def draw_debug_text(fr, text_type, rate, optflow_fn, tot_frs_written, pair_a,
         if text_type == 'stroke':
             draw_stroke(line, origin)
         draw_text(line, origin)
+
+
+def fits(fr, w_fits, h_fits, min_scale):
+    scale = min(float(fr.shape[1]) / float(w_fits),
+                float(fr.shape[0]) / float(h_fits))
+    return scale >= min_scale
+
+
+class Sprite(object):
+    # something drawn once onto a black canvas, with its coverage as alpha,
+    # that can be blended onto frames at (x, y)
+    def __init__(self, w, h):
+        self.fr = np.zeros((h, w, 3), dtype=np.uint8)
+        self.alpha = np.zeros((h, w), dtype=np.uint8)
+
+    def done(self):
+        # the canvas holds color*coverage, blending is then
+        # fr*(1-alpha) + canvas
+        self.inv_alpha = (255 - self.alpha).astype(np.uint16)[:,:,np.newaxis]
+        self.fr_16 = self.fr.astype(np.uint16) * 255
+
+    def blend(self, fr, x, y, saved=None):
+        h, w = self.alpha.shape
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(fr.shape[1], x + w), min(fr.shape[0], y + h)
+        if x2 <= x1 or y2 <= y1:
+            return
+        roi = fr[y1:y2, x1:x2]
+        if saved is not None:
+            saved.append((y1, y2, x1, x2, roi.copy()))
+        sx, sy = x1 - x, y1 - y
+        inv_alpha = self.inv_alpha[sy:sy+y2-y1, sx:sx+x2-x1]
+        fr_16 = self.fr_16[sy:sy+y2-y1, sx:sx+x2-x1]
+        roi[...] = (roi * inv_alpha + fr_16) // 255
+
+
+class Overlay(object):
+    # draws the same things as draw_marker, draw_progress_bar and
+    # draw_debug_text. everything is rasterized once as a sprite and blended
+    # onto frames, only lines of text whose values changed are rasterized
+    # again. what's drawn while saving can be undone with restore() so that a
+    # frame can be written more than once with different info without copying
+    # it
+    def __init__(self, text_type, rate, optflow_fn):
+        self.text_type = text_type
+        self.rate = rate
+        self.optflow_fn = optflow_fn
+        self.headers = {}
+        self.lines = {}    # (side, line number) -> (text, scale, sprite)
+        self.markers = {}  # fill -> sprite
+        self.bars = {}     # (w, h) -> sprite, geometry
+        self.saved = []
+        self.saving = False
+
+    def save(self):
+        self.saving = True
+
+    def restore(self, fr):
+        for y1, y2, x1, x2, roi in reversed(self.saved):
+            fr[y1:y2, x1:x2] = roi
+        self.saved = []
+        self.saving = False
+
+    def blend(self, sprite, fr, x, y):
+        sprite.blend(fr, x, y, self.saved if self.saving else None)
+
+    def text_sprite(self, line, scale):
+        # lines are placed by their size at txt_thick, like draw_debug_text,
+        # the canvas has room around them for the stroke
+        (line_w, line_h), baseline = cv2.getTextSize(
+            line, settings['font_face'], scale, settings['txt_thick'])
+        pad = settings['txt_stroke_thick'] + 1
+        sprite = Sprite(line_w + pad*2, line_h + baseline + pad*2)
+        sprite.line_w, sprite.line_h = line_w, line_h
+        sprite.pad = pad
+        sprite.top = line_h + pad
+        origin = (pad, line_h + pad)
+        if self.text_type == 'dark':
+            color = settings['dark_color']
+        else:
+            color = settings['light_color']
+        draws = []
+        if self.text_type == 'stroke':
+            draws.append((settings['dark_color'],
+                          settings['txt_stroke_thick']))
+        draws.append((color, settings['txt_thick']))
+        for color, thick in draws:
+            cv2.putText(sprite.fr, line, origin, settings['font_face'], scale,
+                        color, thick, settings['font_type'])
+            cv2.putText(sprite.alpha, line, origin, settings['font_face'],
+                        scale, 255, thick, settings['font_type'])
+        sprite.done()
+        return sprite
+
+    def line_sprite(self, side, i, line, scale):
+        key = (side, i)
+        cached = self.lines.get(key)
+        if cached is not None and cached[0] == line and cached[1] == scale:
+            return cached[2]
+        sprite = self.text_sprite(line, scale)
+        self.lines[key] = (line, scale, sprite)
+        return sprite
+
+    def debug_text(self, fr, tot_frs_written, pair_a, pair_b,
+                   idx_between_pair, fr_type, is_dupe, frs_to_render,
+                   frs_written, sub, sub_idx, subs_to_render, drp_every,
+                   dup_every, src_seen, frs_interpolated, frs_dropped,
+                   frs_duped):
+        if not fits(fr, settings['txt_w_fits'], settings['txt_h_fits'],
+                    settings['txt_min_scale']):
+            return
+        w = fr.shape[1]
+        h = fr.shape[0]
+        scale = txt_scale(w, h)
+        if (w, h) not in self.headers:
+            self.headers[(w, h)] = header_text(w, h, self.rate,
+                                               self.optflow_fn)
+        l_lines, r_lines = debug_text_lines(
+            self.headers[(w, h)], self.rate, tot_frs_written, pair_a,
+            pair_b, idx_between_pair, fr_type, is_dupe, frs_to_render,
+            frs_written, sub, sub_idx, subs_to_render, drp_every, dup_every,
+            src_seen, frs_interpolated, frs_dropped, frs_duped, hex(id(fr)))
+        for side, lines in (('l', l_lines), ('r', r_lines)):
+            for i, line in enumerate(lines):
+                if line == '':
+                    continue
+                sprite = self.line_sprite(side, i, line, scale)
+                y = int(settings['txt_t_pad'] +
+                        (i * (sprite.line_h + settings['txt_ln_b_pad'])))
+                if side == 'l':
+                    x = int(settings['txt_l_pad'])
+                else:
+                    x = int(w - settings['txt_r_pad'] - sprite.line_w)
+                self.blend(sprite, fr, x - sprite.pad, y - sprite.top)
+
+    def marker(self, fr, fill=True):
+        if not fits(fr, settings['mrk_w_fits'], settings['mrk_h_fits'], 1.0):
+            return
+        r = settings['mrk_out_radius']
+        if fill not in self.markers:
+            sprite = Sprite(r*2+3, r*2+3)
+            center = (r+1, r+1)
+            color = settings['mrk_color']
+            if fill:
+                color = settings['mrk_fill_color']
+            for c, radius, thick in (
+                    (settings['mrk_out_color'], r, settings['mrk_out_thick']),
+                    (color, settings['mrk_in_radius'],
+                     settings['mrk_in_thick'])):
+                cv2.circle(sprite.fr, center, radius, c, thick,
+                           settings['mrk_ln_type'])
+                cv2.circle(sprite.alpha, center, radius, 255, thick,
+                           settings['mrk_ln_type'])
+            sprite.done()
+            self.markers[fill] = sprite
+        w = fr.shape[1]
+        h = fr.shape[0]
+        x = int(w - (settings['mrk_r_pad'] + r))
+        y = int(h - settings['mrk_d_pad'] - r)
+        self.blend(self.markers[fill], fr, x - (r+1), y - (r+1))
+
+    def progress_bar(self, fr, progress=0.0):
+        # the outline is a sprite, the bar inside is a plain rectangle
+        if not fits(fr, settings['bar_w_fits'], settings['bar_h_fits'], 1.0):
+            return
+        w = fr.shape[1]
+        h = fr.shape[0]
+        if (w, h) not in self.bars:
+            canvas = np.zeros((h, w, 3), dtype=np.uint8)
+            draw_progress_bar(canvas, progress=0.0)
+            mask = np.any(canvas > 0, axis=2)
+            ys, xs = np.nonzero(mask)
+            y1, y2, x1, x2 = ys.min(), ys.max()+1, xs.min(), xs.max()+1
+            sprite = Sprite(x2 - x1, y2 - y1)
+            sprite.fr[...] = canvas[y1:y2, x1:x2]
+            sprite.alpha[mask[y1:y2, x1:x2]] = 255
+            sprite.done()
+            self.bars[(w, h)] = (sprite, x1, y1)
+        sprite, x, y = self.bars[(w, h)]
+        self.blend(sprite, fr, x, y)
+        if progress > 0:
+            # same geometry as draw_progress_bar
+            t_v1 = (int(w * settings['bar_s_pad']),
+                    int(h * settings['bar_t_pad']))
+            t_v2_x = int(w * (1 - settings['bar_s_pad']))
+            pad = settings['bar_ln_thick'] + settings['bar_in_pad']
+            b_v2_y = t_v1[1] + settings['bar_ln_thick'] + \
+                2 * settings['bar_in_pad'] + settings['bar_thick'] + \
+                settings['bar_ln_thick']
+            max_w = int(t_v2_x - pad)
+            min_w = int(t_v1[0] + pad)
+            bar_v1 = (t_v1[0] + pad, t_v1[1] + pad)
+            bar_v2 = (max(min_w, min(max_w, int(max_w * progress))),
+                      b_v2_y - pad)
+            cv2.rectangle(fr, (bar_v1[0] - 1, bar_v1[1] - 1),
+                          (bar_v2[0] + 1, bar_v2[1] + 1),
+                          settings['bar_stroke_color'],
+                          settings['bar_ln_type'])
+            cv2.rectangle(fr, bar_v1, bar_v2, settings['bar_color'],
+                          settings['bar_ln_type'])
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# video writers that rendered frames are piped into. PipeEncoder is a single
+# ffmpeg process. SegmentedEncoder spreads consecutive runs of whole GOPs
+# across several ffmpeg processes so that slow presets can use more cores, and
+# joins the segments without re-encoding them when it's closed
+
+import os
+import subprocess
+import threading
+import Queue
+from butterflow.settings import default as settings
+from butterflow import mux
+
+import logging
+log = logging.getLogger('butterflow')
+
+
+def encoder_call(dest, w, h, rate, lossless, src=None, audio_regions=None,
+                 gop=None, crf=None):
+    # with audio_regions, the audio is taken from those regions of src and
+    # encoded alongside the video. gop fixes the keyframe interval
+    if crf is None:
+        crf = settings['crf']
+    vf = []
+    vf.append('format=yuv420p')
+    call = [
+        settings['avutil'],
+        '-loglevel', settings['av_loglevel'],
+        '-y',
+        '-threads', '0',
+        '-f', 'rawvideo',
+        '-pix_fmt', 'bgr24',
+        '-s', '{}x{}'.format(w, h),
+        '-r', str(rate),
+        '-i', '-']
+    if audio_regions:
+        call.extend([
+            '-i', src,
+            '-filter_complex', mux.audio_filter_graph(audio_regions,
+                                                      stream='1:a'),
+            '-map', '0:v',
+            '-map', '[out]'])
+    call.extend([
+        '-map_metadata', '-1',
+        '-map_chapters', '-1',
+        '-vf', ','.join(vf),
+        '-r', str(rate)])
+    if audio_regions:
+        if settings['ca'] == 'aac':
+            call.extend(['-strict', '-2'])
+        call.extend(['-c:a', settings['ca'], '-b:a', settings['ba']])
+    else:
+        call.append('-an')
+    call.extend([
+        '-sn',
+        '-c:v', settings['cv'],
+        '-preset', settings['preset']])
+    if gop is not None:
+        call.extend(['-g', str(gop)])
+    if settings['cv'] == 'libx264':
+        quality = ['-crf', str(crf)]
+        if lossless:
+            quality = ['-qp', '0']
+        call.extend(quality)
+        call.extend(['-level', '4.2'])
+    params = []
+    call.extend(['-{}-params'.format(settings['cv'].replace('lib', ''))])
+    params.append('log-level={}'.format(settings['enc_loglevel']))
+    if settings['cv'] == 'libx265':
+        quality = 'crf={}'.format(crf)
+        if lossless:
+            # Bug: https://trac.ffmpeg.org/ticket/4284
+            quality = 'lossless=1'
+        params.append(quality)
+    if len(params) > 0:
+        call.extend([':'.join(params)])
+    call.extend([dest])
+    return call
+
+
+def encode_sample(dest, w, h, rate):
+    # a black frame encoded like the renders are, to see which stream
+    # parameters the encoder picks
+    encoder = PipeEncoder(encoder_call(dest, w, h, rate, False))
+    encoder.pipe.stdin.write(b'\0' * (w * h * 3))
+    encoder.close()
+
+
+class PipeEncoder(object):
+    def __init__(self, call):
+        log.info('[Subprocess] Opening a pipe to the video writer')
+        log.debug('Call: {}'.format(' '.join(call)))
+        self.pipe = subprocess.Popen(call, stdin=subprocess.PIPE)
+        if self.pipe == 1:
+            raise RuntimeError
+
+    def write(self, fr, info=None):
+        self.pipe.stdin.write(bytes(fr.data))
+
+    def close(self):
+        if self.pipe and not self.pipe.stdin.closed:
+            self.pipe.stdin.flush()
+            self.pipe.stdin.close()
+            self.pipe.wait()
+            log.info('[Subprocess] Closing pipe to the video writer')
+
+    def abort(self):
+        # stops the encoder without finishing the file
+        if self.pipe.poll() is None:
+            self.pipe.kill()
+        try:
+            self.pipe.stdin.close()
+        except IOError:  # frames left in the pipe
+            pass
+        self.pipe.wait()
+
+
+class Segment(object):
+    # an encoder process fed from a queue by its own thread, so that the
+    # renderer can move on to the next segment while this one is encoding
+    def __init__(self, call, maxsize):
+        log.debug('Call: {}'.format(' '.join(call)))
+        self.pipe = subprocess.Popen(call, stdin=subprocess.PIPE)
+        self.queue = Queue.Queue(maxsize)
+        self.frs = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.feed)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def feed(self):
+        try:
+            while True:
+                dat = self.queue.get()
+                if dat is None:
+                    break
+                self.pipe.stdin.write(dat)
+        except IOError as error:  # the encoder quit early
+            self.error = error
+        self.pipe.stdin.close()
+        self.pipe.wait()
+
+    def write(self, fr, info=None):
+        self.queue.put(bytes(fr.data))  # copy, frs can be drawn on later
+        self.frs += 1
+
+    def finish(self):
+        self.queue.put(None)
+
+    def join(self):
+        self.thread.join()
+        if self.error is not None or self.pipe.returncode != 0:
+            raise RuntimeError('Encoding a segment failed')
+
+    def abort(self):
+        # the feeding thread is either writing, and fails now that the encoder
+        # is gone, or waiting on an empty queue
+        if self.pipe.poll() is None:
+            self.pipe.kill()
+        try:
+            self.queue.put_nowait(None)
+        except Queue.Full:
+            pass
+        self.thread.join()
+
+
+class SegmentedEncoder(object):
+    def __init__(self, dest, mk_call, encoders, tmp_id, gop=None, gops=None,
+                 audio_src=None, audio_regions=None):
+        # mk_call(dest, gop) makes the call for one segment. segments are
+        # gops*gop frames long, each starts on a keyframe. tmp_id keeps the
+        # segments of renders in the same process apart
+        if gop is None:
+            gop = settings['segment_gop']
+        if gops is None:
+            gops = settings['segment_gops']
+        self.dest = dest
+        self.mk_call = mk_call
+        self.encoders = encoders
+        self.tmp_id = tmp_id
+        self.gop = gop
+        self.seg_frs = gop * gops
+        self.audio_src = audio_src
+        self.audio_regions = audio_regions
+        self.files = []
+        self.running = []
+        self.segment = None
+        self.closed = False
+        log.info('[Subprocess] Encoding in %d frame segments with %d '
+                 'encoders', self.seg_frs, encoders)
+
+    def next_segment(self):
+        if self.segment is not None:
+            self.segment.finish()
+        while len(self.running) >= self.encoders:
+            self.running.pop(0).join()
+        name, ext = os.path.splitext(os.path.basename(self.dest))
+        seg_file = os.path.join(settings['tempdir'], '{}.{}.seg{}{}'.format(
+            name, self.tmp_id, len(self.files), ext))
+        log.debug('Encoding segment %d:\t%s', len(self.files),
+                  os.path.basename(seg_file))
+        self.files.append(seg_file)
+        # a few frames, raw frames are large. the encoder's own lookahead
+        # keeps it busy after the renderer moves on to the next segment
+        self.segment = Segment(self.mk_call(seg_file, self.gop),
+                               settings['segment_queue_frs'])
+        self.running.append(self.segment)
+
+    def write(self, fr, info=None):
+        if self.segment is None or self.segment.frs >= self.seg_frs:
+            self.next_segment()
+        self.segment.write(fr)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.segment is not None:
+            self.segment.finish()
+        for segment in self.running:
+            segment.join()
+        self.running = []
+        log.info('[Subprocess] Closing %d segments', len(self.files))
+        if len(self.files) > 0:
+            mux.concat_av_files(self.dest, self.files, self.audio_src,
+                                self.audio_regions)
+        for x in self.files:
+            log.info("Delete:\t%s", os.path.basename(x))
+            os.remove(x)
+
+    def abort(self):
+        # stops every encoder and deletes the segments without joining them
+        if self.closed:
+            return
+        self.closed = True
+        for segment in self.running:
+            segment.abort()
+        self.running = []
+        for x in self.files:
+            if os.path.exists(x):
+                os.remove(x)
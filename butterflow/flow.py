@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+# optical flow backends. every backend computes a dense displacement field
+# between two grayscale frames and returns it as a pair of horizontal and
+# vertical components, (u, v), such that prev[y,x] ~= next[y+v,x+u]
+
+import copy
+import collections
+import cv2
+import numpy as np
+from butterflow.settings import default as settings
+from butterflow import motion
+
+import logging
+log = logging.getLogger('butterflow')
+
+
+backends = collections.OrderedDict()
+
+
+def register_backend(cls):
+    backends[cls.name] = cls
+    return cls
+
+
+def get_backend(name, **kwargs):
+    if name not in backends:
+        raise ValueError('Unknown flow method: {}'.format(name))
+    cls = backends[name]
+    if not cls.available():
+        raise ValueError('Flow method is not available with this build of '
+                         'OpenCV: {}'.format(name))
+    return cls(**kwargs)
+
+
+def available_backends():
+    return [k for k, v in backends.items() if v.available()]
+
+
+_grids = {}
+
+
+def pixel_grid(h, w):
+    # x and y coordinates of every pixel, cached per frame size
+    if (h, w) not in _grids:
+        _grids[(h, w)] = np.meshgrid(np.arange(w, dtype=np.float32),
+                                     np.arange(h, dtype=np.float32))
+    return _grids[(h, w)]
+
+
+def warp_fr(fr, u, v):
+    # sample fr at each pixel plus its displacement
+    gx, gy = pixel_grid(*u.shape)
+    return cv2.remap(fr, gx + u, gy + v, cv2.INTER_LINEAR,
+                     borderMode=cv2.BORDER_REPLICATE)
+
+
+def photometric_error(fr_1, fr_2, u, v):
+    # mean abs difference left after warping fr_2 onto fr_1 along (u, v)
+    return np.mean(cv2.absdiff(fr_1, warp_fr(fr_2, u, v)))
+
+
+def invert_flow(fu, fv, iters=settings['bwd_invert_iters']):
+    # estimates the backward flow from the forward flow by solving
+    # b(q) = -f(q + b(q)) with fixed-point iterations, each one a single
+    # remap. pixels that don't settle, typically disocclusions where nothing
+    # in the previous frame lands, are treated as holes and filled from their
+    # settled neighbors. returns bu, bv, and the fraction of pixels that had
+    # to be filled
+    h, w = fu.shape
+    bu = -fu
+    bv = -fv
+    for i in range(iters):
+        bu, bv = -warp_fr(fu, bu, bv), -warp_fr(fv, bu, bv)
+    ru = bu + warp_fr(fu, bu, bv)
+    rv = bv + warp_fr(fv, bu, bv)
+    settled = (ru*ru + rv*rv) <= 0.25  # within half a pixel
+    holes = 1.0 - np.count_nonzero(settled) / float(h*w)
+    # normalized convolution with a growing window until every hole is
+    # covered by at least one settled pixel
+    mask = np.float32(settled)
+    bu *= mask
+    bv *= mask
+    ksize = 3
+    while not settled.all() and ksize < 2*max(h, w):
+        den = cv2.blur(mask, (ksize, ksize))
+        num_u = cv2.blur(bu, (ksize, ksize))
+        num_v = cv2.blur(bv, (ksize, ksize))
+        fill = ~settled & (den > 0)
+        bu[fill] = num_u[fill] / den[fill]
+        bv[fill] = num_v[fill] / den[fill]
+        settled |= fill
+        mask[fill] = 1.0
+        ksize = ksize*2 + 1
+    return bu, bv, holes
+
+
+class FlowBackend(object):
+    name = None
+    uses_ocl = False
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def params(self):
+        # ordered name and value pairs, shown when embedding debug info
+        return collections.OrderedDict()
+
+    def compute(self, prev_gr, next_gr):
+        raise NotImplementedError
+
+    def compute_bidir(self, prev_gr, next_gr):
+        # forward and backward flows, (fu, fv, bu, bv). backends override
+        # this when they can share work between the two directions
+        fu, fv = self.compute(prev_gr, next_gr)
+        bu, bv = self.compute(next_gr, prev_gr)
+        return fu, fv, bu, bv
+
+    def on_cpu(self):
+        # a backend that computes the same flows without OpenCL
+        return self
+
+    def __call__(self, prev_gr, next_gr):
+        return self.compute(prev_gr, next_gr)
+
+
+@register_backend
+class FarnebackFlow(FlowBackend):
+    name = 'farneback'
+
+    def __init__(self, pyr=settings['pyr_scale'], levels=settings['levels'],
+                 winsize=settings['winsize'], iters=settings['iters'],
+                 polyn=settings['poly_n'], polys=settings['poly_s'],
+                 fast=settings['fast_pyr'], filt=0, use_ocl=True):
+        self.pyr = pyr
+        self.levels = levels
+        self.winsize = winsize
+        self.iters = iters
+        self.polyn = polyn
+        self.polys = polys
+        self.fast = fast
+        self.filt = filt
+        self.uses_ocl = use_ocl
+
+    def params(self):
+        return collections.OrderedDict([
+            ('pyr', self.pyr), ('levels', self.levels),
+            ('winsize', self.winsize), ('iters', self.iters),
+            ('polyn', self.polyn), ('polys', self.polys),
+            ('fast', self.fast), ('filt', self.filt)])
+
+    def compute(self, prev_gr, next_gr):
+        if self.uses_ocl:
+            fu, fv = motion.ocl_farneback_optical_flow(
+                prev_gr, next_gr, self.pyr, self.levels, self.winsize,
+                self.iters, self.polyn, self.polys, self.fast, self.filt)
+            return fu, fv
+        flow = cv2.calcOpticalFlowFarneback(
+            prev_gr, next_gr, self.pyr, self.levels, self.winsize,
+            self.iters, self.polyn, self.polys, self.filt)
+        return flow[:,:,0], flow[:,:,1]
+
+    def compute_bidir(self, prev_gr, next_gr):
+        if self.uses_ocl:
+            fu, fv, bu, bv = motion.ocl_farneback_optical_flow_bidir(
+                prev_gr, next_gr, self.pyr, self.levels, self.winsize,
+                self.iters, self.polyn, self.polys, self.fast, self.filt)
+            return fu, fv, bu, bv
+        return super(FarnebackFlow, self).compute_bidir(prev_gr, next_gr)
+
+    def on_cpu(self):
+        backend = copy.copy(self)
+        backend.uses_ocl = False
+        return backend
+
+
+@register_backend
+class DisFlow(FlowBackend):
+    # dense inverse search, only in OpenCV >= 3.3. typically several times
+    # faster than farneback on the cpu at a comparable quality
+    name = 'dis'
+    presets = {'ultrafast': 0, 'fast': 1, 'medium': 2}
+
+    def __init__(self, preset=settings['dis_preset']):
+        if preset not in self.presets:
+            raise ValueError('Unknown DIS preset: {}'.format(preset))
+        self.preset = preset
+        self.dis = None
+
+    @classmethod
+    def available(cls):
+        return hasattr(cv2, 'DISOpticalFlow_create')
+
+    def params(self):
+        return collections.OrderedDict([('preset', self.preset)])
+
+    def compute(self, prev_gr, next_gr):
+        if self.dis is None:  # create lazily, the object can't be pickled
+            self.dis = cv2.DISOpticalFlow_create(self.presets[self.preset])
+        flow = self.dis.calc(prev_gr, next_gr, None)
+        return flow[:,:,0], flow[:,:,1]
+
+
+@register_backend
+class BlockMatchFlow(FlowBackend):
+    # coarse-to-fine block matching. at each pyramid level the next frame is
+    # warped by the estimate from the level above and the remaining motion is
+    # found with an exhaustive search over a small radius. block costs are
+    # computed for every candidate displacement at once with a box filter so
+    # the whole search is a handful of vectorized passes over the image
+    name = 'bm'
+
+    def __init__(self, levels=settings['bm_levels'],
+                 radius=settings['bm_radius'], block=settings['bm_block'],
+                 min_level=settings['bm_min_level']):
+        self.levels = levels
+        self.radius = radius
+        self.block = block
+        self.min_level = min(min_level, levels)
+
+    def params(self):
+        return collections.OrderedDict([
+            ('levels', self.levels), ('radius', self.radius),
+            ('block', self.block), ('min_level', self.min_level)])
+
+    def search(self, prev_l, next_l):
+        h, w = prev_l.shape
+        r = self.radius
+        padded = cv2.copyMakeBorder(next_l, r, r, r, r, cv2.BORDER_REPLICATE)
+        best_cost = None
+        best_u = np.zeros((h, w), dtype=np.float32)
+        best_v = np.zeros((h, w), dtype=np.float32)
+        # search outward from zero so ties favor the smallest motion
+        offsets = [(dx, dy) for dy in range(-r, r+1) for dx in range(-r, r+1)]
+        offsets.sort(key=lambda x: x[0]*x[0] + x[1]*x[1])
+        for dx, dy in offsets:
+            shifted = padded[r+dy:r+dy+h, r+dx:r+dx+w]
+            cost = cv2.blur(cv2.absdiff(prev_l, shifted),
+                            (self.block, self.block))
+            if best_cost is None:
+                best_cost = cost
+                continue
+            better = cost < best_cost
+            best_cost[better] = cost[better]
+            best_u[better] = dx
+            best_v[better] = dy
+        return best_u, best_v
+
+    def pyramid(self, fr):
+        pyr = [np.float32(fr)]
+        for i in range(self.levels):
+            pyr.append(cv2.pyrDown(pyr[-1]))
+        return pyr
+
+    def compute_from_pyramids(self, prev_pyr, next_pyr):
+        h, w = prev_pyr[0].shape
+        u = None
+        v = None
+        for level in range(self.levels, self.min_level-1, -1):
+            prev_l = prev_pyr[level]
+            next_l = next_pyr[level]
+            lh, lw = prev_l.shape
+            if u is None:
+                u = np.zeros((lh, lw), dtype=np.float32)
+                v = np.zeros((lh, lw), dtype=np.float32)
+                warped = next_l
+            else:
+                u = cv2.resize(u, (lw, lh), interpolation=cv2.INTER_LINEAR)*2
+                v = cv2.resize(v, (lw, lh), interpolation=cv2.INTER_LINEAR)*2
+                gx, gy = np.meshgrid(np.arange(lw, dtype=np.float32),
+                                     np.arange(lh, dtype=np.float32))
+                warped = cv2.remap(next_l, gx + u, gy + v, cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_REPLICATE)
+            du, dv = self.search(prev_l, warped)
+            u += du
+            v += dv
+        scale = 2 ** self.min_level
+        u = cv2.resize(cv2.blur(u, (3, 3)), (w, h),
+                       interpolation=cv2.INTER_LINEAR) * scale
+        v = cv2.resize(cv2.blur(v, (3, 3)), (w, h),
+                       interpolation=cv2.INTER_LINEAR) * scale
+        return u, v
+
+    def compute(self, prev_gr, next_gr):
+        return self.compute_from_pyramids(self.pyramid(prev_gr),
+                                          self.pyramid(next_gr))
+
+    def compute_bidir(self, prev_gr, next_gr):
+        # build each pyramid once and use it for both directions
+        prev_pyr = self.pyramid(prev_gr)
+        next_pyr = self.pyramid(next_gr)
+        fu, fv = self.compute_from_pyramids(prev_pyr, next_pyr)
+        bu, bv = self.compute_from_pyramids(next_pyr, prev_pyr)
+        return fu, fv, bu, bv
+
+
+class EstimatedBackwardFlow(FlowBackend):
+    # wraps a backend to derive the backward flow by inverting the forward
+    # flow instead of computing it, halving the cost per pair. the estimate
+    # is checked against the frames and the true backward flow is computed
+    # when it warps noticeably worse than the forward flow or when too much of
+    # it had to be filled in
+    def __init__(self, backend, max_err_ratio=settings['bwd_max_err_ratio'],
+                 max_holes=settings['bwd_max_holes']):
+        self.backend = backend
+        self.name = backend.name
+        self.uses_ocl = backend.uses_ocl
+        self.max_err_ratio = max_err_ratio
+        self.max_holes = max_holes
+        self.estimated = 0
+        self.fallbacks = 0
+
+    def params(self):
+        params = self.backend.params()
+        params['bwd'] = 'est'
+        return params
+
+    def compute(self, prev_gr, next_gr):
+        return self.backend.compute(prev_gr, next_gr)
+
+    def on_cpu(self):
+        return EstimatedBackwardFlow(self.backend.on_cpu(),
+                                     self.max_err_ratio, self.max_holes)
+
+    def consistency(self, prev_gr, next_gr, fu, fv, bu, bv):
+        # how much worse the backward flow warps next onto prev than the
+        # forward flow warps prev onto next, 1.0 means they agree
+        f_err = photometric_error(prev_gr, next_gr, fu, fv)
+        b_err = photometric_error(next_gr, prev_gr, bu, bv)
+        return b_err / max(f_err, 1.0)
+
+    def compute_bidir(self, prev_gr, next_gr):
+        fu, fv = self.backend.compute(prev_gr, next_gr)
+        bu, bv, holes = invert_flow(fu, fv)
+        if holes <= self.max_holes:
+            err_ratio = self.consistency(prev_gr, next_gr, fu, fv, bu, bv)
+            if err_ratio <= self.max_err_ratio:
+                self.estimated += 1
+                return fu, fv, bu, bv
+            log.debug('Backward flow disagrees (%.2f > %.2f), computing it',
+                      err_ratio, self.max_err_ratio)
+        else:
+            log.debug('Backward flow has too many holes (%.2f > %.2f), '
+                      'computing it', holes, self.max_holes)
+        self.fallbacks += 1
+        bu, bv = self.backend.compute(next_gr, prev_gr)
+        return fu, fv, bu, bv
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# the time every frame of a video is shown at and which frames are keyframes,
+# from a scan of its packets. avinfo estimates the number of frames from the
+# average frame rate, which is wrong for variable frame rate videos. a scan
+# reads the whole file, so tables are cached with the probe results
+
+import os
+import bisect
+from butterflow import avinfo
+from butterflow import probe
+
+import logging
+log = logging.getLogger('butterflow')
+
+version = 1
+
+
+class FrameTable(object):
+    def __init__(self, pts, keyframes, duration):
+        self.pts = pts              # in ms from the first frame, ascending
+        self.keyframes = keyframes  # frame indices, ascending
+        self.duration = duration
+
+    @property
+    def frames(self):
+        return len(self.pts)
+
+    def time_at(self, fr):
+        return self.pts[fr]
+
+    def fr_at(self, time):
+        # the frame being shown at time
+        return max(0, min(bisect.bisect_right(self.pts, time) - 1,
+                          self.frames-1))
+
+    def keyframe_before(self, fr):
+        # the last keyframe at or before fr, decoding fr starts there
+        i = bisect.bisect_right(self.keyframes, fr) - 1
+        if i < 0:
+            return 0
+        return self.keyframes[i]
+
+    def to_dict(self):
+        return {'version': version,
+                'pts': self.pts,
+                'keyframes': self.keyframes,
+                'duration': self.duration}
+
+    @classmethod
+    def from_dict(cls, d):
+        if d['version'] != version:
+            raise ValueError('Unsupported frame table version: {}'.format(
+                             d['version']))
+        return cls(d['pts'], d['keyframes'], d['duration'])
+
+
+def get_fr_table(src):
+    key = probe.cache_key(src)
+    d = probe.load(src, 'frames', key)
+    if d is not None:
+        try:
+            return FrameTable.from_dict(d)
+        except (ValueError, KeyError) as error:
+            log.warn('Rebuilding the frame table (%s)', error)
+    log.info('Indexing frames:\t%s', os.path.basename(src))
+    table = FrameTable(**avinfo.get_fr_table(src))
+    probe.store(src, 'frames', table.to_dict(), key)
+    return table
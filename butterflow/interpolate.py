@@ -1,11 +1,10 @@
 # -*- coding: utf-8 -*-
-# a parallel, naive implementation of software frame interpolation using
-# provided optical flows (displacement fields)
+# software frame interpolation using provided optical flows (displacement
+# fields). fr_at_time_step is the naive, per pixel version of what the
+# vectorized functions do
 
 import numpy as np
-import multiprocessing
-from itertools import izip
-import signal
+from butterflow.settings import default as settings
 
 
 def time_steps_for_nfrs(n):  # py version
@@ -27,51 +26,62 @@ def fr_at_time_step(target_fr, u, v, ts):
         fr[idx] = target_fr[np.asscalar(np.int32(np.clip(py, 0, shape[0]-1))),
                             np.asscalar(np.int32(np.clip(px, 0, shape[1]-1))),
                             ch]
-    return ts, fr
+    return fr
 
 
-def fr_at_time_step_wrp(args):   # to pass multiple args for Pool.map
-    return fr_at_time_step(*args)
+def fr_at_time_step_vec(target_fr, u, v, ts, flow_scale=1.0):
+    # same as fr_at_time_step but indexes every pixel at once. u and v can be
+    # stored flows, see pack_flow
+    h, w = u.shape
+    ys, xs = np.indices((h, w), dtype=np.float32)
+    step = np.float32(ts * flow_scale)
+    py = np.clip(np.rint(ys + v.astype(np.float32, copy=False) * step), 0,
+                 h-1).astype(np.intp)
+    px = np.clip(np.rint(xs + u.astype(np.float32, copy=False) * step), 0,
+                 w-1).astype(np.intp)
+    return target_fr[py, px]
 
 
-def init_worker():  # captures ctrl+c
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
+def stored_flow_scale(storage):
+    # pixels per unit of a flow stored as storage
+    if storage == 'int16':
+        return 1.0 / settings['flow_fixed_steps']
+    return 1.0
 
 
-def sw_interpolate_flow(prev_fr, next_fr, fu, fv, bu, bv, int_each_go):
+def pack_flow(x, storage):
+    # float32 flows can be stored as float16, or as int16 in fixed steps of a
+    # pixel, taking half the memory. the interpolators take stored flows and
+    # their stored_flow_scale and convert them back themselves
+    if storage == 'float16':
+        return x.astype(np.float16)
+    if storage == 'int16':
+        steps = settings['flow_fixed_steps']
+        return np.clip(np.rint(x * steps), -32768, 32767).astype(np.int16)
+    return x
+
+
+def unpack_flow(x, scale=1.0):
+    return x.astype(np.float32) * np.float32(scale)
+
+
+def vec_interpolate_flow(prev_fr, next_fr, fu, fv, bu, bv, int_each_go,
+                         out=None, flow_scale=1.0):
+    # interpolates int_each_go frames, in the calling process.
+    # frames can also be uint8, they're only indexed so they don't need to be
+    # normalized first. with out, a list of uint8 frames, the results are
+    # written into those instead of new arrays
     frames = []
-    time_steps = time_steps_for_nfrs(int_each_go)
-    cpus = multiprocessing.cpu_count()
-    pool = multiprocessing.Pool(cpus, init_worker)
-    work_steps = cpus/2
-    try:
-        for i in range(0, len(time_steps), work_steps):
-            def blend_results(*args):
-                res = args[0]
-                def pairwise(iterable):
-                    a = iter(iterable)
-                    return izip(a, a)
-                for n, p in pairwise(res):
-                    def alpha_blend(a, b, alpha):
-                        return (1-alpha)*a + alpha*b
-                    prv = p[1]
-                    nxt = n[1]
-                    bfr = alpha_blend(prv, nxt, n[0])  # n[0] is the step
-                    bfr = (bfr*255.0).astype(np.uint8)
-                    frames.append(bfr)
-            task_list = []
-            for j in range(work_steps):
-                if i+j > len(time_steps)-1:
-                    continue
-                ts = time_steps[i+j]
-                task_list.extend([(next_fr, fu, fv, ts),
-                                  (prev_fr, bu, bv, ts)])
-            r = pool.map_async(fr_at_time_step_wrp, task_list,
-                               callback=blend_results)
-            r.wait()  # block on results, will return them in order
-    except KeyboardInterrupt:
-        pool.terminate()
-        class KeyboardInterruptError(Exception): pass
-        raise KeyboardInterruptError  # re-raise
-    pool.close()
+    is_uint8 = prev_fr.dtype == np.uint8
+    for i, ts in enumerate(time_steps_for_nfrs(int_each_go)):
+        nxt = fr_at_time_step_vec(next_fr, fu, fv, ts, flow_scale)
+        prv = fr_at_time_step_vec(prev_fr, bu, bv, ts, flow_scale)
+        bfr = np.float32(1-ts)*prv + np.float32(ts)*nxt
+        if not is_uint8:
+            bfr *= 255.0
+        if out is None:
+            frames.append(bfr.astype(np.uint8))
+        else:
+            np.copyto(out[i], bfr, casting='unsafe')
+            frames.append(out[i])
     return frames
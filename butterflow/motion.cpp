@@ -14,11 +14,9 @@ using namespace cv;
 using namespace cv::ocl;
 
 
-static PyObject*
-ocl_farneback_optical_flow(PyObject *self, PyObject *args) {
-    PyObject *py_fr_1;
-    PyObject *py_fr_2;
-
+static bool
+unpack_farneback_args(PyObject *args, PyObject **py_fr_1, PyObject **py_fr_2,
+                      cv::ocl::FarnebackOpticalFlow &calc_flow) {
     PyObject *py_scale;
     PyObject *py_levels;
     PyObject *py_winsize;
@@ -28,21 +26,59 @@ ocl_farneback_optical_flow(PyObject *self, PyObject *args) {
     PyObject *py_fast_pyramids;
     PyObject *py_flags;
 
-    if (!PyArg_UnpackTuple(args, "", 10, 10, &py_fr_1, &py_fr_2, &py_scale,
+    if (!PyArg_UnpackTuple(args, "", 10, 10, py_fr_1, py_fr_2, &py_scale,
                            &py_levels, &py_winsize, &py_iters, &py_poly_n,
                            &py_poly_sigma, &py_fast_pyramids, &py_flags)) {
         PyErr_SetString(PyExc_TypeError, "could not unpack tuple");
-        return (PyObject*)NULL;
+        return false;
     }
 
-    double scale = PyFloat_AsDouble(py_scale);
-    int levels   = PyInt_AsLong(py_levels);
-    int winsize  = PyInt_AsLong(py_winsize);
-    int iters    = PyInt_AsLong(py_iters);
-    int poly_n   = PyInt_AsLong(py_poly_n);
-    double poly_sigma  = PyFloat_AsDouble(py_poly_sigma);
-    bool fast_pyramids = PyObject_IsTrue(py_fast_pyramids);
-    int flags    = PyInt_AsLong(py_flags);
+    calc_flow.pyrScale  = PyFloat_AsDouble(py_scale);
+    calc_flow.numLevels = PyInt_AsLong(py_levels);
+    calc_flow.winSize   = PyInt_AsLong(py_winsize);
+    calc_flow.numIters  = PyInt_AsLong(py_iters);
+    calc_flow.polyN     = PyInt_AsLong(py_poly_n);
+    calc_flow.polySigma = PyFloat_AsDouble(py_poly_sigma);
+    calc_flow.fastPyramids = PyObject_IsTrue(py_fast_pyramids);
+    calc_flow.flags     = PyInt_AsLong(py_flags);
+
+    return true;
+}
+
+static void
+append_flow(NDArrayConverter &converter, PyObject *py_flows, Py_ssize_t idx,
+            cv::ocl::FarnebackOpticalFlow &calc_flow, oclMat &ocl_fr_1,
+            oclMat &ocl_fr_2) {
+    oclMat ocl_flow_x;
+    oclMat ocl_flow_y;
+
+    calc_flow(ocl_fr_1, ocl_fr_2, ocl_flow_x, ocl_flow_y);
+
+    Mat mat_flow_x;
+    Mat mat_flow_y;
+
+    ocl_flow_x.download(mat_flow_x);
+    ocl_flow_y.download(mat_flow_y);
+
+    /* PyList_SetItem will steal a reference to items that are added to the
+     * list. In other words, it now assumes it owns that reference and the user
+     * is no longer responsible for it. The item will be referenced in the list
+     * but it's reference count will not be increased. When the list is
+     # deleted, every element in the list will be decrefed. */
+    PyList_SetItem(py_flows, idx,   converter.toNDArray(mat_flow_x));
+    PyList_SetItem(py_flows, idx+1, converter.toNDArray(mat_flow_y));
+}
+
+static PyObject*
+ocl_farneback_optical_flow(PyObject *self, PyObject *args) {
+    PyObject *py_fr_1;
+    PyObject *py_fr_2;
+
+    cv::ocl::FarnebackOpticalFlow calc_flow;
+
+    if (!unpack_farneback_args(args, &py_fr_1, &py_fr_2, calc_flow)) {
+        return (PyObject*)NULL;
+    }
 
     NDArrayConverter converter;
     Mat fr_1 = converter.toMat(py_fr_1);
@@ -54,41 +90,46 @@ ocl_farneback_optical_flow(PyObject *self, PyObject *args) {
     ocl_fr_1.upload(fr_1);
     ocl_fr_2.upload(fr_2);
 
-    cv::ocl::FarnebackOpticalFlow calc_flow;
-    calc_flow.pyrScale  = scale;
-    calc_flow.numLevels = levels;
-    calc_flow.winSize   = winsize;
-    calc_flow.numIters  = iters;
-    calc_flow.polyN     = poly_n;
-    calc_flow.polySigma = poly_sigma;
-    calc_flow.fastPyramids = fast_pyramids;
-    calc_flow.flags     = flags;
+    PyObject *py_flows = PyList_New(2);
 
-    oclMat ocl_flow_x;
-    oclMat ocl_flow_y;
+    append_flow(converter, py_flows, 0, calc_flow, ocl_fr_1, ocl_fr_2);
 
-    calc_flow(ocl_fr_1, ocl_fr_2, ocl_flow_x, ocl_flow_y);
+    calc_flow.releaseMemory();
 
-    Mat mat_flow_x;
-    Mat mat_flow_y;
+    return py_flows;
+}
 
-    ocl_flow_x.download(mat_flow_x);
-    ocl_flow_y.download(mat_flow_y);
+static PyObject*
+ocl_farneback_optical_flow_bidir(PyObject *self, PyObject *args) {
+    /* same arguments as ocl_farneback_optical_flow but returns the forward
+     * and backward flows, [fu, fv, bu, bv]. each frame is uploaded once and
+     * the calc object, with its device buffers, is reused for both
+     * directions */
+    PyObject *py_fr_1;
+    PyObject *py_fr_2;
 
-    calc_flow.releaseMemory();
+    cv::ocl::FarnebackOpticalFlow calc_flow;
 
-    PyObject *py_flows = PyList_New(2);
+    if (!unpack_farneback_args(args, &py_fr_1, &py_fr_2, calc_flow)) {
+        return (PyObject*)NULL;
+    }
 
-    PyObject *py_flow_1 = converter.toNDArray(mat_flow_x);
-    PyObject *py_flow_2 = converter.toNDArray(mat_flow_y);
+    NDArrayConverter converter;
+    Mat fr_1 = converter.toMat(py_fr_1);
+    Mat fr_2 = converter.toMat(py_fr_2);
 
-    /* PyList_SetItem will steal a reference to items that are added to the
-     * list. In other words, it now assumes it owns that reference and the user
-     * is no longer responsible for it. The item will be referenced in the list
-     * but it's reference count will not be increased. When the list is
-     # deleted, every element in the list will be decrefed. */
-    PyList_SetItem(py_flows, 0, py_flow_1);
-    PyList_SetItem(py_flows, 1, py_flow_2);
+    oclMat ocl_fr_1;
+    oclMat ocl_fr_2;
+
+    ocl_fr_1.upload(fr_1);
+    ocl_fr_2.upload(fr_2);
+
+    PyObject *py_flows = PyList_New(4);
+
+    append_flow(converter, py_flows, 0, calc_flow, ocl_fr_1, ocl_fr_2);
+    append_flow(converter, py_flows, 2, calc_flow, ocl_fr_2, ocl_fr_1);
+
+    calc_flow.releaseMemory();
 
     return py_flows;
 }
@@ -109,6 +150,60 @@ time_steps_for_nfrs(PyObject *self, PyObject *arg) {
     return py_steps;
 }
 
+static void
+upload_fr(Mat &fr, oclMat &ocl_b, oclMat &ocl_g, oclMat &ocl_r) {
+    /* frames can be uint8 with values from 0 to 255 or float32 with values
+     * from 0 to 1.0. uint8 frames are uploaded as they are, a quarter of the
+     * size, and normalized on the device */
+    oclMat *ocl_channels[] = {&ocl_b, &ocl_g, &ocl_r};
+
+    if (fr.depth() == CV_8U) {
+        oclMat ocl_fr(fr);
+        vector<oclMat> ocl_fr_channels;
+        split(ocl_fr, ocl_fr_channels);
+        for (int i = 0; i < 3; i++) {
+            ocl_fr_channels[i].convertTo(*ocl_channels[i], CV_32F,
+                                         1.0/255.0);
+        }
+        return;
+    }
+
+    Mat channels[3];
+    split(fr, channels);
+    for (int i = 0; i < 3; i++) {
+        ocl_channels[i]->upload(channels[i]);
+    }
+}
+
+static bool
+upload_flow(NDArrayConverter &converter, PyObject *py_flow, double scale,
+            oclMat &ocl_flow) {
+    /* flows can be float32, float16, or int16 in fixed steps of scale px.
+     * int16 flows are uploaded as they are, half the size, and scaled on the
+     * device. OpenCV has no half floats so float16 is converted on the host */
+    if (PyArray_Check(py_flow) &&
+        PyArray_TYPE((PyArrayObject*)py_flow) == NPY_HALF) {
+        PyObject *py_flow_32 = PyArray_Cast((PyArrayObject*)py_flow,
+                                            NPY_FLOAT);
+        if (py_flow_32 == NULL) {
+            return false;
+        }
+        Mat flow = converter.toMat(py_flow_32);
+        ocl_flow.upload(flow);
+        Py_DECREF(py_flow_32);
+        return true;
+    }
+
+    Mat flow = converter.toMat(py_flow);
+    if (flow.depth() == CV_16S) {
+        oclMat ocl_flow_16s(flow);
+        ocl_flow_16s.convertTo(ocl_flow, CV_32F, scale);
+        return true;
+    }
+    ocl_flow.upload(flow);
+    return true;
+}
+
 static PyObject*
 ocl_interpolate_flow(PyObject *self, PyObject *args) {
     PyObject *py_fr_1;
@@ -121,8 +216,14 @@ ocl_interpolate_flow(PyObject *self, PyObject *args) {
 
     PyObject *py_int_each_go;
 
-    if (!PyArg_UnpackTuple(args, "", 7, 7, &py_fr_1, &py_fr_2, &py_fu, &py_fv,
-                           &py_bu, &py_bv, &py_int_each_go)) {
+    /* optional, a list of uint8 frames to write the results into instead of
+     * allocating new ones, and the px per unit of int16 flows */
+    PyObject *py_out = NULL;
+    PyObject *py_flow_scale = NULL;
+
+    if (!PyArg_UnpackTuple(args, "", 7, 9, &py_fr_1, &py_fr_2, &py_fu, &py_fv,
+                           &py_bu, &py_bv, &py_int_each_go, &py_out,
+                           &py_flow_scale)) {
         PyErr_SetString(PyExc_TypeError, "could not unpack tuple");
         return (PyObject*)NULL;
     }
@@ -136,39 +237,55 @@ ocl_interpolate_flow(PyObject *self, PyObject *args) {
     NDArrayConverter converter;
     Mat fr_1 = converter.toMat(py_fr_1);
     Mat fr_2 = converter.toMat(py_fr_2);
-    Mat fu   = converter.toMat(py_fu);
-    Mat fv   = converter.toMat(py_fv);
-    Mat bu   = converter.toMat(py_bu);
-    Mat bv   = converter.toMat(py_bv);
 
-    oclMat fr_1_b, fr_1_g, fr_1_r;
-    oclMat fr_2_b, fr_2_g, fr_2_r;
+    if (py_out == Py_None) {
+        py_out = NULL;
+    }
+    if (py_out != NULL) {
+        if (!PyList_Check(py_out) || PyList_Size(py_out) < int_each_go) {
+            PyErr_SetString(PyExc_ValueError,
+                            "out must be a list with a frame for each step");
+            return (PyObject*)NULL;
+        }
+        for (int i = 0; i < int_each_go; i++) {
+            Mat out_fr = converter.toMat(PyList_GetItem(py_out, (Py_ssize_t)i));
+            if (out_fr.rows != fr_1.rows || out_fr.cols != fr_1.cols ||
+                out_fr.type() != CV_8UC3 || !out_fr.isContinuous()) {
+                PyErr_SetString(PyExc_ValueError,
+                                "out frames must be uint8 and the size of "
+                                "the input frames");
+                return (PyObject*)NULL;
+            }
+        }
+    }
 
-    Mat channels[3];
+    double flow_scale = 1.0;
+    if (py_flow_scale != NULL && py_flow_scale != Py_None) {
+        flow_scale = PyFloat_AsDouble(py_flow_scale);
+    }
 
-    split(fr_1, channels);
-    fr_1_b.upload(channels[0]);
-    fr_1_g.upload(channels[1]);
-    fr_1_r.upload(channels[2]);
+    oclMat fr_1_b, fr_1_g, fr_1_r;
+    oclMat fr_2_b, fr_2_g, fr_2_r;
 
-    split(fr_2, channels);
-    fr_2_b.upload(channels[0]);
-    fr_2_g.upload(channels[1]);
-    fr_2_r.upload(channels[2]);
+    upload_fr(fr_1, fr_1_b, fr_1_g, fr_1_r);
+    upload_fr(fr_2, fr_2_b, fr_2_g, fr_2_r);
 
     oclMat ocl_fu;
     oclMat ocl_fv;
     oclMat ocl_bu;
     oclMat ocl_bv;
 
-    ocl_fu.upload(fu);
-    ocl_fv.upload(fv);
-    ocl_bu.upload(bu);
-    ocl_bv.upload(bv);
+    if (!upload_flow(converter, py_fu, flow_scale, ocl_fu) ||
+        !upload_flow(converter, py_fv, flow_scale, ocl_fv) ||
+        !upload_flow(converter, py_bu, flow_scale, ocl_bu) ||
+        !upload_flow(converter, py_bv, flow_scale, ocl_bv)) {
+        return (PyObject*)NULL;
+    }
 
     oclMat ocl_buf;
     oclMat ocl_new_b, ocl_new_g, ocl_new_r;
     oclMat ocl_new_bgr;
+    oclMat ocl_new_bgr_8u;
 
     PyObject *py_frames = PyList_New(0);
     PyObject *py_time_steps = time_steps_for_nfrs(self, py_int_each_go);
@@ -185,9 +302,20 @@ ocl_interpolate_flow(PyObject *self, PyObject *args) {
         oclMat channels[] = {ocl_new_b, ocl_new_g, ocl_new_r};
         merge(channels, 3, ocl_new_bgr);
 
+        /* converted on the device, downloading a quarter of the data */
+        ocl_new_bgr.convertTo(ocl_new_bgr_8u, CV_8UC3, 255.0);
+
+        if (py_out != NULL) {
+            /* borrowed ref, the mat shares the array's memory */
+            PyObject *py_out_fr = PyList_GetItem(py_out, (Py_ssize_t)i);
+            Mat out_fr = converter.toMat(py_out_fr);
+            ocl_new_bgr_8u.download(out_fr);
+            PyList_Append(py_frames, py_out_fr);
+            continue;
+        }
+
         Mat mat_new_bgr;
-        ocl_new_bgr.download(mat_new_bgr);
-        mat_new_bgr.convertTo(mat_new_bgr, CV_8UC3, 255.0);
+        ocl_new_bgr_8u.download(mat_new_bgr);
 
         PyObject *py_new_fr = converter.toNDArray(mat_new_bgr);
         /* PyList_Append will increment reference count. This behavior differs
@@ -206,6 +334,8 @@ static PyMethodDef module_methods[] = {
         "Interpolate flow from frames"},
     {"ocl_farneback_optical_flow", ocl_farneback_optical_flow, METH_VARARGS,
         "Calc farneback optical flow"},
+    {"ocl_farneback_optical_flow_bidir", ocl_farneback_optical_flow_bidir,
+        METH_VARARGS, "Calc forward and backward farneback optical flow"},
     {"time_steps_for_nfrs", time_steps_for_nfrs, METH_O,
         "Get time steps for interpolated frames"},
     {NULL, NULL, 0, NULL}
@@ -214,4 +344,5 @@ static PyMethodDef module_methods[] = {
 PyMODINIT_FUNC
 initmotion(void) {
     (void) Py_InitModule("motion", module_methods);
+    import_array();  /* for PyArray_Cast, the converter imports its own */
 }
@@ -33,9 +33,11 @@ def mux_av(vid, audio, dest):
     shutil.move(tempfile, dest)
 
 
-def concat_av_files(dest, files):
-    tempfile = os.path.join(settings['tempdir'], 'list.{}.txt'.format(
-                            os.getpid()))
+def concat_av_files(dest, files, audio_src=None, audio_regions=None):
+    # joins files without re-encoding them. with audio_regions, audio from
+    # those regions of audio_src is encoded into dest alongside them
+    tempfile = os.path.join(settings['tempdir'], '{}.list.{}.txt'.format(
+                            os.path.basename(dest), os.getpid()))
     log.info("Writing list file:\t{}".format(os.path.basename(tempfile)))
     with open(tempfile, 'w') as f:
         for file in files:
@@ -48,10 +50,22 @@ def concat_av_files(dest, files):
         '-y',
         '-f', 'concat',
         '-safe', '0',
-        '-i', tempfile,
-        '-c', 'copy',
-        dest]
-    log.info('[Subprocess] Concatenating audio files')
+        '-i', tempfile]
+    if audio_regions:
+        call.extend([
+            '-i', audio_src,
+            '-filter_complex', audio_filter_graph(audio_regions,
+                                                  stream='1:a'),
+            '-map', '0:v',
+            '-map', '[out]',
+            '-c:v', 'copy'])
+        if settings['ca'] == 'aac':
+            call.extend(['-strict', '-2'])
+        call.extend(['-c:a', settings['ca'], '-b:a', settings['ba']])
+    else:
+        call.extend(['-c', 'copy'])
+    call.append(dest)
+    log.info('[Subprocess] Concatenating files')
     log.debug('Call: {}'.format(' '.join(call)))
     if subprocess.call(call) == 1:
         raise RuntimeError
@@ -59,51 +73,53 @@ def concat_av_files(dest, files):
     os.remove(tempfile)
 
 
-def extract_audio(vid, dest, ss, to, speed=1.0):
-    filename = os.path.splitext(os.path.basename(dest))[0]
-    tempfile1 = os.path.join(settings['tempdir'],
-                             '{}.{}'.format(filename, settings['v_container']).
-                             lower())
+def split_video(vid, times, dest_fmt):
+    # copies the video stream of vid without re-encoding it into files named
+    # dest_fmt % n, cut at the first keyframe at or after each of times, in
+    # secs. the first file has the frames before the first cut
     call = [
         settings['avutil'],
         '-loglevel', settings['av_loglevel'],
         '-y',
         '-i', vid,
-        '-ss', str(ss/1000.0),
-        '-to', str(to/1000.0),
+        '-map', '0:v:0',
         '-map_metadata', '-1',
         '-map_chapters', '-1',
-        '-vn',
-        '-sn']
-    if settings['ca'] == 'aac':
-        call.extend(['-strict', '-2'])
-    call.extend([
-        '-c:a', settings['ca'],
-        '-b:a', settings['ba'],
-        tempfile1])
-    log.info('[Subprocess] Video chunk extraction')
+        '-an',
+        '-sn',
+        '-c:v', 'copy',
+        '-f', 'segment',
+        '-segment_format', 'mpegts',
+        '-reset_timestamps', '1']
+    if len(times) > 0:
+        call.extend(['-segment_times',
+                     ','.join('{:.6f}'.format(x) for x in times)])
+    call.append(dest_fmt)
+    log.info('[Subprocess] Copying the video in %d parts', len(times) + 1)
     log.debug('Call: {}'.format(' '.join(call)))
-    log.info("Extracting to:\t%s", os.path.basename(tempfile1))
     if subprocess.call(call) == 1:
         raise RuntimeError
-    tempfile2 = os.path.join(settings['tempdir'],
-                             '{}.{}x.{}'.format(filename, speed,
-                                                settings['a_container']))
-    def solve_atempo_chain(speed):
-        if speed >= 0.5 and speed <= 2.0:
-            return [speed]
-        def solve(speed, limit):
-            vals = []
-            x = int(math.log(speed) / math.log(limit))
-            for i in range(x):
-                vals.append(limit)
-            y = float(speed) / math.pow(limit, x)
-            vals.append(y)
-            return vals
-        if speed < 0.5:
-            return solve(speed, 0.5)
-        else:
-            return solve(speed, 2.0)
+
+
+def solve_atempo_chain(speed):
+    # atempo only accepts 0.5-2.0, chain them for speeds outside of that
+    if speed >= 0.5 and speed <= 2.0:
+        return [speed]
+    def solve(speed, limit):
+        vals = []
+        x = int(math.log(speed) / math.log(limit))
+        for i in range(x):
+            vals.append(limit)
+        y = float(speed) / math.pow(limit, x)
+        vals.append(y)
+        return vals
+    if speed < 0.5:
+        return solve(speed, 0.5)
+    else:
+        return solve(speed, 2.0)
+
+
+def atempo_filters(speed):
     atempo_chain = solve_atempo_chain(speed)
     chain_string = ""
     chain = []
@@ -114,25 +130,47 @@ def extract_audio(vid, dest, ss, to, speed=1.0):
             chain_string += "*"
     log.info("Solved tempo chain for speed ({}x): {}".format(speed,
                                                               chain_string))
+    return chain
+
+
+def audio_filter_graph(regions, stream='0:a'):
+    # trims each (ss, to, speed) region out of an audio stream, changes its
+    # tempo, and joins them all back together as [out]
+    graph = []
+    labels = ''
+    for i, (ss, to, speed) in enumerate(regions):
+        chain = ['atrim=start={}:end={}'.format(ss/1000.0, to/1000.0),
+                 'asetpts=PTS-STARTPTS']
+        if speed != 1.0:
+            chain.extend(atempo_filters(speed))
+        graph.append('[{}]{}[a{}]'.format(stream, ','.join(chain), i))
+        labels += '[a{}]'.format(i)
+    graph.append('{}concat=n={}:v=0:a=1[out]'.format(labels, len(regions)))
+    return ';'.join(graph)
+
+
+def extract_audio_regions(vid, dest, regions):
+    # the audio of every region at its speed, joined in order into dest by a
+    # single process
     call = [
         settings['avutil'],
         '-loglevel', settings['av_loglevel'],
         '-y',
-        '-i', tempfile1,
-        '-filter:a', ','.join(chain)]
+        '-i', vid,
+        '-filter_complex', audio_filter_graph(regions),
+        '-map', '[out]',
+        '-map_metadata', '-1',
+        '-map_chapters', '-1',
+        '-vn',
+        '-sn']
     if settings['ca'] == 'aac':
         call.extend(['-strict', '-2'])
     call.extend([
         '-c:a', settings['ca'],
         '-b:a', settings['ba'],
-        tempfile2])
-    log.info('[Subprocess] Altering audio tempo')
+        dest])
+    log.info('[Subprocess] Extracting audio from %d regions', len(regions))
     log.debug('Call: {}'.format(' '.join(call)))
-    log.info("Writing to:\t%s", os.path.basename(tempfile2))
+    log.info("Writing to:\t%s", os.path.basename(dest))
     if subprocess.call(call) == 1:
         raise RuntimeError
-    log.info("Delete:\t%s", os.path.basename(tempfile1))
-    os.remove(tempfile1)
-    log.info("Moving:\t%s -> %s", os.path.basename(tempfile2),
-             os.path.basename(dest))
-    shutil.move(tempfile2, dest)
@@ -200,6 +200,63 @@ compat_ocl_device_available(PyObject *self, PyObject *noargs) {
     Py_RETURN_FALSE;
 }
 
+static PyObject*
+compat_ocl_devices(PyObject *self, PyObject *noargs) {
+    /* returns a list of the numbers of compatible devices, numbered the same
+     * way as print_ocl_devices and select_ocl_device */
+    cl_platform_id platforms[32];
+    cl_uint n_platforms;
+    cl_device_id *devices;
+    cl_uint n_devices;
+    char p_prof[1024];
+    char d_vers[1024];
+    char d_prof[1024];
+    size_t d_max_work_group_size;
+    size_t d_max_work_item_sizes[3];
+    int d_num = 0;
+
+    cl_safe(clGetPlatformIDs(32, platforms, &n_platforms));
+
+    PyObject *py_devices = PyList_New(0);
+
+    for (int i = 0; i < n_platforms; i++) {
+        cl_safe(clGetPlatformInfo(platforms[i], CL_PLATFORM_PROFILE, 1024,
+                                  p_prof, NULL));
+
+        cl_safe(clGetDeviceIDs(platforms[i], CL_DEVICE_TYPE_ALL, 0, NULL,
+                               &n_devices));
+
+        devices = (cl_device_id*)calloc(sizeof(cl_device_id), n_devices);
+        cl_safe(clGetDeviceIDs(platforms[i], CL_DEVICE_TYPE_ALL, n_devices,
+                               devices, NULL));
+
+        for (int j = 0; j < n_devices; j++) {
+            cl_device_id d = devices[j];
+
+            cl_safe(clGetDeviceInfo(d, CL_DEVICE_VERSION, 1024, d_vers, NULL));
+            cl_safe(clGetDeviceInfo(d, CL_DEVICE_PROFILE, 1024, d_prof, NULL));
+            cl_safe(clGetDeviceInfo(d, CL_DEVICE_MAX_WORK_GROUP_SIZE,
+                                    sizeof(d_max_work_group_size),
+                                    &d_max_work_group_size, NULL));
+            cl_safe(clGetDeviceInfo(d, CL_DEVICE_MAX_WORK_ITEM_SIZES,
+                                    sizeof(d_max_work_item_sizes),
+                                    &d_max_work_item_sizes, NULL));
+
+            if (ocl_device_is_compatible(d_vers, d_prof, p_prof,
+                                        d_max_work_group_size,
+                                        d_max_work_item_sizes)) {
+                /* PyList_Append will increment the reference count */
+                PyObject *py_d_num = PyInt_FromLong(d_num);
+                PyList_Append(py_devices, py_d_num);
+                Py_DECREF(py_d_num);
+            }
+            d_num++;
+        }
+        free(devices);
+    }
+    return py_devices;
+}
+
 static PyObject*
 select_ocl_device(PyObject *self, PyObject *arg) {
     int preferred_device_num = PyInt_AsLong(arg);
@@ -304,6 +361,8 @@ static PyMethodDef module_methods[] = {
         "Checks if a compatible ocl device is available"},
     {"print_ocl_devices", print_ocl_devices, METH_NOARGS,
         "Prints all available OpenCL devices"},
+    {"compat_ocl_devices", compat_ocl_devices, METH_NOARGS,
+        "Returns the numbers of compatible OpenCL devices"},
     {"get_current_ocl_device_name", get_current_ocl_device_name, METH_NOARGS,
         "Returns current OpenCL device name"},
     {"select_ocl_device", select_ocl_device, METH_O,
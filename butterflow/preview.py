@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# shows rendered frames in a window from a display thread. the renderer only
+# ever replaces the latest frame in a single slot, at most preview_fps times a
+# second, and never waits for the window to catch up. HighGUI isn't thread
+# safe, so every call to it, from opening the window to destroying it, is
+# made by the display thread
+
+import time
+import threading
+import cv2
+from butterflow.settings import default as settings
+from butterflow import draw
+
+import logging
+log = logging.getLogger('butterflow')
+
+
+class Preview(object):
+    def __init__(self, title, w, h, display=None):
+        # display(fr) shows a frame, by default in an OpenCV window
+        self.title = title
+        scale = min(1.0, float(settings['preview_w']) / w)
+        self.w = max(1, int(w * scale))
+        self.h = max(1, int(h * scale))
+        self.display = display
+        self.interval = 1.0 / settings['preview_fps']
+        self.last_put = 0
+        self.latest = None
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.stopped = False
+        self.shown = 0
+        self.skipped = 0
+        self.overlay = draw.Overlay(None, None, None)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def show(self, fr, progress=0.0):
+        # called from the render loop, must never block on the display
+        now = time.time()
+        if now - self.last_put < self.interval:
+            self.skipped += 1
+            return
+        self.last_put = now
+        small = cv2.resize(fr, (self.w, self.h),
+                           interpolation=cv2.INTER_NEAREST)
+        with self.lock:
+            self.latest = (small, progress)
+        self.ready.set()
+
+    def take(self):
+        with self.lock:
+            latest = self.latest
+            self.latest = None
+            self.ready.clear()
+        return latest
+
+    def run(self):
+        if self.display is None:
+            cv2.namedWindow(self.title, cv2.WINDOW_OPENGL)
+            cv2.resizeWindow(self.title, self.w, self.h)
+        while not self.stopped:
+            self.ready.wait(0.1)
+            latest = self.take()
+            if latest is None:
+                continue
+            fr, progress = latest
+            self.overlay.progress_bar(fr, progress=progress)
+            if self.display is None:
+                cv2.imshow(self.title, fr)
+                cv2.waitKey(settings['imshow_ms'])
+            else:
+                self.display(fr)
+            self.shown += 1
+        if self.display is None:
+            cv2.destroyWindow(self.title)
+
+    def close(self):
+        self.stopped = True
+        self.ready.set()
+        self.thread.join(settings['preview_close_secs'])
+        log.debug('Preview showed %d frames, skipped %d', self.shown,
+                  self.skipped)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# results of probing videos, cached in idxdir across runs and in memory for
+# the life of the process. entries are keyed by the path, size and
+# modification time of a video, and with probe_hash also by a hash of its
+# first and last bytes, so a video that changed is probed again. probe()
+# returns avinfo's dict, other kinds of results can be cached with load()
+# and store()
+
+import os
+import json
+import hashlib
+import tempfile
+from butterflow.settings import default as settings
+from butterflow import avinfo
+
+import logging
+log = logging.getLogger('butterflow')
+
+version = 3  # info has the profile, level, time base and codec extradata
+_memo = {}
+
+
+def content_hash(src):
+    n = settings['probe_hash_bytes']
+    h = hashlib.sha1()
+    with open(src, 'rb') as f:
+        h.update(f.read(n))
+        if os.path.getsize(src) > n:
+            f.seek(-n, os.SEEK_END)
+            h.update(f.read(n))
+    return h.hexdigest()
+
+
+def cache_key(src):
+    st = os.stat(src)
+    # repr keeps the sub-second part of the mtime, str rounds it
+    key = '{}:{}:{}'.format(os.path.abspath(src), st.st_size,
+                            repr(st.st_mtime))
+    if settings['probe_hash']:
+        key += ':' + content_hash(src)
+    return hashlib.sha1(key).hexdigest()
+
+
+def cache_path(key, kind):
+    return os.path.join(settings['idxdir'], '{}.{}.json'.format(key, kind))
+
+
+def load(src, kind, key=None):
+    # the cached result, or None if there isn't a usable one
+    if key is None:
+        key = cache_key(src)
+    if (key, kind) in _memo:
+        return _memo[(key, kind)]
+    path = cache_path(key, kind)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+        if entry['version'] != version:
+            return None
+        _memo[(key, kind)] = entry['result']
+        return entry['result']
+    except (IOError, ValueError, KeyError) as error:
+        log.warn('Ignoring a bad cache entry %s (%s)', os.path.basename(path),
+                 error)
+        return None
+
+
+def store(src, kind, result, key=None):
+    if key is None:
+        key = cache_key(src)
+    _memo[(key, kind)] = result
+    path = cache_path(key, kind)
+    # written to a temp file first so that an entry is never half written,
+    # unique so that threads storing the same entry don't share it
+    fd, part = tempfile.mkstemp(suffix='.part', dir=settings['idxdir'])
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'version': version, 'result': result}, f,
+                  separators=(',', ':'))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(part, path)
+
+
+def probe(src):
+    # avinfo.get_av_info, from the cache if the video hasn't changed. the
+    # dict is a copy so callers can change it
+    key = cache_key(src)
+    info = load(src, 'info', key)
+    if info is None:
+        info = avinfo.get_av_info(src)
+        store(src, 'info', info, key)
+    return dict(info)
@@ -2,15 +2,23 @@
 
 import os
 import shutil
-import subprocess
 import math
+import bisect
+import time
+import threading
+import itertools
+import collections
 import cv2
-import numpy as np
 from butterflow.settings import default as settings
 from butterflow.source import OpenCvFrameSource
 from butterflow import mux
-from butterflow import avinfo
+from butterflow import probe
 from butterflow import draw
+from butterflow import encoders
+from butterflow.spool import SpoolWriter
+from butterflow.preview import Preview
+from butterflow.buffers import FramePool
+from butterflow.workers import InlineWorkers
 from butterflow.interpolate import time_steps_for_nfrs
 
 
@@ -18,16 +26,29 @@ import logging
 log = logging.getLogger('butterflow')
 
 
+class RenderCancelled(Exception):
+    pass
+
+
 class Renderer(object):
+    tmp_ids = itertools.count()
+
     def __init__(self, src, dest, sequence, rate, optflow_fn, interpolate_fn,
                  w, h, scaling_method, lossless, keep_subregions, show_preview,
-                 add_info, text_type, mark_frames, mux):
+                 add_info, text_type, mark_frames, mux, workers=None,
+                 direct_write=False, segment_encoders=1, spool=False,
+                 stream_copy=False):
         self.src = src
         self.dest = dest
         self.sequence = sequence
         self.rate = rate
         self.optflow_fn = optflow_fn
         self.interpolate_fn = interpolate_fn
+        # frames are decoded, scaled and interpolated into reused buffers
+        self.pool = FramePool()
+        if workers is None:
+            workers = InlineWorkers(optflow_fn, interpolate_fn, self.pool)
+        self.workers = workers
         self.w = w
         self.h = h
         self.scaling_method = scaling_method
@@ -38,9 +59,20 @@ class Renderer(object):
         self.text_type = text_type
         self.mark_frames = mark_frames
         self.mux = mux
-        self.pipe = None
+        self.direct_write = direct_write
+        self.segment_encoders = segment_encoders
+        self.spool = spool
+        # skip subregions are copied from the source where they can be, see
+        # VideoSequence.split_for_stream_copy
+        self.stream_copy = stream_copy
+        self.encoder = None
         self.fr_source = None
-        self.av_info = avinfo.get_av_info(src)
+        self.av_info = probe.probe(src)
+        # kept for the encoders since batch jobs change the settings while
+        # others are rendering
+        self.crf = settings['crf']
+        # temp files are named by it so renders in one process don't collide
+        self.tmp_id = '{}-{}'.format(os.getpid(), next(Renderer.tmp_ids))
         self.source_frs = 0
         self.frs_interpolated = 0
         self.frs_duped = 0
@@ -49,66 +81,104 @@ class Renderer(object):
         self.subs_to_render = 0
         self.frs_to_render = 0
         self.curr_sub_idx = 0
+        self.seeks = 0
+        self.frs_carried = 0  # subregions that started on the last one's fr
+        self.carried = None   # (idx, fr) that the last subregion ended on
         self.window_title = os.path.basename(self.src) + ' - Butterflow'
+        self.overlay = draw.Overlay(text_type, rate, optflow_fn)
+        self.preview = None
         self.progress = 0
-
-    def mk_render_pipe(self, dest):
-        vf = []
-        vf.append('format=yuv420p')
-        call = [
-            settings['avutil'],
-            '-loglevel', settings['av_loglevel'],
-            '-y',
-            '-threads', '0',
-            '-f', 'rawvideo',
-            '-pix_fmt', 'bgr24',
-            '-s', '{}x{}'.format(self.w, self.h),
-            '-r', str(self.rate),
-            '-i', '-',
-            '-map_metadata', '-1',
-            '-map_chapters', '-1',
-            '-vf', ','.join(vf),
-            '-r', str(self.rate),
-            '-an',
-            '-sn',
-            '-c:v', settings['cv'],
-            '-preset', settings['preset']]
-        if settings['cv'] == 'libx264':
-            quality = ['-crf', str(settings['crf'])]
-            if self.lossless:
-                quality = ['-qp', '0']
-            call.extend(quality)
-            call.extend(['-level', '4.2'])
-        params = []
-        call.extend(['-{}-params'.format(settings['cv'].replace('lib', ''))])
-        params.append('log-level={}'.format(settings['enc_loglevel']))
-        if settings['cv'] == 'libx265':
-            quality = 'crf={}'.format(settings['crf'])
-            if self.lossless:
-                # Bug: https://trac.ffmpeg.org/ticket/4284
-                quality = 'lossless=1'
-            params.append(quality)
-        if len(params) > 0:
-            call.extend([':'.join(params)])
-        call.extend([dest])
-        log.info('[Subprocess] Opening a pipe to the video writer')
-        log.debug('Call: {}'.format(' '.join(call)))
-        self.pipe = subprocess.Popen(call, stdin=subprocess.PIPE)
-        if self.pipe == 1:
-            raise RuntimeError
+        self.cancelled = False
+        self.audio_thread = None
+        self.audio_file = None
+        self.audio_secs = 0
+        self.audio_error = None
+        self.audio_secs_saved = 0
+        self.copy_thread = None
+        self.copy_error = None
+        self.copy_cuts = []
+        self.copy_name = None
+        self.secs_copied = 0
+
+    def mk_render_pipe(self, dest, audio_regions=None):
+        # with audio_regions, the audio is taken from those regions of the
+        # source and encoded alongside the video
+        def mk_call(dest, gop=None, audio_regions=None):
+            return encoders.encoder_call(dest, self.w, self.h, self.rate,
+                                         self.lossless, self.src,
+                                         audio_regions, gop, self.crf)
+        if self.segment_encoders > 1:
+            self.encoder = encoders.SegmentedEncoder(
+                dest, mk_call, self.segment_encoders, self.tmp_id,
+                audio_src=self.src, audio_regions=audio_regions)
+        else:
+            self.encoder = encoders.PipeEncoder(mk_call(
+                dest, audio_regions=audio_regions))
 
     def close(self):
-        if self.pipe and not self.pipe.stdin.closed:
-            self.pipe.stdin.flush()
-            self.pipe.stdin.close()
-            self.pipe.wait()
-            log.info('[Subprocess] Closing pipe to the video writer')
+        if self.encoder is not None:
+            self.encoder.close()
+
+    def cancel(self):
+        # can be called from another thread, the render stops before its next
+        # pair
+        self.cancelled = True
 
-    def scale_fr(self, fr):
+    def scale_fr(self, fr, out=None):
         return cv2.resize(fr,
                           (self.w, self.h),
+                          dst=out,
                           interpolation=self.scaling_method)
 
+    def read_fr(self):
+        # reads the next fr into a buffer from the pool and downscales it into
+        # another one if needed, the source-sized buffer is given back
+        src_shape = (self.av_info['h'], self.av_info['w'], 3)
+        fr = self.fr_source.read(self.pool.get(src_shape))
+        if fr is not None and self.scaling_method == settings['scaler_dn']:
+            scaled = self.scale_fr(fr, self.pool.get((self.h, self.w, 3)))
+            self.pool.put(fr)
+            fr = scaled
+        return fr
+
+    def seek_to_fr(self, idx):
+        # a seek can decode from the keyframe before idx, so the source is
+        # only moved when it isn't there already
+        if int(self.fr_source.idx) == idx:
+            return
+        log.debug("Seeking to %d", idx)
+        self.fr_source.seek_to_fr(idx)
+        self.seeks += 1
+
+    def carry_fr(self, idx, fr):
+        # keeps a copy of the fr a subregion ends on for the next one, fr
+        # itself is drawn on when it's written and given back to the pool
+        self.drop_carried_fr()
+        if fr is None:
+            return
+        copy = self.pool.get(fr.shape)
+        copy[...] = fr
+        self.carried = (idx, copy)
+
+    def drop_carried_fr(self):
+        if self.carried is not None:
+            self.pool.put(self.carried[1])
+        self.carried = None
+
+    def read_first_fr(self, sub):
+        # adjacent subregions share the fr between them. when the last one
+        # ended on it, it's used again and the source is already past it
+        if self.carried is not None and self.carried[0] == sub.fa:
+            log.debug("Reusing %d from the last subregion", sub.fa)
+            fr = self.carried[1]
+            self.carried = None
+            self.frs_carried += 1
+            return fr
+        self.drop_carried_fr()
+        self.seek_to_fr(sub.fa)
+        log.debug("Reading %d into B", sub.fa)
+        return self.read_fr()
+
     def calc_frs_to_render(self, sub):
         reg_len = (sub.fb - sub.fa) + 1
         reg_duration = (sub.tb - sub.ta) / 1000.0
@@ -190,11 +260,7 @@ class Renderer(object):
 
         fr_1 = None
 
-        log.debug("Seeking to %d", sub.fa)
-        self.fr_source.seek_to_fr(sub.fa)
-
-        log.debug("Reading %d into B", sub.fa)
-        fr_2 = self.fr_source.read()
+        fr_2 = self.read_first_fr(sub)
 
         if fr_2 is None:
             log.warn("First frame in the region is None (B is None)")
@@ -205,15 +271,11 @@ class Renderer(object):
             final_run = True
             log.info("Ready to run:\t1 time (only writing S-frame)")
         else:
-            log.debug("Seeking to %d", sub.fa+1)
-            self.fr_source.seek_to_fr(sub.fa + 1)
+            self.seek_to_fr(sub.fa + 1)
 
             runs = reg_len
             log.info("Ready to run:\t%d times", runs)
 
-        if self.scaling_method == settings['scaler_dn']:
-            fr_2 = self.scale_fr(fr_2)
-
         def fr_draw_scale(w_fits, h_fits):
             return min(float(fr_2.shape[1]) / float(w_fits),
                        float(fr_2.shape[0]) / float(h_fits))
@@ -249,136 +311,173 @@ class Renderer(object):
         else:
             log.info("Showing a sample of the first and last %d runs:", show_n)
 
-        for run in range(0, runs):
-            fr_period = max(1, int(show_period * (runs - show_n*2)))
+        # pairs are submitted to the workers ahead of time, up to a window,
+        # and written in order as their results come in. plan_idx follows
+        # work_idx as if every planned frame had already been written so
+        # that drop decisions don't have to wait for writes
+        window = self.workers.window
+        # a source fr and the frs interpolated after it for every pair in the
+        # window, plus the frs being read and scaled
+        self.pool.capacity = window * (interpolate_each_go + 2) + 2
+        pending = collections.deque()
+        plan_idx = 0
+        run = 0
+
+        while run < runs or len(pending) > 0:
+            if self.cancelled:
+                raise RenderCancelled()
+            if run < runs:
+                fr_period = max(1, int(show_period * (runs - show_n*2)))
+
+                if not in_show_debug_range(run) and not showed_snipped_message:
+                    log.info("<Snipping %d runs from the console, but will update progress periodically every %d frames rendered>",
+                             runs - show_n*2, fr_period)
+                    showed_snipped_message = True
+
+                if not in_show_debug_range(run) and showed_snipped_message:
+                    if run % fr_period == 0:
+                        log.info("<Rendering progress: {:.2f}%>".format(
+                                 self.progress*100))
+
+                if run >= runs - 1:
+                    final_run = True
 
-            if not in_show_debug_range(run) and not showed_snipped_message:
-                log.info("<Snipping %d runs from the console, but will update progress periodically every %d frames rendered>",
-                         runs - show_n*2, fr_period)
-                showed_snipped_message = True
+                pair_a = sub.fa + run
+                pair_b = pair_a + 1 if run + 1 < runs else pair_a
 
-            if not in_show_debug_range(run) and showed_snipped_message:
-                if run % fr_period == 0:
-                    log.info("<Rendering progress: {:.2f}%>".format(
-                             self.progress*100))
+                if final_run:
+                    log.info("Run %d (this is the final run):", run)
+                else:
+                    log.debug("Run %d:", run)
+                log.debug("Pair A: %d, B: %d", pair_a, pair_b)
 
-            if run >= runs - 1:
-                final_run = True
+                log.debug("Copy last B frame, %d, into A", self.fr_source.idx-1)
+                fr_1 = fr_2
+                if fr_1 is None:
+                    log.error("A is None")
 
-            pair_a = sub.fa + run
-            pair_b = pair_a + 1 if run + 1 < runs else pair_a
+                # (run, pair_a, pair_b, final_run, fr_1, job, src_seen, drps)
+                # a job of None writes fr_1 alone, a pair that was dropped
+                # entirely has neither
+                to_write = None
 
-            if final_run:
-                log.info("Run %d (this is the final run):", run)
-            else:
-                log.debug("Run %d:", run)
-            log.debug("Pair A: %d, B: %d", pair_a, pair_b)
+                if final_run:
+                    to_write = (run, pair_a, pair_b, True, fr_1, None,
+                                src_seen, 0)
+                    log.info("To write: S{}".format(pair_a))
+                else:
+                    try:
+                        log.debug("Read %d into B", self.fr_source.idx)
+                        fr_2 = self.read_fr()
+                    except RuntimeError:
+                        log.error("Couldn't read %d (will abort runs)", self.fr_source.idx)
+                        log.warn("Setting B to None")
+                        fr_2 = None
+                    if fr_2 is None:
+                        log.warn("B is None")
+                        final_run = True
+                        to_write = (run, pair_a, pair_b, True, fr_1, None,
+                                    src_seen, 0)
+                        log.info("To write: S{}".format(pair_a))
+                    if not final_run:
+                        src_seen += 1
+
+                        will_write = True
+
+                        would_drp = []
+                        cmp_interpolate_each_go = interpolate_each_go
+                        cmp_work_idx = plan_idx - 1
+
+                        for x in range(1 + interpolate_each_go):
+                            cmp_work_idx += 1
+                            if drp_every > 0 and \
+                                    math.fmod(cmp_work_idx, drp_every) < 1.0:
+                                would_drp.append(x + 1)
+
+                        if len(would_drp) > 0:
+                            txt = ""
+                            for i, x in enumerate(would_drp):
+                                txt += "{}".format(str(x))
+                                if i < len(would_drp)-1:
+                                    txt += ","
+                            log.debug("Would drop indices:\t" + txt)
+
+                            if len(would_drp) <= interpolate_each_go:
+                                cmp_interpolate_each_go -= len(would_drp)
+                                log.debug("Compensating interpolation rate:\t%d (-%d)",
+                                          cmp_interpolate_each_go, len(would_drp))
+                            else:
+                                will_write = False
+                            if not will_write:
+                                self.frs_dropped += 1
+                                to_write = (run, pair_a, pair_b, False, None,
+                                            None, src_seen, len(would_drp))
+                                if in_show_debug_range(run):
+                                    log.info("Compensating, dropping S-frame")
+
+                        if will_write:
+                            job = self.workers.submit(fr_1, fr_2,
+                                                      cmp_interpolate_each_go)
+                            to_write = (run, pair_a, pair_b, False, fr_1, job,
+                                        src_seen, len(would_drp))
+
+                if to_write[3]:
+                    self.carry_fr(pair_a, fr_1)
+                if to_write[5] is None:
+                    plan_idx += 1
+                else:
+                    plan_idx += 1 + cmp_interpolate_each_go
+                pending.append(to_write)
+                run += 1
+                if final_run:
+                    run = runs  # nothing left to read
 
-            frs_to_write = []
+                if len(pending) < window and run < runs:
+                    continue
 
-            log.debug("Copy last B frame, %d, into A", self.fr_source.idx-1)
-            fr_1 = fr_2
-            if fr_1 is None:
-                log.error("A is None")
+            run_idx, pair_a, pair_b, is_final_run, fr_1, job, \
+                src_seen_then, drps = pending.popleft()
 
-            if final_run:
-                frs_to_write.append((fr_1, 'SOURCE', 1))
-                log.info("To write: S{}".format(pair_a))
-            else:
-                try:
-                    log.debug("Read %d into B", self.fr_source.idx)
-                    fr_2 = self.fr_source.read()
-                except RuntimeError:
-                    log.error("Couldn't read %d (will abort runs)", self.fr_source.idx)
-                    log.warn("Setting B to None")
-                    fr_2 = None
-                if fr_2 is None:
-                    log.warn("B is None")
-                    frs_to_write.append((fr_1, 'SOURCE', 1))
-                    final_run = True
-                    log.info("To write: S{}".format(pair_a))
-                if not final_run:
-                    src_seen += 1
+            if fr_1 is None and job is None:
+                work_idx += 1
+                continue
 
-                    if self.scaling_method == settings['scaler_dn']:
-                        fr_2 = self.scale_fr(fr_2)
+            frs_to_write = []
 
-                    fr_1_gr = cv2.cvtColor(fr_1, cv2.COLOR_BGR2GRAY)
-                    fr_2_gr = cv2.cvtColor(fr_2, cv2.COLOR_BGR2GRAY)
+            if job is None:
+                frs_to_write.append((fr_1, 'SOURCE', 1))
+            else:
+                interpolated_frs = job.get()
 
-                    f_uv = self.optflow_fn(fr_1_gr, fr_2_gr)
-                    b_uv = self.optflow_fn(fr_2_gr, fr_1_gr)
+                frs_interpolated += len(interpolated_frs)
 
-                    if isinstance(f_uv, np.ndarray):
-                        fu = f_uv[:,:,0]
-                        fv = f_uv[:,:,1]
-                        bu = b_uv[:,:,0]
-                        bv = b_uv[:,:,1]
-                    else:
-                        fu, fv = f_uv
-                        bu, bv = b_uv
-
-                    fr_1_32 = np.float32(fr_1) * 1/255.0
-                    fr_2_32 = np.float32(fr_2) * 1/255.0
-
-                    will_write = True
-
-                    would_drp = []
-                    cmp_interpolate_each_go = interpolate_each_go
-                    cmp_work_idx = work_idx - 1
-
-                    for x in range(1 + interpolate_each_go):
-                        cmp_work_idx += 1
-                        if drp_every > 0 and \
-                                math.fmod(cmp_work_idx, drp_every) < 1.0:
-                            would_drp.append(x + 1)
-
-                    if len(would_drp) > 0:
-                        txt = ""
-                        for i, x in enumerate(would_drp):
-                            txt += "{}".format(str(x))
-                            if i < len(would_drp)-1:
-                                txt += ","
-                        log.debug("Would drop indices:\t" + txt)
-
-                        if len(would_drp) <= interpolate_each_go:
-                            cmp_interpolate_each_go -= len(would_drp)
-                            log.debug("Compensating interpolation rate:\t%d (-%d)",
-                                      cmp_interpolate_each_go, len(would_drp))
-                        else:
-                            will_write = False
-                        if not will_write:
-                            work_idx += 1
-                            self.frs_dropped += 1
-                            if in_show_debug_range(run):
-                                log.info("Compensating, dropping S-frame")
-
-                    if will_write:
-                        interpolated_frs = self.interpolate_fn(
-                            fr_1_32, fr_2_32, fu, fv, bu, bv,
-                            cmp_interpolate_each_go)
-
-                        frs_interpolated += len(interpolated_frs)
-
-                        frs_to_write.append((fr_1, 'SOURCE', 0))
-                        for i, fr in enumerate(interpolated_frs):
-                            frs_to_write.append((fr, 'INTERPOLATED', i+1))
-                        if in_show_debug_range(run):
-                            temp_progress = (float(self.frs_written) +
-                                        len(frs_to_write)) / self.frs_to_render
-                            temp_progress *= 100.0
-                            log.info("To write: S{}\tI{},{}\t{:.2f}%".format(
-                                     pair_a, len(interpolated_frs), len(would_drp),
-                                     temp_progress))
+                frs_to_write.append((fr_1, 'SOURCE', 0))
+                for i, fr in enumerate(interpolated_frs):
+                    frs_to_write.append((fr, 'INTERPOLATED', i+1))
+                if in_show_debug_range(run_idx):
+                    temp_progress = (float(self.frs_written) +
+                                len(frs_to_write)) / self.frs_to_render
+                    temp_progress *= 100.0
+                    log.info("To write: S{}\tI{},{}\t{:.2f}%".format(
+                             pair_a, len(interpolated_frs), drps,
+                             temp_progress))
 
             for i, (fr, fr_type, idx_between_pair) in enumerate(frs_to_write):
+                if self.scaling_method == settings['scaler_up']:
+                    # upscaled once, dupes are written from the same buffer.
+                    # every job that used fr has finished by now
+                    scaled = self.scale_fr(fr, self.pool.get((self.h, self.w,
+                                                              3)))
+                    self.pool.put(fr)
+                    fr = scaled
+
                 work_idx += 1
                 writes_needed = 1
 
                 if dup_every > 0 and math.fmod(work_idx, dup_every) < 1.0:
                     frs_duped += 1
                     writes_needed = 2
-                if final_run:
+                if is_final_run:
                     writes_needed = (frs_to_render - frs_written)
                     if drp_every > 0 and math.fmod(work_idx, drp_every) < 1.0:
                         self.frs_dropped += 1
@@ -386,10 +485,10 @@ class Renderer(object):
                             log.warn("Dropping S{}".format(pair_a))
                         else:
                             log.warn("Dropping I{}".format(idx_between_pair))
+                        self.pool.put(fr)
                         continue
 
                 for write_idx in range(writes_needed):
-                    fr_to_write = fr
                     frs_written += 1
                     self.frs_written += 1
                     self.progress = float(self.frs_written)/self.frs_to_render
@@ -407,138 +506,262 @@ class Renderer(object):
                         else:
                             log.warn("Duping I%d", idx_between_pair)
 
-                    if self.scaling_method == settings['scaler_up']:
-                        fr = self.scale_fr(fr)
-
-                    if self.mark_frames:
-                        draw.draw_marker(fr, fill=fr_type == 'INTERPOLATED')
+                    if self.mark_frames and write_idx == 0:
+                        self.overlay.marker(fr, fill=fr_type == 'INTERPOLATED')
                     if self.add_info:
                         if writes_needed > 1:
-                            fr_to_write = fr.copy()
-                        draw.draw_debug_text(fr_to_write, self.text_type,
-                                             self.rate, self.optflow_fn,
-                                             self.frs_written, pair_a, pair_b,
-                                             idx_between_pair, fr_type,
-                                             is_dupe, frs_to_render,
-                                             frs_written, sub,
-                                             self.curr_sub_idx,
-                                             self.subs_to_render,
-                                             drp_every, dup_every, src_seen,
-                                             frs_interpolated, frs_dropped,
-                                             frs_duped)
-                    if self.show_preview:
-                        fr_to_show = fr.copy()
-                        draw.draw_progress_bar(fr_to_show, progress=self.progress)
-                        cv2.imshow(self.window_title, np.asarray(fr_to_show))
-                        cv2.waitKey(settings['imshow_ms'])
-
-                    self.pipe.stdin.write(bytes(fr_to_write.data))
+                            # undone after writing, dupes get their own info
+                            self.overlay.save()
+                        self.overlay.debug_text(fr, self.frs_written, pair_a,
+                                                pair_b, idx_between_pair,
+                                                fr_type, is_dupe,
+                                                frs_to_render, frs_written,
+                                                sub, self.curr_sub_idx,
+                                                self.subs_to_render,
+                                                drp_every, dup_every,
+                                                src_seen_then,
+                                                frs_interpolated,
+                                                frs_dropped, frs_duped)
+                    if self.preview is not None:
+                        self.preview.show(fr, self.progress)
+
+                    self.encoder.write(fr,
+                                       (fr_type, pair_a, pair_b,
+                                        idx_between_pair, is_dupe))
+                    if self.add_info and writes_needed > 1:
+                        self.overlay.restore(fr)
+
+                # the writers have copied fr, its buffer can be reused
+                self.pool.put(fr)
 
     def render(self):
         filename = os.path.splitext(os.path.basename(self.src))[0]
-        tempfile1 = os.path.join(
-            settings['tempdir'],
-            '{}.{}.{}'.format(filename, os.getpid(), settings['v_container']).lower())
+        if self.spool:
+            tempfile1 = self.dest
+        elif self.direct_write:
+            # next to the destination so that moving it there is a rename
+            tempfile1 = os.path.join(
+                os.path.dirname(os.path.abspath(self.dest)),
+                '.{}.{}.{}'.format(filename, self.tmp_id,
+                                   settings['v_container']).lower())
+        else:
+            tempfile1 = os.path.join(
+                settings['tempdir'],
+                '{}.{}.{}'.format(filename, self.tmp_id, settings['v_container']).lower())
         log.info("Rendering to:\t%s", os.path.basename(tempfile1))
         log.info("Final destination:\t%s", self.dest)
-        self.fr_source = OpenCvFrameSource(self.src)
+        self.fr_source = OpenCvFrameSource(self.src, self.sequence.fr_table)
         self.fr_source.open()
-        self.mk_render_pipe(tempfile1)
+        subs = self.sequence.subregions
+        if self.stream_copy:
+            subs = self.sequence.split_for_stream_copy()
         self.frs_to_render = 0
-        for sub in self.sequence.subregions:
-            if not self.keep_subregions and sub.skip:
+        for sub in subs:
+            if not self.keep_subregions and sub.skip or sub.stream_copy:
                 continue
             else:
                 self.subs_to_render += 1
                 self.frs_to_render += self.calc_frs_to_render(sub)
+        audio_regions = None
+        if self.spool:
+            # kept in the index for when the spool is encoded
+            if self.av_info['a_stream_exists']:
+                audio_regions = self.audio_regions()
+            self.encoder = SpoolWriter(self.dest, self.w, self.h, self.rate,
+                                       os.path.abspath(self.src),
+                                       audio_regions)
+        elif self.mux:
+            if not self.av_info['a_stream_exists']:
+                log.warn('Not muxing because no audio stream exists in the input file')
+            elif self.direct_write or self.stream_copy:
+                audio_regions = self.audio_regions()
+            else:
+                self.start_audio()
+        if self.stream_copy:
+            # rendered and copied parts are joined when they're all done
+            self.start_copy(subs)
+        elif not self.spool:
+            self.mk_render_pipe(tempfile1, audio_regions)
         if self.show_preview:
-            cv2.namedWindow(self.window_title,
-                            cv2.WINDOW_OPENGL)
-            cv2.resizeWindow(self.window_title, self.w, self.h)
+            self.preview = Preview(self.window_title, self.w, self.h)
+            self.preview.start()
         self.progress = 0
         log.info("Rendering progress:\t{:.2f}%".format(0))
-        for i, sub in enumerate(self.sequence.subregions):
-            if not self.keep_subregions and sub.skip:
-                log.info("Skipping Subregion (%d): %s", i, str(sub))
-                continue
-            else:
-                log.info("Start working on Subregion (%d): %s", i, str(sub))
-                self.curr_sub_idx += 1
-                self.render_subregion(sub)
-                log.info("Done rendering Subregion (%d)", i)
-        if self.show_preview:
-            cv2.destroyAllWindows()
+        parts = []  # files joined into the output when copying, in order
+        try:
+            for i, sub in enumerate(subs):
+                if not self.keep_subregions and sub.skip:
+                    log.info("Skipping Subregion (%d): %s", i, str(sub))
+                    continue
+                elif sub.stream_copy:
+                    log.info("Copying Subregion (%d): %s", i, str(sub))
+                    self.close()
+                    self.encoder = None
+                    parts.append(self.copied_file(sub))
+                    self.secs_copied += (sub.tb - sub.ta) / 1000.0
+                else:
+                    log.info("Start working on Subregion (%d): %s", i,
+                             str(sub))
+                    if self.stream_copy and self.encoder is None:
+                        parts.append(os.path.join(
+                            settings['tempdir'],
+                            '{}.{}.part{}.ts'.format(filename, self.tmp_id,
+                                                     len(parts)).lower()))
+                        self.mk_render_pipe(parts[-1])
+                    self.curr_sub_idx += 1
+                    self.render_subregion(sub)
+                    log.info("Done rendering Subregion (%d)", i)
+        except RenderCancelled:
+            log.warn("Rendering was cancelled")
+            if self.preview is not None:
+                self.preview.close()
+            self.fr_source.close()
+            self.drop_carried_fr()
+            if self.encoder is not None:
+                self.encoder.abort()
+            if not self.spool and os.path.exists(tempfile1):
+                log.info("Delete:\t%s", os.path.basename(tempfile1))
+                os.remove(tempfile1)
+            if self.audio_thread is not None:
+                self.audio_thread.join()
+                if os.path.exists(self.audio_file):
+                    os.remove(self.audio_file)
+            if self.copy_thread is not None:
+                self.copy_thread.join()
+                self.rm_parts(parts)
+            raise
+        if self.preview is not None:
+            self.preview.close()
         self.fr_source.close()
+        self.drop_carried_fr()
         self.close()
         log.info("Rendering is finished")
-        if self.mux:
-            if self.av_info['a_stream_exists']:
-                self.mux_orig_audio_with_rendered_video(tempfile1)
-                return
-            else:
-                log.warn('Not muxing because no audio stream exists in the input file')
+        if self.spool:
+            return
+        if self.stream_copy:
+            self.join_parts(tempfile1, parts, audio_regions)
+        if self.audio_thread is not None:
+            self.mux_orig_audio_with_rendered_video(tempfile1)
+            return
         log.info("Moving: %s -> %s", os.path.basename(tempfile1), self.dest)
-        shutil.move(tempfile1, self.dest)
+        if self.direct_write:
+            if os.path.exists(self.dest):
+                os.remove(self.dest)  # rename won't replace files on windows
+            os.rename(tempfile1, self.dest)
+        else:
+            shutil.move(tempfile1, self.dest)
 
-    def mux_orig_audio_with_rendered_video(self, vid):
-        log.info("Muxing progress:\t{:.2f}%".format(0))
-        progress = 0
-        def update_progress():
-            log.info("Muxing progress:\t{:.2f}%".format(progress*100))
+    def start_copy(self, subs):
+        # the gops that are copied are cut out of the source in one pass that
+        # doesn't decode them, in the background while the rest renders. a
+        # copy that reaches the end of the video isn't cut there
         filename = os.path.splitext(os.path.basename(self.src))[0]
-        audio_files = []
-        to_extract = 0
-        for sub in self.sequence.subregions:
-            if not self.keep_subregions and sub.skip:
-                continue
-            else:
-                to_extract += 1
-        if to_extract == 0:
-            progress += 1.0/3
-            update_progress()
-        progress_chunk = 1.0/to_extract/3
+        cuts = set()
+        for sub in subs:
+            if sub.stream_copy:
+                cuts.add(sub.fa)
+                if sub.tb < self.sequence.duration:
+                    cuts.add(sub.fb)
+        self.copy_cuts = sorted(x for x in cuts if x > 0)
+        self.copy_name = os.path.join(
+            settings['tempdir'],
+            '{}.copy.{}.'.format(filename, self.tmp_id).lower())
+        self.copy_thread = threading.Thread(target=self.split_src)
+        self.copy_thread.daemon = True
+        self.copy_thread.start()
+
+    def split_src(self):
+        # the muxer counts packets in decoding order, so it's given times and
+        # cuts on the first keyframe after each. a time halfway between the
+        # cut and the frame before it allows for rounding, and for the video
+        # starting a little after the audio, which delays its packets as much
+        pts = self.sequence.fr_table.pts
+        times = [(pts[x-1] + pts[x]) / 2.0 / 1000.0 for x in self.copy_cuts]
+        try:
+            mux.split_video(self.src, times,
+                            self.copy_name.replace('%', '%%') + '%d.ts')
+        except RuntimeError as error:
+            self.copy_error = error
+
+    def copied_file(self, sub):
+        # the file the source was split into that starts on sub
+        return '{}{}.ts'.format(self.copy_name,
+                                bisect.bisect_right(self.copy_cuts, sub.fa))
+
+    def rm_parts(self, parts):
+        # the parts and every file the source was split into, including the
+        # ones that were rendered instead of copied
+        copied = ['{}{}.ts'.format(self.copy_name, x) for x in
+                  range(len(self.copy_cuts) + 1)]
+        for x in sorted(set(parts + copied)):
+            if os.path.exists(x):
+                log.info("Delete:\t%s", os.path.basename(x))
+                os.remove(x)
+
+    def join_parts(self, dest, parts, audio_regions):
+        log.info("Waiting for the copied parts")
+        self.copy_thread.join()
+        if self.copy_error is not None:
+            raise self.copy_error
+        mux.concat_av_files(dest, parts, self.src, audio_regions)
+        self.rm_parts(parts)
+
+    def audio_speed(self, sub):
+        speed = sub.target_spd
+        if speed is None:
+            reg_duration = (sub.tb - sub.ta) / 1000.0
+            frs = self.calc_frs_to_render(sub)
+            speed = (self.rate * reg_duration) / frs
+            log.info("Speed not set for mux, calculated as: %fx", speed)
+        return speed
+
+    def audio_regions(self):
+        regions = []
         for i, sub in enumerate(self.sequence.subregions):
             if not self.keep_subregions and sub.skip:
                 continue
-            tempfile1 = os.path.join(
-                settings['tempdir'],
-                '{}.{}.{}.{}'.format(filename,
-                                     i,
-                                     os.getpid(),
-                                     settings['a_container']).lower())
-            log.info("Start working on audio from subregion (%d):", i)
-            log.info("Extracting to:\t%s", os.path.basename(tempfile1))
-            speed = sub.target_spd
-            if speed is None:
-                reg_duration = (sub.tb - sub.ta) / 1000.0
-                frs = self.calc_frs_to_render(sub)
-                speed = (self.rate * reg_duration) / frs
-                log.info("Speed not set for mux, calculated as: %fx", speed)
-            mux.extract_audio(self.src,
-                              tempfile1,
-                              sub.ta,
-                              sub.tb,
-                              speed)
-            audio_files.append(tempfile1)
-            progress += progress_chunk
-            update_progress()
-        tempfile2 = os.path.join(
+            log.info("Audio from subregion (%d):", i)
+            regions.append((sub.ta, sub.tb, self.audio_speed(sub)))
+        return regions
+
+    def start_audio(self):
+        # the audio only depends on the source and the subregion speeds so
+        # it's prepared in the background while the video renders
+        filename = os.path.splitext(os.path.basename(self.src))[0]
+        regions = self.audio_regions()
+        self.audio_file = os.path.join(
             settings['tempdir'],
             '{}.merged.{}.{}'.format(filename,
-                                     os.getpid(),
+                                     self.tmp_id,
                                      settings['a_container']).lower())
-        log.info("Merging to:\t%s", os.path.basename(tempfile2))
-        mux.concat_av_files(tempfile2, audio_files)
-        progress += 1.0/3
-        update_progress()
-        mux.mux_av(vid, tempfile2, self.dest)
-        progress += 1.0/3
-        update_progress()
-        for file in audio_files:
-            log.info("Delete:\t%s", os.path.basename(file))
-            os.remove(file)
-        log.info("Delete:\t%s", os.path.basename(tempfile2))
-        os.remove(tempfile2)
+        self.audio_thread = threading.Thread(target=self.extract_audio,
+                                             args=(regions,))
+        self.audio_thread.daemon = True
+        self.audio_thread.start()
+
+    def extract_audio(self, regions):
+        t = time.time()
+        try:
+            mux.extract_audio_regions(self.src, self.audio_file, regions)
+        except RuntimeError as error:
+            self.audio_error = error
+        self.audio_secs = time.time() - t
+
+    def mux_orig_audio_with_rendered_video(self, vid):
+        log.info("Muxing progress:\t{:.2f}%".format(0))
+        t = time.time()
+        self.audio_thread.join()
+        waited = time.time() - t
+        if self.audio_error is not None:
+            raise self.audio_error
+        self.audio_secs_saved = max(0, self.audio_secs - waited)
+        log.info("Audio took %.3g secs, waited %.3g secs for it",
+                 self.audio_secs, waited)
+        log.info("Muxing progress:\t{:.2f}%".format(50))
+        mux.mux_av(vid, self.audio_file, self.dest)
+        log.info("Muxing progress:\t{:.2f}%".format(100))
+        log.info("Delete:\t%s", os.path.basename(self.audio_file))
+        os.remove(self.audio_file)
         log.info("Delete:\t%s", os.path.basename(vid))
         os.remove(vid)
 
@@ -1,23 +1,56 @@
 # -*- coding: utf-8 -*-
 
+import bisect
 import datetime
 
 
+class OverlapError(AttributeError):
+    # raised with the subregions that overlap
+    def __init__(self, msg, subregions):
+        AttributeError.__init__(self, msg)
+        self.subregions = subregions
+
+
 class VideoSequence(object):
-    def __init__(self, duration, frames):
+    # subregions cover the whole video in order of time. the ones that weren't
+    # added are skip subregions filling the gaps. they are kept sorted, with
+    # the times they start and end at in separate lists, so that the place of
+    # a new subregion and anything it overlaps is found by bisecting
+    def __init__(self, duration, frames, fr_table=None):
+        # with a FrameTable, times are mapped to the exact frames shown then
+        # instead of proportionally
         self.duration = duration
         self.frames = frames
-        self.subregions = []
-        self.add_subregion(Subregion(0, duration, skip=True))
+        self.fr_table = fr_table
+        sub = Subregion(0, duration, skip=True)
+        sub.fa = self.nearest_fr(0)
+        sub.fb = self.nearest_fr(duration)
+        self.subregions = [sub]
+        self.starts = [sub.ta]
+        self.ends = [sub.tb]
+
+    @classmethod
+    def from_subregions(cls, duration, frames, subs, fr_table=None):
+        seq = cls(duration, frames, fr_table)
+        seq.add_subregions(subs)
+        return seq
 
     def relative_pos(self, time):
         return max(0.0, min(float(time) / self.duration, 1.0))
 
     def nearest_fr(self, time):
+        if self.fr_table is not None:
+            return self.fr_table.fr_at(time)
         return max(0, min(int(self.relative_pos(time) * self.frames),
                           self.frames-1))
 
-    def add_subregion(self, sub):
+    def check_in_range(self, sub):
+        if sub.exact_frs:
+            if sub.fa > sub.fb:
+                raise ValueError("fa>fb")
+            if sub.fb > self.frames-1:
+                raise ValueError("{} > frames={}".format(sub.fb, self.frames))
+            return
         duration_string = str(datetime.timedelta(seconds=self.duration/1000.0))
         if sub.ta > self.duration:
             raise ValueError("{} > duration={}".format(sub.ta, duration_string))
@@ -25,51 +58,171 @@ class VideoSequence(object):
             raise ValueError("{} > duration={}".format(sub.tb, duration_string))
         sub.fa = self.nearest_fr(sub.ta)
         sub.fb = self.nearest_fr(sub.tb)
-        if len(self.subregions) == 0 and sub.skip:
-            self.subregions.append(sub)
+
+    def time_at_fr(self, fr):
+        # when fr starts being shown
+        if self.fr_table is not None:
+            return self.fr_table.time_at(fr)
+        return fr * float(self.duration) / self.frames
+
+    def subregion_at_frs(self, fa, fb):
+        # a subregion that keeps the frames it's given instead of rounding
+        # them from times. it lasts until fb starts being shown, or to the end
+        # if fb is the last frame, so subregions given as fa-fb and fb-fc
+        # share fb and cover the times in between exactly
+        if fa < 0:
+            raise ValueError("{} < 0".format(fa))
+        if fb > self.frames-1:
+            raise ValueError("{} > frames={}".format(fb, self.frames))
+        if fb == self.frames-1:
+            tb = self.duration
+        else:
+            tb = self.time_at_fr(fb)
+        sub = Subregion(self.time_at_fr(fa), tb)
+        sub.fa = fa
+        sub.fb = fb
+        sub.exact_frs = True
+        return sub
+
+    def mk_skip(self, ta, tb, fa, fb):
+        try:
+            sub = Subregion(ta, tb, skip=True)
+        except AttributeError as e:
+            raise AttributeError("Bad internal subregion ({})".format(e))
+        sub.fa = fa
+        sub.fb = fb
+        return sub
+
+    def replace(self, lo, hi, subs):
+        self.subregions[lo:hi] = subs
+        self.starts[lo:hi] = [x.ta for x in subs]
+        self.ends[lo:hi] = [x.tb for x in subs]
+
+    def add_subregion(self, sub):
+        # the subregion has to fit in a skip subregion, which is split around
+        # it. subregions without a length can also go between two others
+        self.check_in_range(sub)
+        lo = bisect.bisect_right(self.ends, sub.ta)  # first to end after ta
+        if sub.ta == sub.tb:
+            if lo < len(self.subregions) and self.subregions[lo].ta < sub.ta:
+                hi = lo + 1  # inside a subregion
+            else:
+                hi = lo  # between subregions
+                if lo > 0 and self.starts[lo-1] == sub.ta:
+                    other = self.subregions[lo-1]
+                    raise OverlapError("Overlaps with subregion: {}".format(
+                                       other), (other, sub))
+        else:
+            hi = bisect.bisect_left(self.starts, sub.tb)  # after last to start
+        if hi - lo > 1 or hi - lo == 1 and not self.subregions[lo].skip:
+            other = next((x for x in self.subregions[lo:hi] if not x.skip),
+                         self.subregions[lo])
+            raise OverlapError("Overlaps with subregion: {}".format(other),
+                               (other, sub))
+        if hi == lo:
+            self.replace(lo, hi, [sub])
             return
+        skip = self.subregions[lo]
+        subs = []
+        if skip.ta != sub.ta:
+            subs.append(self.mk_skip(skip.ta, sub.ta, skip.fa, sub.fa))
+        subs.append(sub)
+        if sub.tb != skip.tb:
+            subs.append(self.mk_skip(sub.tb, skip.tb, sub.fb, skip.fb))
+        self.replace(lo, hi, subs)
+
+    def add_subregions(self, subs):
+        # adds many subregions at once. into an empty sequence they're sorted
+        # and checked for overlaps in one pass, instead of one at a time
+        if len(self.subregions) > 1 or not self.subregions[0].skip:
+            for sub in subs:
+                self.add_subregion(sub)
+            return
+        subs = sorted(subs, key=lambda x: (x.ta, x.tb))
+        for sub in subs:
+            self.check_in_range(sub)
+        last = None  # the subregion that ends last so far
+        for prev, sub in zip([None] + subs, subs):
+            if last is not None and sub.ta < last.tb:
+                raise OverlapError("Subregions overlap: {} and {}".format(
+                                   last, sub), (last, sub))
+            if prev is not None and prev.ta == sub.ta and prev.tb == sub.tb:
+                raise OverlapError("Subregions overlap: {} and {}".format(
+                                   prev, sub), (prev, sub))
+            if last is None or sub.tb > last.tb:
+                last = sub
+        if len(subs) == 0:
+            return
+        skip = self.subregions[0]
         temp_subs = []
-        for s in self.subregions:
-            if not s.skip:
-                temp_subs.append(s)
-        temp_subs.append(sub)
-        temp_subs.sort(key=lambda x: (x.fb, x.fa), reverse=False)
-        self.subregions = temp_subs
-        temp_subs = []
-        seq_len = len(self.subregions)
-        i = 0
-        while i < seq_len:
-            curr = self.subregions[i]
-            if i == 0 and curr.ta != 0:  # beginning to first sub
-                try:
-                    new_sub = Subregion(0, curr.ta, skip=True)
-                except AttributeError as e:
-                    raise AttributeError("Bad internal subregion ({})".format(e))
-                new_sub.fa = 0
-                new_sub.fb = curr.fa
-                temp_subs.append(new_sub)
-            temp_subs.append(curr)
-            if i+1 == seq_len:  # last sub to end
-                if curr.tb != self.duration:
-                    try:
-                        new_sub = Subregion(curr.tb, self.duration, skip=True)
-                    except AttributeError as e:
-                        raise AttributeError("Bad internal subregion ({})".format(e))
-                    new_sub.fa = curr.fb
-                    new_sub.fb = self.frames-1
-                    temp_subs.append(new_sub)
-                break
-            next = self.subregions[i+1]
-            if curr.tb != next.ta:  # between subs
-                try:
-                    new_sub = Subregion(curr.tb, next.ta, skip=True)
-                except AttributeError as e:
-                    raise AttributeError("Bad internal subregion ({})".format(e))
-                new_sub.fa = curr.fb
-                new_sub.fb = next.fa
-                temp_subs.append(new_sub)
-            i += 1
-        self.subregions = temp_subs
+        if subs[0].ta != 0:  # beginning to first sub
+            temp_subs.append(self.mk_skip(0, subs[0].ta, skip.fa, subs[0].fa))
+        for prev, sub in zip([None] + subs, subs):
+            if prev is not None and prev.tb != sub.ta:  # between subs
+                temp_subs.append(self.mk_skip(prev.tb, sub.ta, prev.fb,
+                                              sub.fa))
+            temp_subs.append(sub)
+        if subs[-1].tb != self.duration:  # last sub to end
+            temp_subs.append(self.mk_skip(subs[-1].tb, self.duration,
+                                          subs[-1].fb, skip.fb))
+        self.replace(0, len(self.subregions), temp_subs)
+
+    def split_for_stream_copy(self):
+        # returns the subregions with the whole gops in every skip subregion
+        # split out into subregions to be stream copied, from its first
+        # keyframe up to its last one, or to the end of the video. the frames
+        # around them are left in skip subregions to be rendered. without a
+        # FrameTable the keyframes aren't known and nothing is split
+        if self.fr_table is None:
+            return list(self.subregions)
+        keyframes = self.fr_table.keyframes
+        subs = []
+        for sub in self.subregions:
+            if not sub.skip:
+                subs.append(sub)
+                continue
+            i = bisect.bisect_left(keyframes, sub.fa)  # first in sub
+            if i < len(keyframes) and self.time_at_fr(keyframes[i]) < sub.ta:
+                i += 1  # fa started being shown before the sub starts
+            j = bisect.bisect_right(keyframes, sub.fb) - 1  # last in sub
+            if j < i:
+                subs.append(sub)
+                continue
+            if sub.tb == self.duration:
+                k2 = sub.fb
+                tb = sub.tb
+            else:
+                k2 = keyframes[j]
+                tb = self.time_at_fr(k2)
+            if self.time_at_fr(keyframes[i]) >= tb:  # not a whole gop
+                subs.append(sub)
+                continue
+            k1 = keyframes[i]
+            ta = self.time_at_fr(k1)
+            if sub.ta < ta:
+                subs.append(self.mk_skip(sub.ta, ta, sub.fa, k1))
+            copy = self.mk_skip(ta, tb, k1, k2)
+            copy.stream_copy = True
+            subs.append(copy)
+            if tb < sub.tb:
+                subs.append(self.mk_skip(tb, sub.tb, k2, sub.fb))
+        return subs
+
+    def first_overlap(self):
+        # returns the first two subregions that intersect, in time or frames,
+        # or None. a sweep over the subregions in order, comparing each with
+        # the one before it and the one that reaches the furthest
+        last = None
+        prev = None
+        for sub in self.subregions:
+            if prev is not None and sub.intersects(prev):
+                return prev, sub
+            if last is not None and last is not prev and sub.intersects(last):
+                return last, sub
+            if last is None or sub.fb > last.fb:
+                last = sub
+            prev = sub
+        return None
 
     def __str__(self):
         s = 'Sequence: Duration={} ({:.2f}s), Frames={}\n'.format(
@@ -99,6 +252,8 @@ class Subregion(object):
         self.target_dur = None
         self.target_fps = None
         self.skip = skip
+        self.exact_frs = False  # fa and fb were given, not rounded from times
+        self.stream_copy = False  # copied from the source, not rendered
         if skip:
             self.target_spd = 1.0
 
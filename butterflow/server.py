@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# renders jobs sent over http, on a localhost port or a unix socket, in one
+# long-running process. jobs share a batch session so the OpenCL device, the
+# kernels built on it, and the worker processes stay warm between them. a job
+# is the options and video of a butterflow command:
+#
+#   POST   /jobs       {"args": "-r 60 -o out.mp4 in.mp4"}, queues a job
+#   GET    /jobs       every job, oldest first
+#   GET    /jobs/<id>  a job and its progress
+#   DELETE /jobs/<id>  cancels a queued or running job
+#
+# jobs can write anywhere the user can, so requests from browsers, which send
+# an Origin header, are refused and posts have to be application/json. a unix
+# socket is only accessible by the user, on a port every request needs the
+# header `Authorization: Bearer <token>` with the token from mk_token_file
+
+import os
+import stat
+import time
+import json
+import hmac
+import socket
+import binascii
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+from butterflow.batch import argv_from_json, ManifestError
+
+import logging
+log = logging.getLogger('butterflow')
+
+
+class Job(object):
+    def __init__(self, id, argv, args):
+        self.id = id
+        self.argv = argv
+        self.args = args  # parsed options
+        self.state = 'queued'  # running, done, failed or cancelled
+        self.rc = None
+        self.renderer = None  # set once the job has been prepared
+        self.cancelled = False
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def cancel(self):
+        self.cancelled = True
+        rnd = self.renderer
+        if rnd is not None:
+            rnd.cancel()
+
+    def to_dict(self):
+        d = collections.OrderedDict([
+            ('id', self.id),
+            ('args', self.argv),
+            ('state', self.state),
+            ('rc', self.rc),
+            ('submitted', self.submitted),
+            ('started', self.started),
+            ('finished', self.finished)])
+        rnd = self.renderer
+        if rnd is not None:
+            d['progress'] = rnd.progress
+            d['frames_written'] = rnd.frs_written
+            d['frames_to_render'] = rnd.frs_to_render
+            d['subregion'] = rnd.curr_sub_idx
+            d['subregions'] = rnd.subs_to_render
+        return d
+
+
+class JobQueue(object):
+    # runs queued jobs in order with up to `jobs` at once. parse_fn(argv)
+    # returns the options or raises ValueError, run_fn(job) renders a job and
+    # returns its return code
+    def __init__(self, parse_fn, run_fn, jobs=1):
+        self.parse_fn = parse_fn
+        self.run_fn = run_fn
+        self.jobs = collections.OrderedDict()
+        self.pending = collections.deque()
+        self.next_id = 1
+        self.closed = False
+        self.cond = threading.Condition()
+        self.threads = []
+        for i in range(max(1, jobs)):
+            t = threading.Thread(target=self.run_jobs)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, argv):
+        args = self.parse_fn(argv)
+        with self.cond:
+            job = Job(self.next_id, argv, args)
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self.pending.append(job)
+            self.cond.notify()
+        log.info('Queued job %d: %s', job.id, ' '.join(argv))
+        return job
+
+    def get(self, id):
+        with self.cond:
+            return self.jobs.get(id)
+
+    def all(self):
+        with self.cond:
+            return self.jobs.values()
+
+    def cancel(self, id):
+        with self.cond:
+            job = self.jobs.get(id)
+            if job is None or job.state not in ['queued', 'running']:
+                return job
+            if job.state == 'queued':
+                self.pending.remove(job)
+                job.state = 'cancelled'
+                job.finished = time.time()
+            job.cancel()
+        log.info('Cancelling job %d', id)
+        return job
+
+    def run_jobs(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0 and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                job = self.pending.popleft()
+                job.state = 'running'
+                job.started = time.time()
+            log.info('Starting job %d', job.id)
+            try:
+                rc = self.run_fn(job)
+            except Exception:
+                log.exception('Job %d failed', job.id)
+                rc = 1
+            with self.cond:
+                job.rc = rc
+                job.finished = time.time()
+                if job.cancelled:
+                    job.state = 'cancelled'
+                elif rc == 0:
+                    job.state = 'done'
+                else:
+                    job.state = 'failed'
+            log.info('Job %d %s in %.3g secs', job.id, job.state,
+                     job.finished - job.started)
+
+    def close(self):
+        # running jobs are cancelled, queued ones are dropped
+        with self.cond:
+            self.closed = True
+            running = [x for x in self.jobs.values() if x.state == 'running']
+            self.cond.notify_all()
+        for job in running:
+            job.cancel()
+        for t in self.threads:
+            t.join()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'butterflow'
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, code, message):
+        self.send_json(code, {'error': message})
+
+    def job_id(self):
+        # the id in /jobs/<id>, None if the path isn't a job
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return None
+        try:
+            return int(parts[1])
+        except ValueError:
+            return None
+
+    def check_request(self):
+        # responds and returns False when a request isn't allowed
+        if self.headers.getheader('Origin') is not None:
+            self.send_error_json(403, 'Requests from browsers aren\'t allowed')
+            return False
+        token = self.server.token
+        if token is not None:
+            auth = self.headers.getheader('Authorization', '')
+            if not hmac.compare_digest(auth, 'Bearer ' + token):
+                self.send_error_json(401, 'Missing or wrong token')
+                return False
+        return True
+
+    def do_GET(self):
+        if not self.check_request():
+            return
+        queue = self.server.queue
+        if self.path.rstrip('/') == '/jobs':
+            self.send_json(200, [x.to_dict() for x in queue.all()])
+            return
+        id = self.job_id()
+        job = queue.get(id) if id is not None else None
+        if job is None:
+            self.send_error_json(404, 'No such job')
+            return
+        self.send_json(200, job.to_dict())
+
+    def do_POST(self):
+        if not self.check_request():
+            return
+        if self.path.rstrip('/') != '/jobs':
+            self.send_error_json(404, 'Not found')
+            return
+        if self.headers.gettype() != 'application/json':
+            self.send_error_json(415, 'Jobs have to be application/json')
+            return
+        try:
+            n = int(self.headers.getheader('Content-Length', 0))
+            entry = json.loads(self.rfile.read(n))
+            if not isinstance(entry, dict) or 'args' not in entry:
+                raise ValueError('expected an object with `args`')
+            job = self.server.queue.submit(argv_from_json(entry['args']))
+        except (ValueError, ManifestError) as error:
+            self.send_error_json(400, 'Bad job: {}'.format(error))
+            return
+        self.send_json(201, job.to_dict())
+
+    def do_DELETE(self):
+        if not self.check_request():
+            return
+        id = self.job_id()
+        job = self.server.queue.cancel(id) if id is not None else None
+        if job is None:
+            self.send_error_json(404, 'No such job')
+            return
+        self.send_json(200, job.to_dict())
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        log.debug('[Server] %s %s', self.address_string(), format % args)
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn,
+                     SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # a socket left behind by a server that didn't exit cleanly
+        if os.path.exists(self.server_address) and \
+                stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        os.chmod(self.server_address, stat.S_IRUSR | stat.S_IWUSR)
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def mk_token_file(path):
+    # a random token, written to a file only the user can read
+    token = binascii.hexlify(os.urandom(16))
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                 stat.S_IRUSR | stat.S_IWUSR)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token + '\n')
+    return token
+
+
+def mk_server(address, queue, token=None):
+    # a port number listens on localhost only, anything else is the path of a
+    # unix socket. with a token, requests have to carry it
+    if address.isdigit():
+        server = HTTPServer(('127.0.0.1', int(address)), Handler)
+    elif hasattr(socket, 'AF_UNIX'):
+        server = UnixHTTPServer(address, Handler)
+    else:
+        raise ValueError('Unix sockets aren\'t supported here, use a port')
+    server.queue = queue
+    server.token = token
+    return server
@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
 
+# this module is imported by everything, including paths like `--version`
+# that never render, so it doesn't import cv2 or the OpenCL extension. the
+# opencv constants below are spelled out
 import os
 import logging
 import tempfile
-import cv2
-import ocl
 from butterflow.version import __version__
 
 
+def rgb(r, g, b):
+    # same as cv2.cv.RGB, a bgr scalar
+    return (float(b), float(g), float(r), 0.0)
+
+
 default = {
     'debug_opts':     False,
     # show first and last n runs, -1 to show all
@@ -50,10 +56,10 @@ default = {
     'crf':            18,       # visually lossless
     # scaling opts
     'video_scale':    1.0,
-    'scaler_up':      cv2.cv.CV_INTER_AREA,
+    'scaler_up':      3,  # cv2.INTER_AREA
     # CV_INTER_CUBIC looks best but is slower, CV_INTER_LINEAR is faster but
     # still looks okay
-    'scaler_dn':      cv2.cv.CV_INTER_CUBIC,
+    'scaler_dn':      2,  # cv2.INTER_CUBIC
     # muxing opts
     'v_container':    'mp4',
     # See: https://trac.ffmpeg.org/wiki/Encode/HighQualityAudio
@@ -75,6 +81,13 @@ default = {
     # is copied with shutil.copy2 then removed
     'tempdir':        os.path.join(tempfile.gettempdir(),
                                    'butterflow-{}'.format(__version__)),
+    # probe results are cached by path, size and modification time. also
+    # hash the first and last x bytes of videos to catch files that were
+    # replaced without changing either
+    'probe_hash':       False,
+    'probe_hash_bytes': 1 << 20,
+    # optical flow method, See: butterflow/flow.py for the available methods
+    'flow_method':    'farneback',
     # farneback optical flow options
     'pyr_scale':      0.5,
     'levels':         3,
@@ -85,19 +98,57 @@ default = {
     'poly_s':         1.1,
     'fast_pyr':       False,
     'flow_filter':    'box',
+    # when estimating the backward flow from the forward flow, compute it
+    # instead if warping with the estimate leaves more than x times the error
+    # of the forward flow, or if more than x of its pixels had to be filled
+    'bwd_max_err_ratio':  1.25,
+    'bwd_max_holes':      0.05,
+    'bwd_invert_iters':   4,     # fixed-point iterations to invert a flow
+    # dis optical flow options, presets: ultrafast, fast, medium
+    'dis_preset':     'fast',
+    # block matching optical flow options
+    'bm_levels':      4,     # number of pyramid levels above the source
+    'bm_radius':      2,     # search radius in pixels at each level
+    'bm_block':       7,     # size of the block to match at each level
+    'bm_min_level':   1,     # finest level searched, 1 is half resolution
+    # how flows are kept between estimating and interpolating with them:
+    # float32, float16, or int16 in fixed steps of 1/x px. the compact formats
+    # take half the memory and int16 also halves uploads to the device. int16
+    # flows saturate at 32767/x px
+    'flow_storage':       'float32',
+    'flow_fixed_steps':   64,
+    # pairs queued on each worker when rendering with multiple devices, more
+    # keeps devices busy but holds more frames in memory
+    'pairs_per_worker':  2,
+    # frames in a keyframe interval and intervals in a segment when encoding
+    # with `-enc`, and raw frames waiting to be piped into each encoder
+    'segment_gop':    60,
+    'segment_gops':   2,
+    'segment_queue_frs': 4,
+    # worker processes that interpolate on the cpu alongside OpenCL devices
+    # when rendering with `-hybrid`
+    'cpu_workers':    1,
+    # weight of the latest pair when averaging how long a worker takes per
+    # pair, higher adapts faster to changes but is noisier
+    'latency_smoothing': 0.2,
     # -1 is max threads and it's the opencv default
     'ocv_threads':    -1,    # 0 will disable threading optimizations
     # milliseconds to display image in preview window
     'imshow_ms':      1,
+    # the preview window is refreshed at most this many times a second and is
+    # downscaled to fit this width
+    'preview_fps':    15,
+    'preview_w':      960,
+    'preview_close_secs':  1.0,
     # debug text settings
     'text_type':      'light',      # other options: `dark`, `stroke`
-    'light_color':    cv2.cv.RGB(255, 255, 255),
-    'dark_color':     cv2.cv.RGB(0, 0, 0),
+    'light_color':    rgb(255, 255, 255),
+    'dark_color':     rgb(0, 0, 0),
     # h_fits and v_fits is the minimium size in which the unscaled
     # CV_FONT_HERSHEY_PLAIN font text fits in the rendered video. The font is
     # scaled up and down based on this reference point
-    'font_face':      cv2.cv.CV_FONT_HERSHEY_PLAIN,
-    'font_type':      cv2.cv.CV_AA,
+    'font_face':      1,  # cv2.FONT_HERSHEY_PLAIN
+    'font_type':      16,  # cv2.CV_AA
     'txt_max_scale':  1.0,
     'txt_thick':      1,
     'txt_stroke_thick':  2,
@@ -116,11 +167,11 @@ default = {
     'bar_s_pad':      0.12,  # relative padding on each side
     'bar_ln_thick':   3,     # pixels of lines that make outer rectangle
     'bar_stroke_thick':  1,  # size of the stroke in pixels
-    'bar_ln_type':    cv2.cv.CV_FILLED,  # -1, a filled line
+    'bar_ln_type':    -1,  # cv2.cv.CV_FILLED, a filled line
     'bar_in_pad':     3,     # padding from the inner bar
     'bar_thick':      15,    # thickness of the inner bar
-    'bar_color':      cv2.cv.RGB(255, 255, 255),
-    'bar_stroke_color':  cv2.cv.RGB(192, 192, 192),
+    'bar_color':      rgb(255, 255, 255),
+    'bar_stroke_color':  rgb(192, 192, 192),
     # frame marker settings
     'mrk_w_fits':     572,
     'mrk_h_fits':     142,
@@ -130,13 +181,14 @@ default = {
     'mrk_out_radius': 6,
     'mrk_in_thick':   -1,
     'mrk_in_radius':  4,
-    'mrk_ln_type':    cv2.cv.CV_AA,
-    'mrk_out_color':  cv2.cv.RGB(255, 255, 255),
-    'mrk_color':      cv2.cv.RGB(255, 255, 255),
-    'mrk_fill_color': cv2.cv.RGB(255, 0, 0)
+    'mrk_ln_type':    16,  # cv2.CV_AA
+    'mrk_out_color':  rgb(255, 255, 255),
+    'mrk_color':      rgb(255, 255, 255),
+    'mrk_fill_color': rgb(255, 0, 0)
 }
 
 default['clbdir'] = os.path.join(default['tempdir'], 'clb')  # ocl cache files
+default['idxdir'] = os.path.join(default['tempdir'], 'idx')  # probe results
 
 # override default settings with development settings
 # ignore errors when dev_settings.py does not exist
@@ -151,9 +203,6 @@ except AttributeError:
     pass
 
 # make temporary directories
-for x in [default['clbdir'], default['tempdir']]:
+for x in [default['clbdir'], default['idxdir'], default['tempdir']]:
     if not os.path.exists(x):
         os.makedirs(x)
-
-# set the location of the clb cache
-ocl.set_cache_path(default['clbdir'] + os.sep)
@@ -7,8 +7,11 @@ import cv2
 
 
 class OpenCvFrameSource(object):
-    def __init__(self, src):
+    def __init__(self, src, fr_table=None):
+        # with a FrameTable the number of frames is exact and seeks that stay
+        # between two keyframes decode forward instead of seeking
         self.src = src
+        self.fr_table = fr_table
         self.capture = None
         self.frames = 0
 
@@ -21,6 +24,8 @@ class OpenCvFrameSource(object):
         if not self.capture.isOpened():
             raise RuntimeError
         self.frames = int(self.capture.get(cv2.cv.CV_CAP_PROP_FRAME_COUNT))
+        if self.fr_table is not None:
+            self.frames = self.fr_table.frames
 
     def close(self):
         if self.capture is not None:
@@ -30,15 +35,28 @@ class OpenCvFrameSource(object):
     def seek_to_fr(self, idx):  # idx will +1 automatically after a seek
         if idx < 0 or idx > self.frames-1:
             raise IndexError
+        pos = int(self.idx)
+        if self.fr_table is not None and pos <= idx and \
+                self.fr_table.keyframe_before(idx) <= pos:
+            # a seek would decode from the same keyframe or an earlier one
+            while pos < idx:
+                if not self.capture.grab():
+                    raise RuntimeError
+                pos += 1
+            return
         if self.capture.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, idx) is not True:
             raise RuntimeError
 
-    def read(self):
+    def read(self, out=None):
         # read fr at self.idx and return it, return None if there are no frames
-        # available. seek pos will +1 automatically if successful
+        # available. seek pos will +1 automatically if successful. with out,
+        # the fr is decoded into that array if it has the right shape
         if self.idx < 0 or self.idx > self.frames-1:
             return None
-        success, fr = self.capture.read()
+        if out is None:
+            success, fr = self.capture.read()
+        else:
+            success, fr = self.capture.read(out)
         if success is not True:  # can be False or None
             raise RuntimeError
         return fr
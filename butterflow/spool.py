@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# a spool holds rendered frames so that they can be encoded later, possibly on
+# another machine or more than once with different settings. it's a directory
+# with the raw bgr24 frames back to back in one file, which can be memory
+# mapped, and an index describing the video and every frame in it
+
+import os
+import json
+import threading
+import numpy as np
+from butterflow.encoders import encoder_call, PipeEncoder, SegmentedEncoder
+
+import logging
+log = logging.getLogger('butterflow')
+
+frames_file = 'frames.bgr'
+index_file = 'index.json'
+version = 1
+
+
+class SpoolWriter(object):
+    # has the same write, close and abort methods as the encoders
+    def __init__(self, dest, w, h, rate, src=None, audio_regions=None):
+        if os.path.exists(dest) and not os.path.isdir(dest):
+            raise RuntimeError('Spool path is not a directory: {}'.format(dest))
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+        self.dest = dest
+        self.index = {
+            'version': version,
+            'w': w,
+            'h': h,
+            'rate': rate,
+            'src': src,
+            'audio_regions': audio_regions,
+            'frames': []}
+        log.info('Spooling to:\t%s', dest)
+        self.f = open(os.path.join(dest, frames_file), 'wb')
+
+    def write(self, fr, info=None):
+        # info is (type, pair_a, pair_b, idx_between_pair, is_dupe)
+        self.f.write(bytes(fr.data))
+        if info is None:
+            info = ('SOURCE', -1, -1, 0, False)
+        fr_type, pair_a, pair_b, idx_between_pair, is_dupe = info
+        self.index['frames'].append([fr_type[0], pair_a, pair_b,
+                                     idx_between_pair, int(is_dupe)])
+
+    def close(self):
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+        # written last, a spool without an index wasn't finished
+        tempfile = os.path.join(self.dest, index_file + '.part')
+        with open(tempfile, 'w') as f:
+            json.dump(self.index, f, separators=(',', ':'))
+        if os.path.exists(os.path.join(self.dest, index_file)):
+            os.remove(os.path.join(self.dest, index_file))
+        os.rename(tempfile, os.path.join(self.dest, index_file))
+        log.info('Spooled %d frames', len(self.index['frames']))
+
+    def abort(self):
+        # leaves the spool without an index, so it isn't mistaken for a
+        # finished one
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+
+
+def read_spool(path):
+    # returns the index and the frames as a read-only (n, h, w, 3) memmap
+    index_path = os.path.join(path, index_file)
+    if not os.path.exists(index_path):
+        raise RuntimeError('Not a finished spool: {}'.format(path))
+    with open(index_path) as f:
+        index = json.load(f)
+    if index['version'] != version:
+        raise RuntimeError('Unsupported spool version: {}'.format(
+                           index['version']))
+    n = len(index['frames'])
+    frs = np.memmap(os.path.join(path, frames_file), dtype=np.uint8,
+                    mode='r', shape=(n, index['h'], index['w'], 3))
+    return index, frs
+
+
+def spool_size(path):
+    return sum(os.path.getsize(os.path.join(path, x))
+               for x in os.listdir(path))
+
+
+def encode_spool(path, dest, lossless=False, audio=False, encoders=1,
+                 crf=None):
+    # encodes with the current settings, e.g. preset. crf is passed in so
+    # jobs encoding at once can each use their own
+    index, frs = read_spool(path)
+    w, h, rate = index['w'], index['h'], index['rate']
+    src = index['src']
+    audio_regions = None
+    if audio:
+        if not index['audio_regions']:
+            log.warn('Not muxing because the spool has no audio')
+        elif src is None or not os.path.exists(src):
+            log.warn('Not muxing because the source is missing: %s', src)
+        else:
+            audio_regions = index['audio_regions']
+    def mk_call(dest, gop=None, audio_regions=None):
+        return encoder_call(dest, w, h, rate, lossless, src, audio_regions,
+                            gop, crf)
+    if encoders > 1:
+        # jobs can encode spools in threads of the same process
+        tmp_id = '{}-t{}'.format(os.getpid(), threading.current_thread().ident)
+        encoder = SegmentedEncoder(dest, mk_call, encoders, tmp_id,
+                                   audio_src=src, audio_regions=audio_regions)
+    else:
+        encoder = PipeEncoder(mk_call(dest, audio_regions=audio_regions))
+    log.info('Encoding %d frames from:\t%s', len(frs), path)
+    try:
+        for fr in frs:
+            encoder.write(fr)
+    finally:
+        encoder.close()
+    return len(frs)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# interpolates frame pairs, either in the calling process or spread across
+# worker processes that each own an OpenCL device or run on the cpu. every
+# OpenCL worker process has its own context and command queue. pairs are
+# handed to the worker expected to finish them first, going by how long its
+# recent pairs took, and the renderer collects the results in the order it
+# submitted them
+
+import os
+import time
+import signal
+import threading
+import multiprocessing
+import cv2
+from butterflow.settings import default as settings
+from butterflow.interpolate import pack_flow, stored_flow_scale
+
+import logging
+log = logging.getLogger('butterflow')
+
+
+def interpolate_pair(optflow_fn, interpolate_fn, fr_1, fr_2, int_each_go,
+                     out=None, storage='float32'):
+    fr_1_gr = cv2.cvtColor(fr_1, cv2.COLOR_BGR2GRAY)
+    fr_2_gr = cv2.cvtColor(fr_2, cv2.COLOR_BGR2GRAY)
+
+    fu, fv, bu, bv = optflow_fn.compute_bidir(fr_1_gr, fr_2_gr)
+
+    # the interpolators take uint8 frames and normalize them themselves
+    if out is None and storage == 'float32':
+        return interpolate_fn(fr_1, fr_2, fu, fv, bu, bv, int_each_go)
+    # stored flows are converted back by the interpolators, on the device if
+    # they can
+    fu, fv, bu, bv = [pack_flow(x, storage) for x in (fu, fv, bu, bv)]
+    return interpolate_fn(fr_1, fr_2, fu, fv, bu, bv, int_each_go, out,
+                          stored_flow_scale(storage))
+
+
+class Job(object):
+    # the frames interpolated for one pair, available with get()
+    def __init__(self, frs=None, async_result=None):
+        self.frs = frs
+        self.async_result = async_result
+
+    def get(self):
+        if self.frs is None:
+            self.frs, secs = self.async_result.get()
+        return self.frs
+
+
+class InlineWorkers(object):
+    # interpolates each pair as soon as it's submitted, in this process. with
+    # a pool, interpolated frames are written into buffers taken from it
+    window = 1
+
+    def __init__(self, optflow_fn, interpolate_fn, pool=None):
+        self.optflow_fn = optflow_fn
+        self.interpolate_fn = interpolate_fn
+        self.pool = pool
+        self.storage = settings['flow_storage']
+
+    def submit(self, fr_1, fr_2, int_each_go):
+        out = None
+        if self.pool is not None and int_each_go > 0:
+            out = [self.pool.get(fr_1.shape) for x in range(int_each_go)]
+        return Job(frs=interpolate_pair(self.optflow_fn, self.interpolate_fn,
+                                        fr_1, fr_2, int_each_go, out,
+                                        self.storage))
+
+    def close(self):
+        pass
+
+
+# state of a worker process, set once by init_worker
+worker_state = {}
+
+
+def init_worker(device, optflow_fn, clbdir, ocv_threads, flow_storage):
+    # a device of None runs on the cpu
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # parent handles ctrl+c
+    from butterflow import ocl, motion
+    from butterflow.interpolate import vec_interpolate_flow
+    ocl.set_num_threads(ocv_threads)
+    worker_state['flow_storage'] = flow_storage
+    if device is None:
+        worker_state['optflow_fn'] = optflow_fn.on_cpu()
+        worker_state['interpolate_fn'] = vec_interpolate_flow
+    else:
+        ocl.set_cache_path(clbdir + os.sep)
+        ocl.select_ocl_device(device)
+        worker_state['optflow_fn'] = optflow_fn
+        worker_state['interpolate_fn'] = motion.ocl_interpolate_flow
+
+
+def run_in_worker(fr_1, fr_2, int_each_go):
+    # returns the frames and the seconds it took to make them
+    t = time.time()
+    frs = interpolate_pair(worker_state['optflow_fn'],
+                           worker_state['interpolate_fn'],
+                           fr_1, fr_2, int_each_go,
+                           storage=worker_state['flow_storage'])
+    return frs, time.time() - t
+
+
+def worker_flow_counts():
+    # how many backward flows were estimated and computed in this worker
+    optflow_fn = worker_state['optflow_fn']
+    return getattr(optflow_fn, 'estimated', 0), \
+        getattr(optflow_fn, 'fallbacks', 0)
+
+
+class DeviceWorker(object):
+    # a single process bound to one OpenCL device, or the cpu if the device
+    # is None
+    def __init__(self, device, optflow_fn, clbdir=None):
+        if clbdir is None:
+            clbdir = settings['clbdir']
+        self.device = device
+        self.pool = multiprocessing.Pool(
+            1, init_worker, (device, optflow_fn, clbdir,
+                             settings['ocv_threads'],
+                             settings['flow_storage']))
+        self.in_flight = 0
+        self.done = 0
+        self.busy_secs = 0.0
+        self.latency = None  # moving average of seconds per pair
+        self.lock = threading.Lock()
+
+    @property
+    def label(self):
+        if self.device is None:
+            return 'CPU'
+        return 'Device {}'.format(self.device)
+
+    def on_done(self, result):  # called from the pool's result thread
+        frs, secs = result
+        with self.lock:
+            self.in_flight -= 1
+            self.done += 1
+            self.busy_secs += secs
+            if self.latency is None:
+                self.latency = secs
+            else:
+                alpha = settings['latency_smoothing']
+                self.latency = alpha * secs + (1 - alpha) * self.latency
+
+    def submit(self, fr_1, fr_2, int_each_go):
+        with self.lock:
+            self.in_flight += 1
+        return Job(async_result=self.pool.apply_async(
+            run_in_worker, (fr_1, fr_2, int_each_go), callback=self.on_done))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def terminate(self):
+        self.pool.terminate()
+
+
+class DeviceWorkers(object):
+    # spreads pairs across one worker process per device. a device can be
+    # listed more than once to run several contexts on it and a device of None
+    # adds a worker that runs on the cpu
+    def __init__(self, devices, optflow_fn, clbdir=None):
+        if len(devices) == 0:
+            raise ValueError('No devices to render with')
+        self.optflow_fn = optflow_fn
+        self.workers = []
+        for device in devices:
+            worker = DeviceWorker(device, optflow_fn, clbdir)
+            log.info('[Subprocess] Starting a worker on: %s', worker.label)
+            self.workers.append(worker)
+        # keep every worker busy with one pair while another one is queued
+        self.window = settings['pairs_per_worker'] * len(self.workers)
+
+    def expected_secs(self, worker):
+        # when the worker would finish a pair submitted now. workers that
+        # haven't finished a pair yet are assumed to be as fast as the others
+        # so that each gets measured
+        latencies = [x.latency for x in self.workers if x.latency is not None]
+        latency = worker.latency
+        if latency is None:
+            latency = sum(latencies) / len(latencies) if latencies else 1.0
+        return (worker.in_flight + 1) * latency
+
+    def submit(self, fr_1, fr_2, int_each_go):
+        worker = min(self.workers, key=self.expected_secs)
+        return worker.submit(fr_1, fr_2, int_each_go)
+
+    def close(self):
+        for worker in self.workers:
+            log.info('[Subprocess] %s interpolated %d pairs, %.1f ms/pair',
+                     worker.label, worker.done,
+                     worker.busy_secs * 1000 / max(1, worker.done))
+            if hasattr(self.optflow_fn, 'estimated'):
+                estimated, fallbacks = worker.pool.apply(worker_flow_counts)
+                self.optflow_fn.estimated += estimated
+                self.optflow_fn.fallbacks += fallbacks
+            worker.close()
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.terminate()
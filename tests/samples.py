@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# sample data shared by the tests
+
+import subprocess
+import numpy as np
+from butterflow.settings import default as settings
+
+def mk_sample_frames(n, w, h):
+    # n random bgr frames, the same ones every time
+    np.random.seed(0)
+    return [np.array(np.random.rand(h, w, 3) * 255, dtype=np.uint8)
+            for x in range(n)]
+
+def mk_sample_video(dest, duration):
+    call = [
+        settings['avutil'],
+        '-loglevel', 'error',
+        '-y',
+        '-f', 'lavfi',
+        '-i', 'testsrc=duration={}:size=320x240:rate=30'.format(duration),
+        '-pix_fmt', 'yuv420p',
+        dest]
+    if subprocess.call(call) == 1:
+        raise RuntimeError
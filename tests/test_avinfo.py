@@ -88,6 +88,20 @@ class AvInfoTestCase(unittest.TestCase):
         self.assertEqual(av['rate_d'], 1001)
         self.assertEqual(av['frames'], 30*1000.0/1001 * 3.003)
 
+    def test_get_av_info_codec_parameters(self):
+        testfile = os.path.join(settings['tempdir'],
+                                'test_get_av_info_video_rational_rate.mp4')
+        mk_sample_video(testfile, 2, 640, 360, fractions.Fraction(24, 1))
+        av = avinfo.get_av_info(testfile)
+        self.assertNotEqual(av['profile'], '')
+        self.assertGreater(av['level'], 0)
+        self.assertGreater(av['tb_n'], 0)
+        self.assertGreater(av['tb_d'], 0)
+        self.assertEqual(len(av['extradata']) % 2, 0)
+        int(av['extradata'], 16)  # hex
+        self.assertEqual(avinfo.get_av_info(testfile)['extradata'],
+                         av['extradata'])
+
     def test_get_av_info_w_h_sar_unknown(self):
         testfile = os.path.join(settings['tempdir'],
                                 'test_get_av_info_w_h_sar_unknown.mp4')
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow import flow
+from butterflow.batch import read_manifest, ManifestError, Session
+
+def mk_manifest(name, text):
+    path = os.path.join(settings['tempdir'], name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+class ReadManifestTestCase(unittest.TestCase):
+    def test_lines(self):
+        path = mk_manifest('test_batch_lines.txt',
+                           '# comment\n'
+                           '-r 60 -o a.mp4 a.mp4\n'
+                           '\n'
+                           '-s "a=0,b=1,spd=0.5" -o "b c.mp4" b.mp4  # slow\n')
+        self.assertEqual(read_manifest(path),
+                         [(2, ['-r', '60', '-o', 'a.mp4', 'a.mp4']),
+                          (4, ['-s', 'a=0,b=1,spd=0.5', '-o', 'b c.mp4',
+                               'b.mp4'])])
+
+    def test_bad_line(self):
+        path = mk_manifest('test_batch_bad_line.txt',
+                           '-o a.mp4 a.mp4\n-o "b.mp4 b.mp4\n')
+        with self.assertRaisesRegexp(ManifestError, 'line 2'):
+            read_manifest(path)
+
+    def test_json(self):
+        path = mk_manifest('test_batch.json', json.dumps(
+            ['-r 60 -o a.mp4 a.mp4', ['-o', 'b c.mp4', 'b.mp4']]))
+        self.assertEqual(read_manifest(path),
+                         [(1, ['-r', '60', '-o', 'a.mp4', 'a.mp4']),
+                          (2, ['-o', 'b c.mp4', 'b.mp4'])])
+
+    def test_json_bad_job(self):
+        path = mk_manifest('test_batch_bad_job.json', json.dumps(
+            ['-o a.mp4 a.mp4', {'o': 'b.mp4'}]))
+        with self.assertRaisesRegexp(ManifestError, 'job 2'):
+            read_manifest(path)
+
+    def test_json_not_a_list(self):
+        path = mk_manifest('test_batch_not_a_list.json', '{}')
+        with self.assertRaises(ManifestError):
+            read_manifest(path)
+
+class SessionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.terminate()
+
+    def test_reuses_workers(self):
+        a = self.session.workers([None], flow.get_backend('bm'))
+        b = self.session.workers([None], flow.get_backend('bm'))
+        self.assertIs(a, b)
+
+    def test_new_workers_for_other_params(self):
+        a = self.session.workers([None], flow.get_backend('bm'))
+        b = self.session.workers([None], flow.get_backend('bm', radius=3))
+        c = self.session.workers([None, None], flow.get_backend('bm'))
+        self.assertIsNot(a, b)
+        self.assertIsNot(a, c)
+        self.assertEqual(len(self.session.pools), 3)
+
+if __name__ == '__main__':
+    unittest.main()
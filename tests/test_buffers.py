@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+from butterflow.buffers import FramePool
+
+class FramePoolTestCase(unittest.TestCase):
+    def test_get_allocates(self):
+        pool = FramePool(2)
+        buf = pool.get((4, 6, 3))
+        self.assertEqual(buf.shape, (4, 6, 3))
+        self.assertEqual(buf.dtype, np.uint8)
+        self.assertEqual(pool.allocated, 1)
+
+    def test_put_then_get_reuses(self):
+        pool = FramePool(2)
+        buf = pool.get((4, 6, 3))
+        pool.put(buf)
+        self.assertIs(pool.get((4, 6, 3)), buf)
+        self.assertEqual(pool.reused, 1)
+
+    def test_shapes_kept_apart(self):
+        pool = FramePool(2)
+        buf = pool.get((4, 6, 3))
+        pool.put(buf)
+        self.assertIsNot(pool.get((2, 3, 3)), buf)
+        self.assertIsNot(pool.get((4, 6, 3), np.float32), buf)
+
+    def test_capacity(self):
+        pool = FramePool(1)
+        bufs = [pool.get((4, 6, 3)) for x in range(3)]
+        for x in bufs:
+            pool.put(x)
+        self.assertIs(pool.get((4, 6, 3)), bufs[0])
+        self.assertIsNot(pool.get((4, 6, 3)), bufs[1])
+
+    def test_put_none(self):
+        pool = FramePool(1)
+        pool.put(None)
+        self.assertEqual(len(pool.free), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow.cli import sequence_from_file, sequence_from_input_str, \
+    mk_parser, stream_copy_problem, stream_params_problem
+
+def mk_file(name, text):
+    path = os.path.join(settings['tempdir'], name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+def user_subs(seq):
+    return [(x.ta, x.tb, x.fa, x.fb) for x in seq.subregions if not x.skip]
+
+class SubregionsFileTestCase(unittest.TestCase):
+    def test_csv(self):
+        path = mk_file('test_cli.csv',
+                       'a,b,spd\n'
+                       '0:01,0:02,0.25\n'
+                       '3,end,0.5\n')
+        seq = sequence_from_file(path, 10000, 300)
+        self.assertEqual(user_subs(seq), [(1000, 2000, 30, 60),
+                                          (3000, 10000, 90, 299)])
+        self.assertEqual(seq.subregions[1].target_spd, 0.25)
+
+    def test_json(self):
+        path = mk_file('test_cli.json', json.dumps([
+            {'fa': 30, 'fb': 60, 'fps': '24/1.001'},
+            {'a': 0.5, 'b': '0.9', 'dur': 2}]))
+        seq = sequence_from_file(path, 10000, 300)
+        self.assertEqual(user_subs(seq), [(500, 900, 15, 27),
+                                          (1000, 2000, 30, 60)])
+        self.assertEqual(seq.subregions[1].target_dur, 2000)
+        self.assertAlmostEqual(seq.subregions[3].target_fps, 23.976, 3)
+
+    def test_overlap_names_rows(self):
+        path = mk_file('test_cli_overlap.csv',
+                       'a,b,spd\n'
+                       '5,6,1\n'
+                       '0:01,0:02,0.25\n'
+                       '1.5,2.5,0.5\n')
+        with self.assertRaisesRegexp(ValueError, 'rows 3 and 4'):
+            sequence_from_file(path, 10000, 300)
+
+    def test_bad_rows(self):
+        for text, row in [('a,b,spd\n1,2,1\n2,1,1\n', 'row 3'),
+                          ('a,b,spd\n1,2\n', 'row 2'),
+                          ('a,b,spd,fps\n1,2,1,30\n', 'row 2'),
+                          ('fa,fb,spd\n0,300,1\n', 'row 2'),
+                          ('a,b,spd\n1,2,1,1\n', 'row 2'),
+                          ('a,b,spd\n1,20,1\n', 'row 2')]:
+            path = mk_file('test_cli_bad.csv', text)
+            with self.assertRaisesRegexp(ValueError, row):
+                sequence_from_file(path, 10000, 300)
+        path = mk_file('test_cli_bad.json', json.dumps([{'a': 1, 'b': 2,
+                                                         'spd': 1}, [1, 2]]))
+        with self.assertRaisesRegexp(ValueError, 'row 2'):
+            sequence_from_file(path, 10000, 300)
+
+class SubregionsStrTestCase(unittest.TestCase):
+    def test_times(self):
+        seq = sequence_from_input_str('a=0:01,b=2,spd=0.5:a=9,b=end,fps=60',
+                                      10000, 300)
+        self.assertEqual(user_subs(seq), [(1000, 2000, 30, 60),
+                                          (9000, 10000, 270, 299)])
+        seq = sequence_from_input_str('full,dur=20', 10000, 300)
+        self.assertEqual(user_subs(seq), [(0, 10000, 0, 299)])
+
+    def test_frames(self):
+        seq = sequence_from_input_str('fa=7,fb=21,spd=0.5:fa=21,fb=end,spd=1'
+                                      ':a=0.1,b=0.2,spd=1', 3000, 30)
+        self.assertEqual([(x.fa, x.fb) for x in seq.subregions if
+                          not x.skip], [(1, 2), (7, 21), (21, 29)])
+        self.assertEqual(seq.subregions[3].tb, 2100)
+        self.assertEqual(seq.subregions[4].tb, 3000)
+
+    def test_bad(self):
+        for s in ['fa=1,spd=1', 'fa=1,fb=30,spd=1', 'fa=5,fb=2,spd=1',
+                  'a=1,fb=2,spd=1']:
+            with self.assertRaises((ValueError, AttributeError)):
+                sequence_from_input_str(s, 3000, 30)
+
+class StreamCopyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.av_info = {'v_codec': 'h264', 'pix_fmt': 'yuv420p', 'w': 640,
+                        'h': 360, 'rate': 30.0}
+        self.table = object()  # only the lack of one matters
+
+    def problem(self, argv, w=640, h=360, rate=30.0, table=True):
+        args = mk_parser().parse_args(['-cs'] + argv + ['a.mp4'])
+        return stream_copy_problem(args, self.av_info,
+                                   self.table if table else None, w, h, rate)
+
+    def test_can_copy(self):
+        self.assertIsNone(self.problem(['-s', 'a=1,b=2,spd=0.5']))
+
+    def test_cant_copy(self):
+        self.assertIn('keyframes', self.problem([], table=False))
+        self.assertIn('scaled', self.problem([], w=320, h=180))
+        self.assertIn('rate', self.problem([], rate=60.0))
+        self.assertIn('lossless', self.problem(['-l']))
+        self.assertIn('drawn', self.problem(['-m']))
+        self.av_info['v_codec'] = 'vp9'
+        self.assertIn('vp9', self.problem([]))
+
+class StreamParamsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.av_info = {'profile': 'High', 'level': 42, 'tb_n': 1,
+                        'tb_d': 15360, 'sar_n': 1, 'sar_d': 1,
+                        'extradata': '0164002affe1'}
+        self.enc_info = dict(self.av_info)
+
+    def test_same_params(self):
+        self.assertIsNone(stream_params_problem(self.av_info, self.enc_info))
+
+    def test_different_params(self):
+        for k, v, reason in [('profile', 'Main', 'profile'),
+                             ('level', 31, 'level'),
+                             ('tb_d', 90000, 'time base'),
+                             ('sar_n', 4, 'aspect ratio'),
+                             ('extradata', '014d401fffe1', 'extradata')]:
+            enc_info = dict(self.enc_info)
+            enc_info[k] = v
+            self.assertIn(reason,
+                          stream_params_problem(self.av_info, enc_info))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow.sequence import Subregion
+from butterflow import draw, flow
+
+class OverlayTestCase(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        self.fr = np.array(np.random.rand(720, 1280, 3) * 255,
+                           dtype=np.uint8)
+        self.overlay = draw.Overlay('stroke', 24.0,
+                                    flow.get_backend('farneback'))
+        self.sub = Subregion(0, 1000)
+        self.sub.fa = 0
+        self.sub.fb = 24
+        self.sub.target_spd = 1.0
+
+    def debug_text(self, fr, frs_written):
+        self.overlay.debug_text(fr, frs_written, 0, 1, 0, 'SOURCE', False,
+                                48, frs_written, self.sub, 1, 1, 0, 0, 1, 0,
+                                0, 0)
+
+    def test_debug_text_draws(self):
+        fr = self.fr.copy()
+        self.debug_text(fr, 1)
+        self.assertFalse(np.array_equal(fr, self.fr))
+
+    def test_restore(self):
+        fr = self.fr.copy()
+        self.overlay.save()
+        self.debug_text(fr, 1)
+        self.overlay.marker(fr)
+        self.overlay.restore(fr)
+        self.assertTrue(np.array_equal(fr, self.fr))
+
+    def test_only_changed_lines_are_rasterized(self):
+        self.debug_text(self.fr.copy(), 1)
+        sprites = dict((k, v[2]) for k, v in self.overlay.lines.items())
+        self.debug_text(self.fr.copy(), 2)
+        changed = [k for k, v in self.overlay.lines.items()
+                   if v[2] is not sprites[k]]
+        self.assertGreater(len(changed), 0)
+        self.assertLess(len(changed), len(sprites))
+        self.assertIn(('l', 0), sprites)
+        self.assertNotIn(('l', 0), changed)  # the header
+
+    def test_marker(self):
+        fr = self.fr.copy()
+        self.overlay.marker(fr, fill=True)
+        r = settings['mrk_out_radius']
+        x = 1280 - settings['mrk_r_pad'] - r
+        y = 720 - settings['mrk_d_pad'] - r
+        self.assertTrue(np.array_equal(fr[y, x],
+                        np.array(settings['mrk_fill_color'][:3], np.uint8)))
+        self.assertTrue(np.array_equal(fr[:600], self.fr[:600]))
+
+    def test_too_small_to_draw(self):
+        fr = np.zeros((100, 100, 3), dtype=np.uint8)
+        self.debug_text(fr, 1)
+        self.overlay.marker(fr)
+        self.overlay.progress_bar(fr, 0.5)
+        self.assertFalse(fr.any())
+
+    def test_progress_bar(self):
+        fr = np.zeros((720, 1280, 3), dtype=np.uint8)
+        fr_2 = fr.copy()
+        self.overlay.progress_bar(fr, 0.5)
+        draw.draw_progress_bar(fr_2, 0.5)
+        self.assertTrue(np.array_equal(fr, fr_2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow import avinfo
+from butterflow.encoders import encoder_call, PipeEncoder, SegmentedEncoder
+from tests.samples import mk_sample_frames
+
+class EncoderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frs = mk_sample_frames(25, 64, 48)
+        self.dest = os.path.join(settings['tempdir'],
+                                 'test_encoder_test_case.mp4')
+        self.mk_call = lambda dest, gop=None: \
+            encoder_call(dest, 64, 48, 24, False, gop=gop)
+
+    def tearDown(self):
+        if os.path.exists(self.dest):
+            os.remove(self.dest)
+
+    def _test_encoded(self, encoder):
+        for fr in self.frs:
+            encoder.write(fr)
+        encoder.close()
+        av_info = avinfo.get_av_info(self.dest)
+        self.assertEqual(av_info['frames'], len(self.frs))
+        self.assertEqual(av_info['w'], 64)
+        self.assertEqual(av_info['h'], 48)
+
+    def test_pipe_encoder(self):
+        self._test_encoded(PipeEncoder(self.mk_call(self.dest)))
+
+    def test_segmented_encoder(self):
+        encoder = SegmentedEncoder(self.dest, self.mk_call, 2, 'test',
+                                   gop=4, gops=2)
+        self._test_encoded(encoder)
+        # 25 frames in segments of 8
+        self.assertEqual(len(encoder.files), 4)
+        for x in encoder.files:
+            self.assertFalse(os.path.exists(x))
+
+    def test_segmented_encoder_one_segment(self):
+        encoder = SegmentedEncoder(self.dest, self.mk_call, 2, 'test',
+                                   gop=30, gops=1)
+        self._test_encoded(encoder)
+        self.assertEqual(len(encoder.files), 1)
+
+    def test_segmented_encoders_apart(self):
+        a = SegmentedEncoder(self.dest, self.mk_call, 1, '1-0')
+        b = SegmentedEncoder(self.dest, self.mk_call, 1, '1-1')
+        for x in [a, b]:
+            x.write(self.frs[0])
+        self.assertNotEqual(a.files, b.files)
+        a.abort()
+        b.abort()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import cv2
+import numpy as np
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow.ocl import set_cache_path
+from butterflow import flow
+
+clb_dir = settings['clbdir']
+if not os.path.exists(clb_dir):
+    os.makedirs(clb_dir)
+set_cache_path(clb_dir + os.sep)
+
+def mk_shifted_pair(w, h, dx, dy):
+    # a smooth random texture and a copy of it moved by (dx, dy)
+    np.random.seed(0)
+    noise = np.float32(np.random.rand(h, w) * 255)
+    noise = cv2.GaussianBlur(noise, (0, 0), 2)
+    fr_1 = np.uint8(cv2.normalize(noise, None, 0, 255, cv2.NORM_MINMAX))
+    m = np.float32([[1, 0, dx], [0, 1, dy]])
+    fr_2 = cv2.warpAffine(fr_1, m, (w, h), borderMode=cv2.BORDER_REFLECT)
+    return fr_1, fr_2
+
+class FlowBackendRegistryTestCase(unittest.TestCase):
+    def test_get_backend(self):
+        for name in flow.available_backends():
+            self.assertIsInstance(flow.get_backend(name), flow.FlowBackend)
+
+    def test_get_backend_unknown(self):
+        with self.assertRaises(ValueError):
+            flow.get_backend('unknown')
+
+    def test_builtin_backends_registered(self):
+        self.assertIn('farneback', flow.backends)
+        self.assertIn('dis', flow.backends)
+        self.assertIn('bm', flow.backends)
+
+    def test_params(self):
+        fb = flow.get_backend('farneback', pyr=0.5, levels=3)
+        params = fb.params()
+        self.assertEqual(params['pyr'], 0.5)
+        self.assertEqual(params['levels'], 3)
+
+class FlowBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fr_1_gr, self.fr_2_gr = mk_shifted_pair(320, 240, 3, -2)
+
+    def _test_flow_form(self, u, v):
+        self.assertIsInstance(u, np.ndarray)
+        self.assertIsInstance(v, np.ndarray)
+        self.assertEqual(u.dtype, np.float32)
+        self.assertEqual(v.dtype, np.float32)
+        self.assertEqual(u.shape, (240, 320))
+        self.assertEqual(v.shape, (240, 320))
+
+    def _test_flow_shift(self, u, v):
+        # ignore the borders, compare to the known motion
+        u = u[20:-20,20:-20]
+        v = v[20:-20,20:-20]
+        self.assertAlmostEqual(np.median(u), 3, delta=1)
+        self.assertAlmostEqual(np.median(v), -2, delta=1)
+
+    def test_backends_form(self):
+        for name in flow.available_backends():
+            u, v = flow.get_backend(name).compute(self.fr_1_gr, self.fr_2_gr)
+            self._test_flow_form(u, v)
+
+    def test_compute_bidir_matches_separate_calls(self):
+        for name in flow.available_backends():
+            backend = flow.get_backend(name)
+            fu, fv, bu, bv = backend.compute_bidir(self.fr_1_gr, self.fr_2_gr)
+            fu_2, fv_2 = backend.compute(self.fr_1_gr, self.fr_2_gr)
+            bu_2, bv_2 = backend.compute(self.fr_2_gr, self.fr_1_gr)
+            for x, y in [(fu, fu_2), (fv, fv_2), (bu, bu_2), (bv, bv_2)]:
+                self._test_flow_form(x, y)
+                self.assertTrue(np.allclose(x, y, atol=1e-5))
+
+    def test_sw_farneback_compute_bidir(self):
+        fb = flow.get_backend('farneback', use_ocl=False)
+        fu, fv, bu, bv = fb.compute_bidir(self.fr_1_gr, self.fr_2_gr)
+        self._test_flow_shift(fu, fv)
+        self._test_flow_shift(-bu, -bv)
+
+    def test_sw_farneback_matches_cv2(self):
+        fb = flow.get_backend('farneback', use_ocl=False)
+        u, v = fb.compute(self.fr_1_gr, self.fr_2_gr)
+        sw_flow = cv2.calcOpticalFlowFarneback(
+            self.fr_1_gr, self.fr_2_gr, fb.pyr, fb.levels, fb.winsize,
+            fb.iters, fb.polyn, fb.polys, fb.filt)
+        self.assertTrue(np.array_equal(u, sw_flow[:,:,0]))
+        self.assertTrue(np.array_equal(v, sw_flow[:,:,1]))
+
+    def test_bm_shift(self):
+        u, v = flow.get_backend('bm').compute(self.fr_1_gr, self.fr_2_gr)
+        self._test_flow_shift(u, v)
+
+    @unittest.skipIf(not flow.DisFlow.available(), 'requires OpenCV >= 3.3')
+    def test_dis_shift(self):
+        u, v = flow.get_backend('dis').compute(self.fr_1_gr, self.fr_2_gr)
+        self._test_flow_shift(u, v)
+
+class EstimatedBackwardFlowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fr_1_gr, self.fr_2_gr = mk_shifted_pair(320, 240, 3, -2)
+        self.backend = flow.get_backend('bm')
+
+    def test_invert_flow_constant(self):
+        fu = np.full((240, 320), 3, dtype=np.float32)
+        fv = np.full((240, 320), -2, dtype=np.float32)
+        bu, bv, holes = flow.invert_flow(fu, fv)
+        self.assertEqual(bu.dtype, np.float32)
+        self.assertEqual(bu.shape, (240, 320))
+        self.assertTrue(np.allclose(bu, -3))
+        self.assertTrue(np.allclose(bv, 2))
+        self.assertEqual(holes, 0)
+
+    def test_invert_flow_fills_holes(self):
+        # the right half moves right, opening a gap no pixel lands in
+        fu = np.zeros((240, 320), dtype=np.float32)
+        fu[:,160:] = 8
+        fv = np.zeros((240, 320), dtype=np.float32)
+        bu, bv, holes = flow.invert_flow(fu, fv)
+        self.assertGreater(holes, 0)
+        self.assertFalse(np.isnan(bu).any())
+        self.assertTrue(np.allclose(bu[:,:150], 0))
+        self.assertTrue(np.allclose(bu[:,180:], -8))
+
+    def test_estimates_backward_flow(self):
+        est = flow.EstimatedBackwardFlow(self.backend)
+        fu, fv, bu, bv = est.compute_bidir(self.fr_1_gr, self.fr_2_gr)
+        self.assertEqual(est.estimated, 1)
+        self.assertEqual(est.fallbacks, 0)
+        self.assertAlmostEqual(np.median(bu[20:-20,20:-20]), -3, delta=1)
+        self.assertAlmostEqual(np.median(bv[20:-20,20:-20]), 2, delta=1)
+
+    def test_falls_back_when_inconsistent(self):
+        est = flow.EstimatedBackwardFlow(self.backend, max_err_ratio=0)
+        fu, fv, bu, bv = est.compute_bidir(self.fr_1_gr, self.fr_2_gr)
+        self.assertEqual(est.estimated, 0)
+        self.assertEqual(est.fallbacks, 1)
+        bu_2, bv_2 = self.backend.compute(self.fr_2_gr, self.fr_1_gr)
+        self.assertTrue(np.array_equal(bu, bu_2))
+        self.assertTrue(np.array_equal(bv, bv_2))
+
+    def test_falls_back_on_holes(self):
+        est = flow.EstimatedBackwardFlow(self.backend, max_holes=-1)
+        est.compute_bidir(self.fr_1_gr, self.fr_2_gr)
+        self.assertEqual(est.fallbacks, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import subprocess
+import cv2
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow import frametable, probe
+from butterflow.frametable import FrameTable
+from butterflow.source import OpenCvFrameSource
+
+def mk_sample_video(dest, vf=None, gop=None):
+    if os.path.exists(dest):
+        return
+    call = [
+        settings['avutil'],
+        '-loglevel', 'error',
+        '-y',
+        '-f', 'lavfi',
+        '-i', 'testsrc=duration=2:size=320x240:rate=30']
+    if vf is not None:
+        call.extend(['-vf', vf, '-vsync', 'vfr'])
+    if gop is not None:
+        call.extend(['-g', str(gop)])
+    call.extend(['-pix_fmt', 'yuv420p', dest])
+    if subprocess.call(call) == 1:
+        raise RuntimeError
+
+def decoded_frs(src):
+    capture = cv2.VideoCapture(src)
+    n = 0
+    while capture.grab():
+        n += 1
+    capture.release()
+    return n
+
+class FrameTableTestCase(unittest.TestCase):
+    def setUp(self):
+        # frames shown for 10, 30, 10 and 50ms
+        self.table = FrameTable([0, 10, 40, 50], [0, 2], 100)
+
+    def test_frames(self):
+        self.assertEqual(self.table.frames, 4)
+
+    def test_fr_at(self):
+        self.assertEqual(self.table.fr_at(-1), 0)
+        self.assertEqual(self.table.fr_at(0), 0)
+        self.assertEqual(self.table.fr_at(10), 1)
+        self.assertEqual(self.table.fr_at(39.9), 1)
+        self.assertEqual(self.table.fr_at(40), 2)
+        self.assertEqual(self.table.fr_at(1000), 3)
+
+    def test_keyframe_before(self):
+        self.assertEqual(self.table.keyframe_before(0), 0)
+        self.assertEqual(self.table.keyframe_before(1), 0)
+        self.assertEqual(self.table.keyframe_before(2), 2)
+        self.assertEqual(self.table.keyframe_before(3), 2)
+
+    def test_dict_round_trip(self):
+        table = FrameTable.from_dict(self.table.to_dict())
+        self.assertEqual(table.pts, self.table.pts)
+        self.assertEqual(table.keyframes, self.table.keyframes)
+        self.assertEqual(table.duration, self.table.duration)
+
+class GetFrameTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cfr = os.path.join(settings['tempdir'],
+                                'test_frame_table_test_case_cfr.mp4')
+        # drops every third frame, so frames are shown for 1/30 or 2/30s
+        self.vfr = os.path.join(settings['tempdir'],
+                                'test_frame_table_test_case_vfr.mp4')
+        mk_sample_video(self.cfr, gop=12)
+        mk_sample_video(self.vfr, vf='select=mod(n\\,3)')
+
+    def test_cfr(self):
+        table = frametable.get_fr_table(self.cfr)
+        self.assertEqual(table.frames, 60)
+        self.assertEqual(table.pts[0], 0)
+        self.assertAlmostEqual(table.pts[1], 1000/30.0, places=0)
+        self.assertEqual(table.keyframes[:2], [0, 12])
+
+    def test_vfr(self):
+        table = frametable.get_fr_table(self.vfr)
+        self.assertEqual(table.frames, decoded_frs(self.vfr))
+        self.assertEqual(table.frames, 40)
+        self.assertAlmostEqual(table.pts[2] - table.pts[1], 2000/30.0,
+                               places=0)
+
+    def test_cached(self):
+        frametable.get_fr_table(self.cfr)
+        path = probe.cache_path(probe.cache_key(self.cfr), 'frames')
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(frametable.get_fr_table(self.cfr).pts,
+                         frametable.get_fr_table(self.cfr).pts)
+
+    def test_seeks_match_without_table(self):
+        table = frametable.get_fr_table(self.cfr)
+        src = OpenCvFrameSource(self.cfr)
+        src_2 = OpenCvFrameSource(self.cfr, table)
+        src.open()
+        src_2.open()
+        for idx in [0, 3, 4, 13, 11, 30, 31, 59]:
+            src.seek_to_fr(idx)
+            src_2.seek_to_fr(idx)
+            self.assertEqual(src_2.idx, idx)
+            self.assertTrue((src.read() == src_2.read()).all())
+        src.close()
+        src_2.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import numpy as np
+from butterflow.settings import default as settings
+from butterflow.interpolate import vec_interpolate_flow, fr_at_time_step, \
+    fr_at_time_step_vec, time_steps_for_nfrs, pack_flow, unpack_flow, \
+    stored_flow_scale
+
+class VecInterpolateFlowTestCase(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        h, w = 12, 16
+        self.fr_1 = np.float32(np.random.rand(h, w, 3))
+        self.fr_2 = np.float32(np.random.rand(h, w, 3))
+        # flows that reach past the borders
+        self.fu = np.float32((np.random.rand(h, w) - 0.5) * 40)
+        self.fv = np.float32((np.random.rand(h, w) - 0.5) * 40)
+        self.bu = np.float32((np.random.rand(h, w) - 0.5) * 40)
+        self.bv = np.float32((np.random.rand(h, w) - 0.5) * 40)
+
+    def test_fr_at_time_step_matches_naive(self):
+        for ts in [0.25, 0.5, 1/3.0]:
+            fr = fr_at_time_step(self.fr_2, self.fu, self.fv, ts)
+            fr_2 = fr_at_time_step_vec(self.fr_2, self.fu, self.fv, ts)
+            # rounding at exactly .5 px can land on a neighbour
+            self.assertGreater(np.mean(fr == fr_2), 0.99)
+
+    def test_matches_naive(self):
+        frs = vec_interpolate_flow(self.fr_1, self.fr_2, self.fu, self.fv,
+                                   self.bu, self.bv, 3)
+        frs_2 = []
+        for ts in time_steps_for_nfrs(3):
+            nxt = fr_at_time_step(self.fr_2, self.fu, self.fv, ts)
+            prv = fr_at_time_step(self.fr_1, self.bu, self.bv, ts)
+            frs_2.append((((1-ts)*prv + ts*nxt)*255.0).astype(np.uint8))
+        self.assertEqual(len(frs), 3)
+        for x, y in zip(frs, frs_2):
+            self.assertEqual(x.dtype, np.uint8)
+            self.assertEqual(x.shape, (12, 16, 3))
+            self.assertGreater(np.mean(x == y), 0.99)
+
+    def test_uint8_frames(self):
+        fr_1 = np.uint8(np.rint(self.fr_1*255))
+        fr_2 = np.uint8(np.rint(self.fr_2*255))
+        frs = vec_interpolate_flow(fr_1, fr_2, self.fu, self.fv, self.bu,
+                                   self.bv, 3)
+        frs_32 = vec_interpolate_flow(np.float32(fr_1)/255.0,
+                                      np.float32(fr_2)/255.0, self.fu,
+                                      self.fv, self.bu, self.bv, 3)
+        for x, y in zip(frs, frs_32):
+            self.assertEqual(x.dtype, np.uint8)
+            diff = np.abs(np.int16(x) - np.int16(y))
+            self.assertLessEqual(diff.max(), 1)
+
+    def test_out(self):
+        out = [np.zeros(self.fr_1.shape, dtype=np.uint8) for x in range(3)]
+        frs = vec_interpolate_flow(self.fr_1, self.fr_2, self.fu, self.fv,
+                                   self.bu, self.bv, 3)
+        frs_2 = vec_interpolate_flow(self.fr_1, self.fr_2, self.fu, self.fv,
+                                     self.bu, self.bv, 3, out)
+        for x, y, z in zip(frs, frs_2, out):
+            self.assertIs(y, z)
+            self.assertTrue(np.array_equal(x, y))
+
+    def test_return_zero(self):
+        self.assertEqual(len(vec_interpolate_flow(
+            self.fr_1, self.fr_2, self.fu, self.fv, self.bu, self.bv, 0)), 0)
+
+class FlowStorageTestCase(unittest.TestCase):
+    def setUp(self):
+        h, w = 60, 80
+        ys, xs = np.indices((h, w), dtype=np.float32)
+        def smooth(a, b):
+            return np.uint8(127 + 60*np.sin(xs/a) + 60*np.cos(ys/b))
+        self.fr_1 = np.dstack([smooth(5, 7), smooth(6, 4), smooth(3, 9)])
+        self.fr_2 = np.roll(self.fr_1, 3, axis=1)
+        # smooth flows of up to 35px
+        self.flows = [np.float32(20*np.sin(xs/13 + i) + 15*np.cos(ys/11 - i))
+                      for i in range(4)]
+
+    def test_float32_unchanged(self):
+        self.assertIs(pack_flow(self.flows[0], 'float32'), self.flows[0])
+
+    def test_float16_error(self):
+        x = self.flows[0]
+        y = pack_flow(x, 'float16')
+        self.assertEqual(y.dtype, np.float16)
+        err = np.abs(unpack_flow(y) - x)
+        self.assertTrue(np.all(err <= np.abs(x) * 2**-11))
+
+    def test_int16_error(self):
+        x = self.flows[0]
+        y = pack_flow(x, 'int16')
+        self.assertEqual(y.dtype, np.int16)
+        err = np.abs(unpack_flow(y, stored_flow_scale('int16')) - x)
+        self.assertLessEqual(err.max(), 0.5 / settings['flow_fixed_steps'])
+
+    def test_int16_saturates(self):
+        limit = 32767.0 / settings['flow_fixed_steps']
+        x = np.float32([[-limit*2, limit*2]])
+        y = unpack_flow(pack_flow(x, 'int16'), stored_flow_scale('int16'))
+        self.assertAlmostEqual(y[0, 0], -32768.0 / settings['flow_fixed_steps'])
+        self.assertAlmostEqual(y[0, 1], limit)
+
+    def test_interpolation_error(self):
+        # flows that are off by a fraction of a px only move the pixels
+        # whose displacement rounds the other way, and only by one px
+        frs = vec_interpolate_flow(self.fr_1, self.fr_2, *self.flows,
+                                   int_each_go=3)
+        for storage in ['float16', 'int16']:
+            flows = [pack_flow(x, storage) for x in self.flows]
+            frs_2 = vec_interpolate_flow(self.fr_1, self.fr_2, *flows,
+                                         int_each_go=3,
+                                         flow_scale=stored_flow_scale(storage))
+            for x, y in zip(frs, frs_2):
+                diff = np.abs(np.int16(x) - np.int16(y))
+                self.assertLess(np.mean(diff > 0), 0.03)
+                self.assertLess(diff.mean(), 0.25)
+
+if __name__ == '__main__':
+    unittest.main()
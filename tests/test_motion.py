@@ -7,10 +7,12 @@ import cv2
 from cv2 import calcOpticalFlowFarneback as sw_farneback_optical_flow
 import numpy as np
 from butterflow.motion import ocl_farneback_optical_flow, \
-    ocl_interpolate_flow, time_steps_for_nfrs
+    ocl_farneback_optical_flow_bidir, ocl_interpolate_flow, \
+    time_steps_for_nfrs
 from butterflow.ocl import set_cache_path
 
 from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow.interpolate import pack_flow, stored_flow_scale
 
 # but not the clb_dir, make it and set it for testing
 clb_dir = settings['clbdir']
@@ -98,6 +100,25 @@ class OpticalFlowTestCase(unittest.TestCase):
             ocl_farneback_optical_flow(
                 fr_1_gr,fr_2_gr,0.5,3,15,3,7,1.5,False,0))
 
+    def test_farneback_optical_flow_bidir_matches_separate_calls(self):
+        fu,fv,bu,bv = ocl_farneback_optical_flow_bidir(
+            self.fr_1_gr,self.fr_2_gr,0.5,3,15,3,7,1.5,False,0)
+        bu_2,bv_2 = ocl_farneback_optical_flow(
+            self.fr_2_gr,self.fr_1_gr,0.5,3,15,3,7,1.5,False,0)
+        self._test_optical_flow_form(fu,fv)
+        self._test_optical_flow_form(bu,bv)
+        self.assertTrue(np.allclose(fu, self.u, atol=1e-5))
+        self.assertTrue(np.allclose(fv, self.v, atol=1e-5))
+        self.assertTrue(np.allclose(bu, bu_2, atol=1e-5))
+        self.assertTrue(np.allclose(bv, bv_2, atol=1e-5))
+
+    def test_farneback_optical_flow_bidir_refcnt(self):
+        flows = ocl_farneback_optical_flow_bidir(
+            self.fr_1_gr,self.fr_2_gr,0.5,3,15,3,7,1.5,False,0)
+        self.assertEqual(sys.getrefcount(flows), 1+1)
+        for x in flows:
+            self.assertEqual(sys.getrefcount(x), 1+1+1)  # +1 for the list
+
 class InterpolateFlowTestCase(unittest.TestCase):
     def setUp(self):
         img_1 = os.path.join(settings['tempdir'],
@@ -130,6 +151,50 @@ class InterpolateFlowTestCase(unittest.TestCase):
         self.assertEqual(c, 320)
         self.assertEqual(ch, 3)
 
+    def test_ocl_interpolate_flow_uint8(self):
+        # uint8 frames are normalized on the device
+        fr_1 = np.uint8(np.rint(self.fr_1_32*255))
+        fr_2 = np.uint8(np.rint(self.fr_2_32*255))
+        frs = ocl_interpolate_flow(
+            fr_1,fr_2,self.fu,self.fv,self.bu,self.bv,2)
+        frs_32 = self.ocl_inter_method(2)
+        self.assertEqual(len(frs), 2)
+        for x, y in zip(frs, frs_32):
+            self.assertEqual(x.dtype, np.uint8)
+            self.assertEqual(x.shape, y.shape)
+            diff = np.abs(np.int16(x) - np.int16(y))
+            self.assertLessEqual(diff.max(), 1)
+
+    def test_ocl_interpolate_flow_out(self):
+        out = [np.zeros((240, 320, 3), dtype=np.uint8) for x in range(2)]
+        frs = ocl_interpolate_flow(
+            self.fr_1_32,self.fr_2_32,self.fu,self.fv,self.bu,self.bv,2,out)
+        frs_2 = self.ocl_inter_method(2)
+        self.assertEqual(len(frs), 2)
+        for x, y, z in zip(frs, frs_2, out):
+            self.assertIs(x, z)
+            self.assertTrue(np.array_equal(x, y))
+
+    def test_ocl_interpolate_flow_out_wrong_size(self):
+        out = [np.zeros((120, 160, 3), dtype=np.uint8)]
+        with self.assertRaises(ValueError):
+            ocl_interpolate_flow(
+                self.fr_1_32,self.fr_2_32,self.fu,self.fv,self.bu,self.bv,1,
+                out)
+
+    def test_ocl_interpolate_flow_stored_flows(self):
+        # converted on the device, int16 is exact to the fixed step
+        frs = self.ocl_inter_method(2)
+        for storage in ['float16', 'int16']:
+            fu, fv, bu, bv = [pack_flow(x, storage)
+                              for x in (self.fu, self.fv, self.bu, self.bv)]
+            frs_2 = ocl_interpolate_flow(self.fr_1_32, self.fr_2_32, fu, fv,
+                                         bu, bv, 2, None,
+                                         stored_flow_scale(storage))
+            for x, y in zip(frs, frs_2):
+                diff = np.abs(np.int16(x) - np.int16(y))
+                self.assertLess(diff.mean(), 0.5)
+
     def test_ocl_interpolate_flow_count(self):
         self.assertEqual(len(self.ocl_inter_method(1)),1)
         self.assertEqual(len(self.ocl_inter_method(2)),2)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from butterflow.mux import solve_atempo_chain, audio_filter_graph
+
+class AtempoChainTestCase(unittest.TestCase):
+    def test_in_range(self):
+        self.assertEqual(solve_atempo_chain(1.5), [1.5])
+        self.assertEqual(solve_atempo_chain(0.5), [0.5])
+
+    def test_chained(self):
+        for speed in [0.1, 0.25, 3.0, 10.0]:
+            chain = solve_atempo_chain(speed)
+            self.assertGreater(len(chain), 1)
+            self.assertAlmostEqual(reduce(lambda x, y: x*y, chain), speed)
+            for x in chain:
+                self.assertTrue(0.5 <= x <= 2.0)
+
+class AudioFilterGraphTestCase(unittest.TestCase):
+    def test_one_region(self):
+        self.assertEqual(
+            audio_filter_graph([(0, 1500, 1.0)]),
+            '[0:a]atrim=start=0.0:end=1.5,asetpts=PTS-STARTPTS[a0];'
+            '[a0]concat=n=1:v=0:a=1[out]')
+
+    def test_regions(self):
+        graph = audio_filter_graph([(0, 1000, 0.5), (1000, 2000, 4.0)])
+        self.assertEqual(
+            graph,
+            '[0:a]atrim=start=0.0:end=1.0,asetpts=PTS-STARTPTS,atempo=0.5[a0];'
+            '[0:a]atrim=start=1.0:end=2.0,asetpts=PTS-STARTPTS,atempo=2.0,'
+            'atempo=2.0[a1];'
+            '[a0][a1]concat=n=2:v=0:a=1[out]')
+
+    def test_stream(self):
+        graph = audio_filter_graph([(0, 1000, 1.0)], stream='1:a')
+        self.assertTrue(graph.startswith('[1:a]atrim'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import time
+import threading
+import numpy as np
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow.preview import Preview
+
+class PreviewTestCase(unittest.TestCase):
+    def setUp(self):
+        self.fr = np.zeros((720, 1280, 3), dtype=np.uint8)
+        self.release = threading.Event()
+        self.entered = threading.Event()
+        self.displayed = []
+        def display(fr):
+            self.displayed.append((fr.shape, threading.current_thread()))
+            self.entered.set()
+            self.release.wait()  # a display that's stuck
+        self.preview = Preview('test', 1280, 720, display=display)
+        self.preview.start()
+
+    def tearDown(self):
+        self.release.set()
+        self.preview.close()
+
+    def test_show_never_blocks(self):
+        self.preview.interval = 0
+        t = time.time()
+        for x in range(200):
+            self.preview.show(self.fr, x / 200.0)
+        self.assertLess(time.time() - t, 2.0)
+        self.assertLessEqual(len(self.displayed), 1)
+
+    def test_shown_by_the_display_thread(self):
+        self.preview.show(self.fr)
+        self.assertTrue(self.entered.wait(5))
+        self.assertIs(self.displayed[0][1], self.preview.thread)
+
+    def test_latest_frame_wins(self):
+        self.preview.interval = 0
+        self.preview.show(self.fr, 0.1)
+        # the display is now stuck on the first frame
+        self.assertTrue(self.entered.wait(5))
+        fr = np.full((720, 1280, 3), 255, dtype=np.uint8)
+        self.preview.show(self.fr, 0.2)
+        self.preview.show(fr, 0.3)
+        latest, progress = self.preview.latest
+        self.assertEqual(progress, 0.3)
+        self.assertTrue((latest == 255).all())
+
+    def test_downscaled(self):
+        self.preview.show(self.fr)
+        self.assertTrue(self.entered.wait(5))
+        self.assertEqual(self.displayed[0][0],
+                         (self.preview.h, self.preview.w, 3))
+        self.assertLessEqual(self.preview.w, settings['preview_w'])
+
+    def test_rate_capped(self):
+        self.preview.interval = 60
+        for x in range(10):
+            self.preview.show(self.fr)
+        self.assertEqual(self.preview.skipped, 9)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import time
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow import avinfo, probe
+from tests.samples import mk_sample_video
+
+class ProbeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.src = os.path.join(settings['tempdir'],
+                                'test_probe_test_case.mp4')
+        mk_sample_video(self.src, 1)
+        probe._memo.clear()
+
+    def test_matches_get_av_info(self):
+        info = probe.probe(self.src)
+        av_info = avinfo.get_av_info(self.src)
+        for k, v in av_info.items():
+            self.assertEqual(info[k], v)
+
+    def test_stored_on_disk(self):
+        probe.probe(self.src)
+        key = probe.cache_key(self.src)
+        self.assertTrue(os.path.exists(probe.cache_path(key, 'info')))
+        probe._memo.clear()
+        self.assertEqual(probe.load(self.src, 'info')['frames'],
+                         probe.probe(self.src)['frames'])
+
+    def test_returns_copies(self):
+        info = probe.probe(self.src)
+        info['frames'] = -1
+        self.assertNotEqual(probe.probe(self.src)['frames'], -1)
+
+    def test_changed_file_probed_again(self):
+        self.assertEqual(probe.probe(self.src)['frames'], 30)
+        time.sleep(1.1)  # mtimes can have a resolution of a second
+        mk_sample_video(self.src, 2)
+        self.assertEqual(probe.probe(self.src)['frames'], 60)
+
+    def test_bad_entry_ignored(self):
+        key = probe.cache_key(self.src)
+        with open(probe.cache_path(key, 'info'), 'w') as f:
+            f.write('{')
+        self.assertIsNone(probe.load(self.src, 'info'))
+        self.assertEqual(probe.probe(self.src)['frames'], 30)
+
+class CacheKeyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.src = os.path.join(settings['tempdir'], 'test_cache_key.txt')
+        with open(self.src, 'w') as f:
+            f.write('x')
+
+    def tearDown(self):
+        os.remove(self.src)
+
+    def test_sub_second_mtime(self):
+        os.utime(self.src, (1000000000.25, 1000000000.25))
+        key = probe.cache_key(self.src)
+        os.utime(self.src, (1000000000.5, 1000000000.5))
+        self.assertNotEqual(probe.cache_key(self.src), key)
+
+    def test_store_leaves_no_parts(self):
+        before = set(os.listdir(settings['idxdir']))
+        probe.store(self.src, 'test', {'a': 1})
+        key = probe.cache_key(self.src)
+        path = probe.cache_path(key, 'test')
+        after = set(os.listdir(settings['idxdir']))
+        self.assertEqual(after - before, set([os.path.basename(path)]))
+        probe._memo.clear()
+        self.assertEqual(probe.load(self.src, 'test'), {'a': 1})
+        os.remove(path)
+
+if __name__ == '__main__':
+    unittest.main()
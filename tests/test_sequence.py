@@ -1,8 +1,24 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import bisect
 from butterflow.sequence import VideoSequence, Subregion
 
+class FrameTable(object):
+    # like butterflow.frametable.FrameTable, which needs the compiled avinfo
+    def __init__(self, pts, keyframes, duration):
+        self.pts = pts
+        self.keyframes = keyframes
+        self.duration = duration
+        self.frames = len(pts)
+
+    def time_at(self, fr):
+        return self.pts[fr]
+
+    def fr_at(self, time):
+        return max(0, min(bisect.bisect_right(self.pts, time) - 1,
+                          self.frames-1))
+
 class VideoSequenceTestcase(unittest.TestCase):
     def test_relative_pos(self):
         vs = VideoSequence(1,1)
@@ -56,6 +72,18 @@ class VideoSequenceTestcase(unittest.TestCase):
         self.assertEqual(vs.nearest_fr(0), 1-1)
         self.assertEqual(vs.nearest_fr(1.1), 3-1)
 
+    def test_nearest_fr_with_fr_table(self):
+        # frames shown for 10, 30, 10 and 50ms
+        table = FrameTable([0, 10, 40, 50], [0, 2], 100)
+        vs = VideoSequence(100, 4, table)
+        self.assertEqual(vs.nearest_fr(0), 0)
+        self.assertEqual(vs.nearest_fr(9), 0)
+        self.assertEqual(vs.nearest_fr(10), 1)
+        self.assertEqual(vs.nearest_fr(39), 1)
+        self.assertEqual(vs.nearest_fr(45), 2)
+        self.assertEqual(vs.nearest_fr(60), 3)
+        self.assertEqual(vs.nearest_fr(100), 3)
+
     def test_add_subregion(self):
         cnt_skip_subs = lambda x: \
             len([s for s in x.subregions if s.skip])
@@ -131,6 +159,94 @@ class VideoSequenceTestcase(unittest.TestCase):
         self.assertEqual(cnt_usr_subs(vs), 5)
         self.assertEqual(cnt_skip_subs(vs), 0)
 
+    def test_add_subregion_overlaps(self):
+        vs = VideoSequence(1,5)
+        vs.add_subregion(Subregion(0.2,0.6))
+        for a, b in [(0.2,0.6), (0.1,0.3), (0.5,0.7), (0.3,0.4), (0,1),
+                     (0.4,0.4)]:
+            with self.assertRaises(AttributeError):
+                vs.add_subregion(Subregion(a,b))
+        vs.add_subregion(Subregion(0.6,0.6))
+        with self.assertRaises(AttributeError):
+            vs.add_subregion(Subregion(0.6,0.6))
+        self.assertEqual(len(vs.subregions), 4)
+
+    def test_add_subregions(self):
+        subs = [(0.8,1), (0.2,0.4), (0.4,0.6), (0.66,0.66)]
+        vs = VideoSequence(1,5)
+        for a, b in subs:
+            vs.add_subregion(Subregion(a,b))
+        bulk = VideoSequence.from_subregions(
+            1, 5, [Subregion(a,b) for a, b in subs])
+        key = lambda x: [(s.ta, s.tb, s.fa, s.fb, s.skip)
+                         for s in x.subregions]
+        self.assertEqual(key(bulk), key(vs))
+        self.assertEqual([(s.ta, s.tb) for s in bulk.subregions],
+                         [(0,0.2), (0.2,0.4), (0.4,0.6), (0.6,0.66),
+                          (0.66,0.66), (0.66,0.8), (0.8,1)])
+
+    def test_add_subregions_overlaps(self):
+        for subs in [[(0.2,0.6), (0.5,0.7)], [(0.2,0.6), (0.3,0.4)],
+                     [(0.3,0.3), (0.3,0.3)], [(0,1), (0.5,0.5)]]:
+            with self.assertRaises(AttributeError):
+                VideoSequence.from_subregions(
+                    1, 5, [Subregion(a,b) for a, b in subs])
+
+    def test_first_overlap(self):
+        vs = VideoSequence(1,5)
+        vs.add_subregion(Subregion(0.2,0.4))
+        vs.add_subregion(Subregion(0.4,0.6))
+        self.assertIsNone(vs.first_overlap())
+        vs = VideoSequence(1,2)
+        vs.add_subregion(Subregion(0,0.1))
+        vs.add_subregion(Subregion(0.1,0.2))  # both are frame 0
+        a, b = vs.first_overlap()
+        self.assertEqual((a.ta, b.ta), (0,0.1))
+
+    def test_subregion_at_frs(self):
+        table = FrameTable([0, 10, 40, 50], [0, 2], 100)
+        vs = VideoSequence(100, 4, table)
+        a = vs.subregion_at_frs(1, 2)
+        b = vs.subregion_at_frs(2, 3)
+        self.assertEqual((a.ta, a.tb, a.fa, a.fb), (10, 40, 1, 2))
+        self.assertEqual((b.ta, b.tb, b.fa, b.fb), (40, 100, 2, 3))
+        vs.add_subregions([b, a])
+        self.assertEqual([(s.fa, s.fb, s.skip) for s in vs.subregions],
+                         [(0, 1, True), (1, 2, False), (2, 3, False)])
+        for fa, fb in [(-1, 2), (2, 4), (2, 1)]:
+            with self.assertRaises((ValueError, AttributeError)):
+                vs.subregion_at_frs(fa, fb)
+
+    def test_subregion_at_frs_is_not_rounded(self):
+        # 0.1 is not exact, so times from frames can round to the one before
+        vs = VideoSequence(3, 30)
+        sub = vs.subregion_at_frs(7, 29)
+        self.assertEqual(vs.nearest_fr(vs.time_at_fr(7)), 6)
+        vs.check_in_range(sub)
+        self.assertEqual((sub.fa, sub.fb), (7, 29))
+
+    def test_split_for_stream_copy(self):
+        table = FrameTable(range(0, 100, 10), [0, 4, 8], 100)
+        vs = VideoSequence(100, 10, table)
+        vs.add_subregions([vs.subregion_at_frs(1, 2),
+                           vs.subregion_at_frs(9, 9)])
+        key = lambda subs: [(x.ta, x.tb, x.fa, x.fb, x.skip, x.stream_copy)
+                            for x in subs]
+        self.assertEqual(key(vs.split_for_stream_copy()),
+                         [(0, 10, 0, 1, True, False),
+                          (10, 20, 1, 2, False, False),
+                          (20, 40, 2, 4, True, False),
+                          (40, 80, 4, 8, True, True),
+                          (80, 90, 8, 9, True, False),
+                          (90, 100, 9, 9, False, False)])
+        vs = VideoSequence(100, 10, table)
+        vs.add_subregion(vs.subregion_at_frs(2, 3))
+        self.assertEqual(key(vs.split_for_stream_copy())[2:],
+                         [(30, 40, 3, 4, True, False),
+                          (40, 100, 4, 9, True, True)])
+        vs.fr_table = None
+        self.assertEqual(vs.split_for_stream_copy(), vs.subregions)
+
 class SubregionTestCase(unittest.TestCase):
     def setUp(self):
         self.time_intersects = lambda x, y, z, w: \
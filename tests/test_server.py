@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import json
+import time
+import socket
+import httplib
+import threading
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow.server import JobQueue, mk_server, mk_token_file
+
+def parse(argv):
+    if len(argv) == 0:
+        raise ValueError('no video')
+    return argv
+
+class FakeRenderer(object):
+    def __init__(self):
+        self.progress = 0.5
+        self.frs_written = 1
+        self.frs_to_render = 2
+        self.curr_sub_idx = 1
+        self.subs_to_render = 1
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Runner(object):
+    # jobs block until they're released or cancelled
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, job):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        job.renderer = FakeRenderer()
+        self.started.release()
+        while not self.release.is_set() and not job.renderer.cancelled:
+            time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        if job.renderer.cancelled:
+            return 1
+        return 0 if job.args[0] != 'fail' else 1
+
+def wait_for(queue, id, states):
+    for i in range(500):
+        if queue.get(id).state in states:
+            return
+        time.sleep(0.01)
+    raise AssertionError('job {} is {}'.format(id, queue.get(id).state))
+
+class JobQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner()
+        self.queue = JobQueue(parse, self.runner, jobs=2)
+
+    def tearDown(self):
+        self.runner.release.set()
+        self.queue.close()
+
+    def test_runs_jobs(self):
+        self.runner.release.set()
+        a = self.queue.submit(['a.mp4'])
+        b = self.queue.submit(['fail'])
+        wait_for(self.queue, a.id, ['done'])
+        wait_for(self.queue, b.id, ['failed'])
+        self.assertEqual(a.rc, 0)
+        self.assertEqual(b.rc, 1)
+
+    def test_bad_job(self):
+        with self.assertRaises(ValueError):
+            self.queue.submit([])
+        self.assertEqual(len(self.queue.all()), 0)
+
+    def test_concurrency_limit(self):
+        jobs = [self.queue.submit(['a.mp4']) for x in range(4)]
+        self.runner.started.acquire()
+        self.runner.started.acquire()
+        time.sleep(0.05)
+        self.assertEqual([x.state for x in jobs],
+                         ['running', 'running', 'queued', 'queued'])
+        self.runner.release.set()
+        for x in jobs:
+            wait_for(self.queue, x.id, ['done'])
+        self.assertEqual(self.runner.max_running, 2)
+
+    def test_cancel_queued(self):
+        jobs = [self.queue.submit(['a.mp4']) for x in range(3)]
+        self.queue.cancel(jobs[2].id)
+        self.assertEqual(jobs[2].state, 'cancelled')
+        self.runner.release.set()
+        wait_for(self.queue, jobs[1].id, ['done'])
+        self.assertIsNone(jobs[2].started)
+
+    def test_cancel_running(self):
+        job = self.queue.submit(['a.mp4'])
+        self.runner.started.acquire()
+        self.queue.cancel(job.id)
+        wait_for(self.queue, job.id, ['cancelled'])
+        self.assertEqual(job.rc, 1)
+
+    def test_cancel_unknown(self):
+        self.assertIsNone(self.queue.cancel(123))
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.runner = Runner()
+        self.runner.release.set()
+        self.queue = JobQueue(parse, self.runner)
+        self.path = os.path.join(settings['tempdir'], 'test_server.sock')
+        self.server = mk_server(self.path, self.queue)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.queue.close()
+
+    def connect(self):
+        return UnixHTTPConnection(self.path)
+
+    def request(self, method, url, body=None, headers=None):
+        if headers is None:
+            headers = {'Content-Type': 'application/json'}
+        conn = self.connect()
+        conn.request(method, url, body, headers)
+        res = conn.getresponse()
+        dat = json.loads(res.read())
+        conn.close()
+        return res.status, dat
+
+    def test_submit_and_get(self):
+        status, job = self.request('POST', '/jobs',
+                                   json.dumps({'args': '-r 60 a.mp4'}))
+        self.assertEqual(status, 201)
+        self.assertEqual(job['args'], ['-r', '60', 'a.mp4'])
+        wait_for(self.queue, job['id'], ['done'])
+        status, job = self.request('GET', '/jobs/{}'.format(job['id']))
+        self.assertEqual(status, 200)
+        self.assertEqual(job['state'], 'done')
+        self.assertEqual(job['progress'], 0.5)
+        status, jobs = self.request('GET', '/jobs')
+        self.assertEqual([x['id'] for x in jobs], [job['id']])
+
+    def test_bad_job(self):
+        status, dat = self.request('POST', '/jobs', json.dumps({'args': []}))
+        self.assertEqual(status, 400)
+        status, dat = self.request('POST', '/jobs', 'not json')
+        self.assertEqual(status, 400)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.request('GET', '/jobs/9')[0], 404)
+        self.assertEqual(self.request('DELETE', '/jobs/9')[0], 404)
+
+    def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+    def test_needs_json(self):
+        body = json.dumps({'args': 'a.mp4'})
+        status, dat = self.request('POST', '/jobs', body,
+                                   {'Content-Type': 'text/plain'})
+        self.assertEqual(status, 415)
+        status, dat = self.request('POST', '/jobs', body, {})
+        self.assertEqual(status, 415)
+        self.assertEqual(self.queue.all(), [])
+
+    def test_refuses_browsers(self):
+        headers = {'Content-Type': 'application/json',
+                   'Origin': 'http://example.com'}
+        status, dat = self.request('POST', '/jobs',
+                                   json.dumps({'args': 'a.mp4'}), headers)
+        self.assertEqual(status, 403)
+        status, dat = self.request('GET', '/jobs', headers=headers)
+        self.assertEqual(status, 403)
+        self.assertEqual(self.queue.all(), [])
+
+class TokenServerTestCase(ServerTestCase):
+    # a port, where every request needs the token
+    def setUp(self):
+        self.runner = Runner()
+        self.runner.release.set()
+        self.queue = JobQueue(parse, self.runner)
+        self.token_file = os.path.join(settings['tempdir'],
+                                       'test_server.token')
+        self.token = mk_token_file(self.token_file)
+        self.server = mk_server('0', self.queue, self.token)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        ServerTestCase.tearDown(self)
+        os.remove(self.token_file)
+
+    def connect(self):
+        return httplib.HTTPConnection(*self.server.server_address)
+
+    def request(self, method, url, body=None, headers=None):
+        if headers is None:
+            headers = {'Content-Type': 'application/json'}
+        headers = dict(headers)
+        headers.setdefault('Authorization', 'Bearer ' + self.token)
+        return ServerTestCase.request(self, method, url, body, headers)
+
+    def test_socket_is_private(self):
+        with open(self.token_file) as f:
+            self.assertEqual(f.read().strip(), self.token)
+        self.assertEqual(os.stat(self.token_file).st_mode & 0o777, 0o600)
+
+    def test_needs_token(self):
+        for auth in ['', 'Bearer', 'Bearer x' + self.token[1:]]:
+            status, dat = self.request('GET', '/jobs', headers={
+                'Authorization': auth})
+            self.assertEqual(status, 401)
+        status, dat = self.request('POST', '/jobs',
+                                   json.dumps({'args': 'a.mp4'}),
+                                   {'Content-Type': 'application/json',
+                                    'Authorization': ''})
+        self.assertEqual(status, 401)
+        self.assertEqual(self.queue.all(), [])
+
+if __name__ == '__main__':
+    unittest.main()
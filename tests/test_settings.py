@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import sys
+import subprocess
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from tests.samples import mk_sample_video
+
+heavy = ['cv2', 'numpy', 'butterflow.ocl', 'butterflow.motion']
+
+def imported_modules(code):
+    # the heavy modules imported by code, run in a fresh interpreter
+    code += '\nimport sys\nprint("imported:" + ",".join(x for x in {!r} ' \
+            'if x in sys.modules))'.format(heavy)
+    out = subprocess.check_output([sys.executable, '-c', code])
+    line = out.strip().split('\n')[-1]
+    return [x for x in line[len('imported:'):].split(',') if x]
+
+class StartupTestCase(unittest.TestCase):
+    def test_settings_imports_no_opencv(self):
+        self.assertEqual(imported_modules('import butterflow.settings'), [])
+
+    def test_version_imports_no_opencv(self):
+        code = 'import sys\n' \
+               'sys.argv = ["butterflow", "--version"]\n' \
+               'from butterflow.cli import main\n' \
+               'main()'
+        self.assertEqual(imported_modules(code), [])
+
+    def test_probe_imports_no_opencv(self):
+        src = os.path.join(settings['tempdir'], 'test_settings_probe.mp4')
+        mk_sample_video(src, 1)
+        code = 'import sys\n' \
+               'sys.argv = ["butterflow", "--probe", {!r}]\n' \
+               'from butterflow.cli import main\n' \
+               'assert main() == 0'.format(src)
+        self.assertEqual(imported_modules(code), [])
+
+    def test_scalers_match_opencv(self):
+        import cv2
+        self.assertEqual(settings['scaler_up'], cv2.INTER_AREA)
+        self.assertEqual(settings['scaler_dn'], cv2.INTER_CUBIC)
+        self.assertEqual(settings['light_color'], cv2.cv.RGB(255, 255, 255))
+        self.assertEqual(settings['mrk_fill_color'], cv2.cv.RGB(255, 0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -144,5 +144,13 @@ class OpenCvFrameSourceTestCase(unittest.TestCase):
         self.src_1.close()
         self.assertIsNone(self.src_1.capture)
 
+    def test_read_into_out(self):
+        fr = self.src_3.read()
+        self.src_3.seek_to_fr(0)
+        out = np.zeros_like(fr)
+        fr_2 = self.src_3.read(out)
+        self.assertIs(fr_2, out)
+        self.assertTrue(np.array_equal(fr, fr_2))
+
 if __name__ == '__main__':
     unittest.main()
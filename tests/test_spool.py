@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import shutil
+import numpy as np
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow import avinfo, spool
+from butterflow.spool import SpoolWriter, read_spool, encode_spool
+from butterflow.encoders import encoder_call
+from tests.samples import mk_sample_frames
+
+class SpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frs = mk_sample_frames(5, 64, 48)
+        self.spool = os.path.join(settings['tempdir'],
+                                  'test_spool_test_case.spool')
+        self.dest = os.path.join(settings['tempdir'],
+                                 'test_spool_test_case.mp4')
+        writer = SpoolWriter(self.spool, 64, 48, 24.0)
+        for i, fr in enumerate(self.frs):
+            fr_type = 'SOURCE' if i % 2 == 0 else 'INTERPOLATED'
+            writer.write(fr, (fr_type, i // 2, i // 2 + 1, i % 2, False))
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.spool)
+        if os.path.exists(self.dest):
+            os.remove(self.dest)
+
+    def test_read_spool(self):
+        index, frs = read_spool(self.spool)
+        self.assertEqual(index['w'], 64)
+        self.assertEqual(index['h'], 48)
+        self.assertEqual(index['rate'], 24.0)
+        self.assertEqual(frs.shape, (5, 48, 64, 3))
+        for x, y in zip(frs, self.frs):
+            self.assertTrue(np.array_equal(x, y))
+
+    def test_index(self):
+        index, frs = read_spool(self.spool)
+        self.assertEqual(index['frames'][0], ['S', 0, 1, 0, 0])
+        self.assertEqual(index['frames'][1], ['I', 0, 1, 1, 0])
+        self.assertEqual(len(index['frames']), 5)
+
+    def test_unfinished_spool(self):
+        os.remove(os.path.join(self.spool, 'index.json'))
+        with self.assertRaises(RuntimeError):
+            read_spool(self.spool)
+
+    def test_encode_spool(self):
+        self.assertEqual(encode_spool(self.spool, self.dest), 5)
+        self.assertEqual(avinfo.get_av_info(self.dest)['frames'], 5)
+
+    def test_encode_spool_crf(self):
+        # jobs encoding at once don't share crf through the settings
+        crfs = []
+        def call(*args):
+            crfs.append(args[8])
+            return encoder_call(*args)
+        spool.encoder_call = call
+        try:
+            encode_spool(self.spool, self.dest, encoders=2, crf=30)
+        finally:
+            spool.encoder_call = encoder_call
+        self.assertGreater(len(crfs), 0)
+        self.assertEqual(set(crfs), set([30]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import os
+import numpy as np
+
+from butterflow.settings import default as settings  # will mk temp dirs
+from butterflow.ocl import set_cache_path, compat_ocl_devices
+from butterflow.motion import ocl_interpolate_flow
+from butterflow import flow
+from butterflow.workers import interpolate_pair, InlineWorkers, DeviceWorkers
+from tests.samples import mk_sample_frames
+
+clb_dir = settings['clbdir']
+if not os.path.exists(clb_dir):
+    os.makedirs(clb_dir)
+set_cache_path(clb_dir + os.sep)
+
+class InlineWorkersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frs = mk_sample_frames(2, 320, 240)
+        self.optflow_fn = flow.get_backend('farneback')
+
+    def test_submit_matches_interpolate_pair(self):
+        workers = InlineWorkers(self.optflow_fn, ocl_interpolate_flow)
+        frs = workers.submit(self.frs[0], self.frs[1], 2).get()
+        frs_2 = interpolate_pair(self.optflow_fn, ocl_interpolate_flow,
+                                 self.frs[0], self.frs[1], 2)
+        self.assertEqual(len(frs), 2)
+        for x, y in zip(frs, frs_2):
+            self.assertTrue(np.array_equal(x, y))
+
+    def test_window(self):
+        workers = InlineWorkers(self.optflow_fn, ocl_interpolate_flow)
+        self.assertEqual(workers.window, 1)
+
+class CpuWorkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frs = mk_sample_frames(2, 320, 240)
+        self.optflow_fn = flow.get_backend('farneback')
+        self.workers = DeviceWorkers([None], self.optflow_fn)
+
+    def tearDown(self):
+        self.workers.terminate()
+
+    def test_cpu_worker(self):
+        frs = self.workers.submit(self.frs[0], self.frs[1], 2).get()
+        self.workers.close()
+        worker = self.workers.workers[0]
+        self.assertEqual(worker.label, 'CPU')
+        self.assertEqual(worker.done, 1)
+        self.assertIsNotNone(worker.latency)
+        self.assertEqual(len(frs), 2)
+        self.assertEqual(frs[0].dtype, np.uint8)
+
+class SchedulingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workers = DeviceWorkers([None, None], flow.get_backend('bm'))
+
+    def tearDown(self):
+        self.workers.terminate()
+
+    def test_prefers_faster_worker(self):
+        fast, slow = self.workers.workers
+        fast.latency = 0.1
+        slow.latency = 0.4
+        # the fast worker takes pairs until its queue outlasts the slow one
+        for x in range(3):
+            self.assertIs(min(self.workers.workers,
+                              key=self.workers.expected_secs), fast)
+            fast.in_flight += 1
+        fast.in_flight += 1
+        self.assertIs(min(self.workers.workers,
+                          key=self.workers.expected_secs), slow)
+
+    def test_unmeasured_worker_gets_average(self):
+        fast, slow = self.workers.workers
+        fast.latency = 0.2
+        self.assertEqual(self.workers.expected_secs(slow), 0.2)
+
+@unittest.skipIf(len(compat_ocl_devices()) == 0, 'requires an OpenCL device')
+class DeviceWorkersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.frs = mk_sample_frames(5, 320, 240)
+        self.optflow_fn = flow.get_backend('farneback')
+        # two contexts on the same device is enough to test the scheduling
+        device = compat_ocl_devices()[0]
+        self.workers = DeviceWorkers([device, device], self.optflow_fn)
+
+    def tearDown(self):
+        self.workers.terminate()
+
+    def test_window(self):
+        self.assertEqual(self.workers.window,
+                         settings['pairs_per_worker'] * 2)
+
+    def test_no_devices(self):
+        with self.assertRaises(ValueError):
+            DeviceWorkers([], self.optflow_fn)
+
+    def test_results_in_submitted_order(self):
+        inline = InlineWorkers(self.optflow_fn, ocl_interpolate_flow)
+        pairs = zip(self.frs[:-1], self.frs[1:])
+        jobs = [self.workers.submit(x, y, 1) for x, y in pairs]
+        for job, (x, y) in zip(jobs, pairs):
+            frs = job.get()
+            frs_2 = inline.submit(x, y, 1).get()
+            self.assertEqual(len(frs), 1)
+            self.assertTrue(np.allclose(frs[0], frs_2[0], atol=1))
+
+    def test_spreads_pairs(self):
+        jobs = [self.workers.submit(self.frs[0], self.frs[1], 1)
+                for x in range(4)]
+        for job in jobs:
+            job.get()
+        self.workers.close()
+        for worker in self.workers.workers:
+            self.assertGreater(worker.done, 0)
+
+if __name__ == '__main__':
+    unittest.main()